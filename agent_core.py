@@ -13,6 +13,7 @@ from agent_features import (
     CodeReviewTool, SmartCodeConnector, AntiExploitScanner,
     SetupScriptGenerator, AutoTestGenerator, LiveCodeExplainer
 )
+from keyed_locks import locks
 
 # Anthropic Integration Setup
 AI_INTEGRATIONS_ANTHROPIC_API_KEY = os.environ.get("AI_INTEGRATIONS_ANTHROPIC_API_KEY") or "replit_dummy_key"
@@ -881,7 +882,6 @@ class AgentMode:
         self.model_name = model_name
         self.personality = personality
         self.sessions = {}
-        self._locks = {}
         self.splitter = SplitMessageTool()
         self.code_thread = CodeThreadTool()
         self.reader = ReadMessagesTool()
@@ -896,11 +896,6 @@ class AgentMode:
         self.test_gen = AutoTestGenerator(anthropic_client, model_name)
         self.explainer = LiveCodeExplainer(anthropic_client, model_name)
 
-    def _get_lock(self, user_id):
-        if user_id not in self._locks:
-            self._locks[user_id] = asyncio.Lock()
-        return self._locks[user_id]
-
     def is_agent_mode(self, user_id):
         return user_id in self.sessions and self.sessions[user_id].get("active", False)
 
@@ -955,8 +950,7 @@ class AgentMode:
             return f"ERROR: {e}"
 
     async def handle_message(self, message):
-        lock = self._get_lock(message.author.id)
-        async with lock:
+        async with locks.lock("agent", message.author.id):
             await self._handle_message_internal(message)
 
     async def _handle_message_internal(self, message):
@@ -0,0 +1,186 @@
+"""Running server totals for /stats
+
+Keeps the sums and distributions /stats shows (credits, pCredits, levels,
+messages, voice minutes, roles, ranks) up to date as users change, so the
+command reads a handful of numbers instead of scanning every user. The
+state is a plain dict so database.py can persist it like any other
+collection, and a capped history of hourly snapshots lets /stats show how
+the totals moved over time.
+"""
+import time
+
+
+# user field -> total name
+SUM_FIELDS = {
+    "studio_credits": "credits",
+    "pcredits": "pcredits",
+    "level": "levels",
+    "message_count": "messages",
+    "voice_minutes": "voice",
+}
+
+# Totals copied into each history snapshot
+HISTORY_FIELDS = ["users"] + list(SUM_FIELDS.values())
+
+
+def _value(doc, field):
+    if field == "level":
+        return doc.get("level") or 1
+    return doc.get(field) or 0
+
+
+def _roles(doc):
+    roles = doc.get("roles")
+    return roles if isinstance(roles, list) else []
+
+
+def _rank(doc):
+    return doc.get("rank") or "Beginner"
+
+
+def empty_totals():
+    return {
+        "users": 0,
+        "sums": {name: 0 for name in SUM_FIELDS.values()},
+        "roles": {},
+        "ranks": {},
+    }
+
+
+def _bump(histogram, key, delta):
+    count = histogram.get(key, 0) + delta
+    if count:
+        histogram[key] = count
+    else:
+        histogram.pop(key, None)
+
+
+class UserAggregates:
+    """Incrementally maintained user totals + their history"""
+
+    def __init__(self, history_interval: float = 3600, history_size: int = 720):
+        self.history_interval = history_interval
+        self.history_size = history_size
+        self.data = {"totals": empty_totals(), "history": [], "updated_at": None}
+
+    @property
+    def totals(self):
+        return self.data["totals"]
+
+    def load(self, data):
+        """Adopt previously persisted state (ignored if malformed)"""
+        if isinstance(data, dict) and isinstance(data.get("totals"), dict):
+            self.data = {
+                "totals": {**empty_totals(), **data["totals"]},
+                "history": list(data.get("history") or []),
+                "updated_at": data.get("updated_at"),
+            }
+
+    # ---------- maintenance ----------
+    def _count(self, doc, sign):
+        totals = self.totals
+        totals["users"] += sign
+        for field, name in SUM_FIELDS.items():
+            totals["sums"][name] += sign * _value(doc, field)
+        for role in _roles(doc):
+            _bump(totals["roles"], role, sign)
+        _bump(totals["ranks"], _rank(doc), sign)
+
+    def add(self, doc):
+        self._count(doc, 1)
+        self._touch()
+
+    def remove(self, doc):
+        self._count(doc, -1)
+        self._touch()
+
+    def change(self, old, new):
+        """Account for one user going from `old` to `new` (only what differs)"""
+        totals = self.totals
+        changed = False
+        for field, name in SUM_FIELDS.items():
+            delta = _value(new, field) - _value(old, field)
+            if delta:
+                totals["sums"][name] += delta
+                changed = True
+        old_roles, new_roles = _roles(old), _roles(new)
+        if old_roles != new_roles:
+            for role in old_roles:
+                _bump(totals["roles"], role, -1)
+            for role in new_roles:
+                _bump(totals["roles"], role, 1)
+            changed = True
+        old_rank, new_rank = _rank(old), _rank(new)
+        if old_rank != new_rank:
+            _bump(totals["ranks"], old_rank, -1)
+            _bump(totals["ranks"], new_rank, 1)
+            changed = True
+        if changed:
+            self._touch()
+        return changed
+
+    def _touch(self, now: float = None):
+        now = now or time.time()
+        self.data["updated_at"] = now
+        history = self.data["history"]
+        if not history or now - history[-1]["at"] >= self.history_interval:
+            entry = {"at": now, "users": self.totals["users"]}
+            entry.update(self.totals["sums"])
+            history.append(entry)
+            if len(history) > self.history_size:
+                del history[:len(history) - self.history_size]
+
+    # ---------- verification ----------
+    @staticmethod
+    def compute(docs):
+        """Totals for `docs` computed from scratch"""
+        scratch = UserAggregates()
+        for doc in docs:
+            scratch._count(doc, 1)
+        return scratch.totals
+
+    def rebuild(self, docs):
+        """Recompute the totals from every user document
+
+        Returns {total: (kept, recomputed)} for whatever had drifted, so
+        callers can report it. History is kept.
+        """
+        fresh = self.compute(docs)
+        drift = {}
+        for key in ("users", "sums", "roles", "ranks"):
+            if self.totals.get(key) != fresh[key]:
+                drift[key] = (self.totals.get(key), fresh[key])
+        self.data["totals"] = fresh
+        self._touch()
+        return drift
+
+    # ---------- reads ----------
+    def snapshot(self):
+        totals = self.totals
+        users = totals["users"]
+        stats = {"users": users, **totals["sums"]}
+        stats["avg_level"] = round(totals["sums"]["levels"] / max(users, 1), 1)
+        stats["roles"] = dict(totals["roles"])
+        stats["ranks"] = dict(totals["ranks"])
+        return stats
+
+    def delta(self, seconds: float, now: float = None):
+        """How much each history field changed over the last `seconds`
+
+        Compares against the newest snapshot at least that old (or the oldest
+        one kept). Returns None when there is no history to compare with.
+        """
+        now = now or time.time()
+        history = self.data["history"]
+        if not history:
+            return None
+        base = history[0]
+        for entry in reversed(history):
+            if now - entry["at"] >= seconds:
+                base = entry
+                break
+        current = {"users": self.totals["users"], **self.totals["sums"]}
+        return {
+            "since": base["at"],
+            **{field: current[field] - base.get(field, 0) for field in HISTORY_FIELDS},
+        }
@@ -0,0 +1,83 @@
+"""users.json encode/decode: the old pretty-printed format vs the codec
+
+Run from the repository root:
+
+    python benchmarks/json_codec.py [count]
+
+Builds a synthetic users.json of `count` (default 50k) full user records,
+the shape existing files have before the lazy sparse-schema migration, and
+times writing and reading it with:
+
+- the old format: json.dump(indent=4, default=str) / json.load
+- database.json_dumps / json_loads (orjson if installed, else compact stdlib)
+- the same, gzip- and (if zstandard is installed) zstd-compressed
+"""
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+from database import USER_DEFAULTS, json_dumps, json_loads, _user_default  # noqa: E402
+
+
+def build_users(count):
+    users = {}
+    for i in range(count):
+        uid = 100000000000000000 + i
+        doc = {field: _user_default(field) for field in USER_DEFAULTS}
+        doc.update({
+            "_id": uid, "username": f"member{i}", "player_id": f"DEV-{i:06d}-AB12",
+            "created_at": "2026-10-17T12:00:00.000000", "xp": 1200 + i % 5000,
+            "level": 5 + i % 20, "message_count": 300 + i % 900, "voice_minutes": i % 600,
+            "studio_credits": 250 + i % 1000, "duel_wins": i % 25, "last_daily": "2026-10-16T09:30:00",
+        })
+        users[str(uid)] = doc
+    return users
+
+
+def best_of(fn, runs=3):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    users = build_users(count)
+    print(f"{count} users, encoder: {'orjson' if database.orjson else 'stdlib (compact)'}")
+    print(f"{'format':<22} {'size':>9} {'write':>9} {'read':>9}")
+
+    def row(name, write, read):
+        write_s, raw = best_of(write)
+        read_s, loaded = best_of(lambda: read(raw))
+        assert len(loaded) == count
+        print(f"{name:<22} {len(raw) / 2**20:>7.1f}MB {write_s * 1000:>7.0f}ms {read_s * 1000:>7.0f}ms")
+
+    row("indent=4 (old)",
+        lambda: json.dumps(users, indent=4, default=str).encode(),
+        lambda raw: json.loads(raw))
+    row("compact stdlib",
+        lambda: json.dumps(users, separators=(",", ":"), ensure_ascii=False, default=str).encode(),
+        lambda raw: json.loads(raw))
+    row("codec",
+        lambda: json_dumps(users),
+        json_loads)
+    row("codec + gzip",
+        lambda: gzip.compress(json_dumps(users), compresslevel=6),
+        json_loads)
+    if database.zstandard is not None:
+        row("codec + zstd",
+            lambda: database.zstandard.ZstdCompressor(level=3).compress(json_dumps(users)),
+            json_loads)
+
+
+if __name__ == "__main__":
+    main()
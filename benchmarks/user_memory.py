@@ -0,0 +1,97 @@
+"""Memory per 100k in-memory users: plain dicts vs CompactUser
+
+Run from the repository root:
+
+    python benchmarks/user_memory.py [count]
+
+Three profiles are measured: a member who just joined (sparse document:
+identity fields only), an active member (counters from chatting, voice,
+dailies and duels) and a legacy record that still carries every default
+(written before the sparse schema, not yet migrated).
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compact_user import CompactUser  # noqa: E402
+
+USER_DEFAULTS = {
+    "role": None, "roles": [], "rank": "Beginner", "xp": 0, "level": 1,
+    "experience_months": 0, "voice_minutes": 0, "message_count": 0, "reputation": 0,
+    "studio_credits": 10, "pcredits": 0, "ai_credits": 0, "max_teams": 3, "max_projects": 2,
+    "has_agent_mode": False, "has_super_agent": False, "has_premium_badge": False,
+    "has_custom_color": False, "has_team_storage": False, "has_team_banner": False,
+    "has_featured_listing": False, "custom_color": None, "auto_agent_switch": False,
+    "temp_chat_cooldown": None, "last_quest": None, "last_daily": None, "daily_streak": 0,
+    "daily_claims": 0, "portfolio_games": [], "reviews_given": 0, "reviews_received": [],
+    "sales_count": 0, "purchases_count": 0, "claimed_quests": [], "seller_rating": 5.0,
+    "can_sell": True, "duel_wins": 0, "duel_losses": 0, "duel_draws": 0,
+    "duel_credits_won": 0, "duel_credits_lost": 0, "duel_streak": 0, "duel_best_streak": 0,
+    "duel_rank": "Novice Duelist", "duel_title_emoji": "🥉",
+    "duel_powerups": {"shield": 0, "extra_time": 0, "peek": 0, "sabotage": 0, "reroll": 0},
+    "bughunt_wins": 0, "bughunt_games": 0, "bughunt_bugs_found": 0,
+    "bughunt_powerups": {"hint": 0, "time_freeze": 0, "auto_find": 0, "shield": 0,
+                         "bug_bomb": 0, "reveal": 0},
+}
+
+
+def new_member(i):
+    return {
+        "_id": 100000000000000000 + i,
+        "username": f"member{i}",
+        "player_id": f"DEV-{i:06d}-AB12",
+        "studio_credits": 10,
+        "created_at": "2026-10-17T12:00:00.000000",
+        "schema_version": 2,
+    }
+
+
+def active_member(i):
+    doc = new_member(i)
+    doc.update({
+        "rank": "Intermediate", "xp": 1200 + i % 5000, "level": 5 + i % 20,
+        "message_count": 300 + i % 900, "voice_minutes": 45 + i % 600,
+        "studio_credits": 250 + i % 1000, "pcredits": i % 7, "reputation": i % 40,
+        "daily_streak": i % 30, "daily_claims": i % 90, "last_daily": "2026-10-16T09:30:00",
+        "duel_wins": i % 25, "duel_losses": i % 19, "duel_streak": i % 4,
+        "duel_best_streak": i % 9, "duel_credits_won": i % 400,
+    })
+    return doc
+
+
+def legacy_member(i):
+    doc = {key: (value.copy() if isinstance(value, (dict, list)) else value)
+           for key, value in USER_DEFAULTS.items()}
+    doc.update(active_member(i))
+    del doc["schema_version"]
+    return doc
+
+
+def measure(build, wrap, count):
+    docs = [build(i) for i in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = {doc["_id"]: wrap(doc) for doc in docs}
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del docs
+    return store, after - before
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"{count} users, bytes held by _memory_users (values shared with the source docs excluded)")
+    print(f"{'profile':<10} {'dict':>12} {'CompactUser':>12} {'saved':>8}   per user")
+    for name, build in [("new", new_member), ("active", active_member), ("legacy", legacy_member)]:
+        # dict(doc) re-creates the container like a JSON load would; values are shared
+        _, plain = measure(build, dict, count)
+        _, compact = measure(build, CompactUser, count)
+        saved = 1 - compact / plain
+        print(f"{name:<10} {plain / 2**20:>10.1f}MB {compact / 2**20:>10.1f}MB {saved:>7.0%}"
+              f"   {plain // count}B -> {compact // count}B")
+
+
+if __name__ == "__main__":
+    main()
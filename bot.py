@@ -1,9 +1,16 @@
 import discord
 from discord.ext import commands
 import os
+import time
 import asyncio
-from config import DISCORD_TOKEN, GUILD_ID
-from database import UserProfile
+from config import (
+    DISCORD_TOKEN, GUILD_ID, ACTIVITY_FLUSH_SECONDS, PRELOAD_DATA, MIGRATE_ON_STARTUP, DIAGNOSTICS_LOG_SECONDS,
+)
+from database import (
+    UserProfile, start_write_behind, shutdown_storage, ensure_indexes, leaderboards, listing_index,
+    duel_index, load_collections, ttl_sweeper, migration_runner, user_cache, mongo_breaker,
+)
+from keyed_locks import locks
 from datetime import datetime
 
 # Intents configuration
@@ -14,6 +21,77 @@ intents.voice_states = True
 intents.dm_messages = True  # ADD THIS for DM support
 
 
+class ActivityAccumulator:
+    """Collects message/voice activity in memory and writes it in batches
+
+    Chat and voice events only bump per-user counters here; every
+    ACTIVITY_FLUSH_SECONDS the pending deltas go out as one bulk write
+    (levels are recomputed at flush time by UserProfile.bulk_increment).
+    """
+
+    def __init__(self, interval: float = ACTIVITY_FLUSH_SECONDS):
+        self.interval = interval
+        self._pending = {}  # user_id -> {field: delta}
+        self._task = None
+        self.stats = {"accumulated": 0, "flushed": 0, "flushes": 0, "users_flushed": 0}
+
+    def _add(self, user_id: int, **deltas):
+        entry = self._pending.setdefault(user_id, {})
+        for field, delta in deltas.items():
+            entry[field] = entry.get(field, 0) + delta
+        self.stats["accumulated"] += 1
+
+    def add_message(self, user_id: int, xp: int = 5):
+        self._add(user_id, message_count=1, xp=xp)
+
+    def add_voice(self, user_id: int, minutes: int):
+        # 1 XP per voice minute, max 60 per session
+        self._add(user_id, voice_minutes=minutes, xp=min(minutes, 60))
+
+    @property
+    def pending_events(self):
+        return self.stats["accumulated"] - self.stats["flushed"]
+
+    async def flush(self):
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        events = self.pending_events
+        try:
+            users = await UserProfile.bulk_increment(batch)
+        except Exception as e:
+            print(f"✗ Activity flush failed: {e}")
+            # put the batch back so nothing is lost
+            for user_id, deltas in batch.items():
+                entry = self._pending.setdefault(user_id, {})
+                for field, delta in deltas.items():
+                    entry[field] = entry.get(field, 0) + delta
+            return 0
+        self.stats["flushed"] += events
+        self.stats["flushes"] += 1
+        self.stats["users_flushed"] += users
+        return users
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
 class StudioBot(commands.Bot):
     """Main Discord Bot Class"""
 
@@ -29,9 +107,63 @@ class StudioBot(commands.Bot):
         self.guild_id = GUILD_ID
         self._voice_times = {}
         self._synced = False
+        self.activity_buffer = ActivityAccumulator()
+        self._diagnostics_task = None
+
+    def diagnostics(self):
+        """One line per in-process counter group, for the periodic log"""
+        activity = self.activity_buffer.stats
+        cache = user_cache.info()
+        lines = [
+            f"activity: {activity['accumulated']} events, {self.activity_buffer.pending_events} pending, "
+            f"{activity['flushes']} flushes, {activity['users_flushed']} user writes",
+            f"user cache: {cache['size']}/{cache['max_size']}, {cache['hit_rate']:.0%} hits, "
+            f"{cache['evictions']} evicted, {cache['expired']} expired, {cache['invalidations']} invalidated",
+        ]
+        for family, stats in sorted(locks.info().items()):
+            lines.append(f"locks[{family}]: {stats['acquired']} taken, {stats['contended']} contended, "
+                         f"max wait {stats['max_wait_ms']:.0f}ms, {stats['active']} held")
+        if mongo_breaker is not None:
+            breaker = mongo_breaker.stats
+            lines.append(f"mongo: {mongo_breaker.state}, {len(mongo_breaker.pending_writes)} writes queued, "
+                         f"{breaker['dropped_writes']} dropped, {breaker['resynced_writes']} resynced")
+        return lines
+
+    async def _log_diagnostics(self):
+        while True:
+            await asyncio.sleep(DIAGNOSTICS_LOG_SECONDS)
+            print("📊 " + " | ".join(self.diagnostics()))
 
     async def setup_hook(self):
         """Load all cogs"""
+        timings = {}
+        mark = time.perf_counter()
+
+        def lap(step):
+            nonlocal mark
+            now = time.perf_counter()
+            timings[step] = now - mark
+            mark = now
+
+        start_write_behind()
+        self.activity_buffer.start()
+        ttl_sweeper.start()
+        if PRELOAD_DATA:
+            files = await load_collections()
+            lap("data")
+            if files:
+                slowest = max(files, key=files.get)
+                print(f"✓ Loaded {len(files)} data files in {timings['data'] * 1000:.0f}ms "
+                      f"(slowest: {slowest} {files[slowest] * 1000:.0f}ms)")
+        await ensure_indexes()
+        lap("mongo indexes")
+        await leaderboards.ensure_built()
+        await listing_index.ensure_built()
+        await duel_index.ensure_built()
+        lap("in-memory indexes")
+        if MIGRATE_ON_STARTUP:
+            migration_runner.start()
+
         print("\n🔧 Loading cogs...")
         cogs_dir = "cogs"
 
@@ -60,6 +192,21 @@ class StudioBot(commands.Bot):
         print(f"\n📦 Cogs: {len(loaded)} loaded, {len(failed)} failed")
         if failed:
             print(f"  ⚠️ Failed: {', '.join(failed)}")
+        lap("cogs")
+        print("⏱️ Startup: " + ", ".join(f"{step} {seconds * 1000:.0f}ms" for step, seconds in timings.items()))
+        if DIAGNOSTICS_LOG_SECONDS > 0:
+            self._diagnostics_task = asyncio.get_running_loop().create_task(self._log_diagnostics())
+
+    async def close(self):
+        """Shut down and flush pending data writes"""
+        await super().close()
+        if self._diagnostics_task is not None:
+            self._diagnostics_task.cancel()
+        await self.activity_buffer.stop()
+        await ttl_sweeper.stop()
+        await migration_runner.stop()
+        await shutdown_storage()
+        print("✓ Data flushed to disk")
 
     async def on_ready(self):
         """Bot ready event"""
@@ -192,18 +339,9 @@ class StudioBot(commands.Bot):
             await self.process_commands(message)
             return
 
-        # Track message stats and give XP
+        # Track message stats and give XP (batched, written every few seconds)
         if message.guild:
-            try:
-                user = await UserProfile.get_user(message.author.id)
-                if user:
-                    new_msg_count = user.get('message_count', 0) + 1
-                    await UserProfile.update_user(message.author.id, {
-                        "message_count": new_msg_count
-                    })
-                    await UserProfile.add_xp(message.author.id, 5)
-            except Exception as e:
-                pass  # Silent fail for message tracking
+            self.activity_buffer.add_message(message.author.id)
 
         await self.process_commands(message)
 
@@ -222,18 +360,7 @@ class StudioBot(commands.Bot):
             if join_time:
                 minutes = int((datetime.utcnow() - join_time).total_seconds() / 60)
                 if minutes > 0:
-                    try:
-                        user = await UserProfile.get_user(member.id)
-                        if user:
-                            current_voice = user.get('voice_minutes', 0)
-                            await UserProfile.update_user(member.id, {
-                                "voice_minutes": current_voice + minutes
-                            })
-                            # Give XP for voice time (1 XP per minute, max 60)
-                            xp_gain = min(minutes, 60)
-                            await UserProfile.add_xp(member.id, xp_gain)
-                    except Exception:
-                        pass
+                    self.activity_buffer.add_voice(member.id, minutes)
 
 
 # ==================== OWNER COMMANDS ====================
@@ -7,7 +7,8 @@ import string
 import discord
 from discord import app_commands, ui
 from discord.ext import commands
-from database import UserProfile, DuelData, ActiveDuelData
+from database import UserProfile, DuelData, ActiveDuelData, LedgerData, LEDGER_SYSTEM, UnknownAccount, db_batch
+from keyed_locks import locks
 
 from cogs.fun import (
     FALLBACK_QUESTIONS,
@@ -858,32 +859,41 @@ class DuelCog(commands.Cog):
             winner_score, loser_score = p2_score, p1_score
 
         # Transfer credits
-        winner = await UserProfile.get_user(winner_id)
-        loser = await UserProfile.get_user(loser_id)
-        actual_bet = 0
+        async with locks.lock("user", winner_id, loser_id):
+            winner = await UserProfile.get_user(winner_id)
+            loser = await UserProfile.get_user(loser_id)
+            actual_bet = 0
+
+            if winner and loser:
+                actual_bet = min(bet, loser.get("studio_credits", 0))
+
+                shield_active = False
+                for rd in rounds_data:
+                    if rd.get("winner") != loser_id:
+                        if rd.get("p1_powerup") == "shield" and loser_id == p1_id:
+                            shield_active = True
+                        if rd.get("p2_powerup") == "shield" and loser_id == p2_id:
+                            shield_active = True
+
+                if shield_active:
+                    actual_bet = actual_bet // 2
+                    await channel.send(f"🛡️ Shield! {loser_name} only loses **{actual_bet:,}** credits!")
 
-        if winner and loser:
-            actual_bet = min(bet, loser.get("studio_credits", 0))
-
-            shield_active = False
-            for rd in rounds_data:
-                if rd.get("winner") != loser_id:
-                    if rd.get("p1_powerup") == "shield" and loser_id == p1_id:
-                        shield_active = True
-                    if rd.get("p2_powerup") == "shield" and loser_id == p2_id:
-                        shield_active = True
-
-            if shield_active:
-                actual_bet = actual_bet // 2
-                await channel.send(f"🛡️ Shield! {loser_name} only loses **{actual_bet:,}** credits!")
-
-            if actual_bet > 0:
-                await UserProfile.update_user(loser_id, {"studio_credits": loser.get("studio_credits", 0) - actual_bet})
-                await UserProfile.update_user(winner_id, {"studio_credits": winner.get("studio_credits", 0) + actual_bet})
-
-        # Record in database
-        duel_result = await DuelData.record_duel(winner_id, loser_id, actual_bet, mode, rounds_data)
-        await DuelData.record_loss(loser_id, actual_bet)
+                try:
+                    paid = actual_bet > 0 and await LedgerData.transfer(
+                        loser_id, winner_id, "studio_credits", actual_bet, "duel_bet")
+                except UnknownAccount:
+                    paid = False
+                if not paid:
+                    # The loser spent their stake while the duel was running
+                    actual_bet = 0
+
+        # Record in database. The duel record, both history pushes and the
+        # winner's rank go out together; the win/loss counters are written
+        # straight away because record_duel/record_loss read them back
+        async with db_batch():
+            duel_result = await DuelData.record_duel(winner_id, loser_id, actual_bet, mode, rounds_data)
+            await DuelData.record_loss(loser_id, actual_bet)
 
         # Check streak milestone
         if duel_result.get("milestone_hit"):
@@ -1183,7 +1193,11 @@ class DuelCog(commands.Cog):
             await interaction.followup.send(f"❌ Need **{total_cost:,}** but have **{credits:,}**!", ephemeral=True)
             return
 
-        await UserProfile.update_user(interaction.user.id, {"studio_credits": credits - total_cost})
+        result = await LedgerData.transfer(interaction.user.id, LEDGER_SYSTEM, "studio_credits", total_cost, "duel_powerup")
+        if not result:
+            await interaction.followup.send(f"❌ Need **{total_cost:,}** credits!", ephemeral=True)
+            return
+        credits = result["balances"][interaction.user.id]["studio_credits"] + total_cost
         await DuelData.add_powerup(interaction.user.id, powerup, amount)
 
         embed = discord.Embed(
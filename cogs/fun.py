@@ -1,7 +1,8 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-from database import UserProfile
+from database import UserProfile, LedgerData, LEDGER_SYSTEM
+from keyed_locks import locks
 from config import BOT_COLOR, AI_MODEL, AI_PERSONALITY, AI_NAME
 import asyncio
 import random
@@ -4243,14 +4244,14 @@ async def check_ai_credits(interaction: discord.Interaction,
     if is_user_admin(interaction):
         return True
 
-    user = await UserProfile.get_user(interaction.user.id)
+    user = await UserProfile.get_user(interaction.user.id, fields=["ai_credits"])
     if not user:
-        await UserProfile.create_user(interaction.user.id,
-                                      interaction.user.name)
-        user = await UserProfile.get_user(interaction.user.id)
+        user = await UserProfile.create_user(interaction.user.id,
+                                             interaction.user.name)
 
     current_ai = user.get("ai_credits", 0)
-    if current_ai < cost:
+    if current_ai < cost or not await UserProfile.increment(
+            interaction.user.id, {"ai_credits": -cost}, floor=0):
         embed = discord.Embed(
             title="❌ Not Enough AI Credits",
             description=(f"This command costs **{cost}** AI Credit(s).\n"
@@ -4262,16 +4263,11 @@ async def check_ai_credits(interaction: discord.Interaction,
         await interaction.followup.send(embed=embed, ephemeral=True)
         return False
 
-    await UserProfile.update_user(interaction.user.id,
-                                  {"ai_credits": current_ai - cost})
     return True
 
 
 async def refund_ai_credits(user_id: int, cost: int = 1):
-    user = await UserProfile.get_user(user_id)
-    if user:
-        current = user.get("ai_credits", 0)
-        await UserProfile.update_user(user_id, {"ai_credits": current + cost})
+    await UserProfile.increment(user_id, {"ai_credits": cost})
 
 
 def format_cooldown_remaining(user_id: int) -> str:
@@ -4292,7 +4288,6 @@ class FunCog(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        self._trivia_locks = set()
 
     # ========== 1. AI ROAST ==========
     @app_commands.command(
@@ -4318,9 +4313,7 @@ class FunCog(commands.Cog):
         if not await check_ai_credits(interaction, 1):
             return
 
-        roles = profile.get("roles", profile.get("role", "None"))
-        if isinstance(roles, list):
-            roles = ", ".join(roles) if roles else "None"
+        roles = ", ".join(profile.get("roles", [])) or "None"
 
         prompt = (
             f"System: {AI_PERSONALITY}\n\n"
@@ -4391,8 +4384,11 @@ class FunCog(commands.Cog):
                 f"❌ Not enough credits! You have **{current_credits}**.")
             return
 
-        await UserProfile.update_user(
-            interaction.user.id, {"studio_credits": current_credits - reward})
+        if not await LedgerData.transfer(interaction.user.id, LEDGER_SYSTEM,
+                                         "studio_credits", reward, "dev_bounty"):
+            await interaction.followup.send(
+                "❌ Not enough credits to post this bounty!")
+            return
 
         bounty_id = f"bounty_{interaction.user.id}_{random.randint(10000, 99999)}"
 
@@ -4428,8 +4424,11 @@ class FunCog(commands.Cog):
                 f"❌ You need **500 Credits**! You have **{current_credits}**.")
             return
 
-        await UserProfile.update_user(
-            interaction.user.id, {"studio_credits": current_credits - 500})
+        if not await LedgerData.transfer(interaction.user.id, LEDGER_SYSTEM,
+                                         "studio_credits", 500, "unbox_snippet"):
+            await interaction.followup.send(
+                "❌ You need **500 Credits** to open a box!")
+            return
 
         msg = await interaction.followup.send(UNBOX_FRAMES[0], wait=True)
         for frame in UNBOX_FRAMES[1:]:
@@ -4479,17 +4478,8 @@ class FunCog(commands.Cog):
     async def flex_wealth(self, interaction: discord.Interaction):
         await interaction.response.defer()
 
-        from database import _memory_users
-
-        if not _memory_users:
-            await interaction.followup.send("❌ No users found!")
-            return
-
-        users = sorted(
-            _memory_users.values(),
-            key=lambda x:
-            (x.get("pcredits", 0) * 1000) + x.get("studio_credits", 0),
-            reverse=True)[:10]
+        board = await UserProfile.get_leaderboard("wealth", 0, 10)
+        users = board["users"]
 
         if not users:
             await interaction.followup.send("❌ No users found!")
@@ -5043,16 +5033,13 @@ class FunCog(commands.Cog):
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
 
-        if user_id in self._trivia_locks:
+        if locks.locked("trivia", user_id):
             await interaction.followup.send(
                 "❌ You already have a trivia in progress!", ephemeral=True)
             return
 
-        self._trivia_locks.add(user_id)
-        try:
+        async with locks.lock("trivia", user_id):
             await self._run_trivia_session(interaction, difficulty, category)
-        finally:
-            self._trivia_locks.discard(user_id)
 
     async def _run_trivia_session(self,
                                   interaction: discord.Interaction,
@@ -754,8 +754,7 @@ class HelpView(discord.ui.View):
             await UserProfile.create_user(interaction.user.id, interaction.user.name)
             user = await UserProfile.get_user(interaction.user.id)
 
-        roles = user.get('roles', [])
-        roles_str = ", ".join(roles) if isinstance(roles, list) and roles else user.get('role', 'None')
+        roles_str = ", ".join(user.get('roles', [])) or "None"
         level = user.get('level', 1)
         xp = user.get('xp', 0)
         xp_needed = level * 250
@@ -901,39 +900,20 @@ async def setup(bot):
         await interaction.response.defer()
 
         try:
-            from database import _memory_users, _memory_teams, _memory_marketplace
-            user_count = len(_memory_users)
-            team_count = len(_memory_teams)
-            listing_count = len(_memory_marketplace)
-
-            # Calculate extra stats
-            total_credits = sum(u.get('studio_credits', 0) for u in _memory_users.values())
-            total_pcredits = sum(u.get('pcredits', 0) for u in _memory_users.values())
-            avg_level = round(
-                sum(u.get('level', 1) for u in _memory_users.values()) / max(user_count, 1), 1
-            )
-            total_messages = sum(u.get('message_count', 0) for u in _memory_users.values())
-            total_voice = sum(u.get('voice_minutes', 0) for u in _memory_users.values())
-
-            active_listings = sum(
-                1 for l in _memory_marketplace.values()
-                if l.get('status') == 'active'
-            )
-
-            # Role distribution
-            role_counts = {}
-            for u in _memory_users.values():
-                roles = u.get('roles', [])
-                if isinstance(roles, list):
-                    for r in roles:
-                        role_counts[r] = role_counts.get(r, 0) + 1
-
-            # Rank distribution
-            rank_counts = {}
-            for u in _memory_users.values():
-                rank = u.get('rank', 'Beginner')
-                rank_counts[rank] = rank_counts.get(rank, 0) + 1
-
+            from database import StatsData
+            stats = await StatsData.get_stats()
+            user_count = stats['users']
+            team_count = stats['teams']
+            listing_count = stats['listings']
+            active_listings = stats['active_listings']
+            total_credits = stats['credits']
+            total_pcredits = stats['pcredits']
+            avg_level = stats['avg_level']
+            total_messages = stats['messages']
+            total_voice = stats['voice']
+            role_counts = stats['roles']
+            rank_counts = stats['ranks']
+            delta = stats['delta']
         except Exception:
             user_count = team_count = listing_count = 0
             total_credits = total_pcredits = 0
@@ -941,6 +921,7 @@ async def setup(bot):
             total_messages = total_voice = active_listings = 0
             role_counts = {}
             rank_counts = {}
+            delta = None
 
         embed = discord.Embed(
             title="📊 Ashtrails' Studio Statistics",
@@ -965,6 +946,18 @@ async def setup(bot):
             inline=False
         )
 
+        if delta:
+            hours = max(int((datetime.utcnow().timestamp() - delta['since']) // 3600), 1)
+            embed.add_field(
+                name=f"📈 Last {hours}h",
+                value=(
+                    f"👥 {delta['users']:+,} devs | 💬 {delta['messages']:+,} messages | "
+                    f"🎤 {delta['voice']:+,} min\n"
+                    f"💰 {delta['credits']:+,} credits | 💎 {delta['pcredits']:+,} pCredits"
+                ),
+                inline=False
+            )
+
         if role_counts:
             role_lines = sorted(role_counts.items(), key=lambda x: x[1], reverse=True)
             role_text = " | ".join([f"**{r}**: {c}" for r, c in role_lines[:6]])
@@ -14,7 +14,7 @@ from discord import app_commands
 from anthropic import Anthropic
 
 from config import BOT_COLOR, AI_MODEL
-from database import UserProfile
+from database import UserProfile, conversation_log, db_batch
 
 # Anthropic Integration Setup
 AI_INTEGRATIONS_ANTHROPIC_API_KEY = os.environ.get("AI_INTEGRATIONS_ANTHROPIC_API_KEY")
@@ -25,8 +25,6 @@ client = Anthropic(
     base_url=AI_INTEGRATIONS_ANTHROPIC_BASE_URL
 )
 
-MAX_CONVERSATION_MESSAGES = 50
-
 
 async def openrouter_chat(messages, model_pool=None, max_tokens=1000):
     """Compatibility wrapper for Anthropic AI Integrations"""
@@ -1658,42 +1656,7 @@ async def ensure_learn_fields(user_id: int, username: str):
         await UserProfile.create_user(user_id, username)
         user = await UserProfile.get_user(user_id)
 
-    defaults = {}
-    default_fields = {
-        "learn_lesson": 1,
-        "learn_phase": "menu",
-        "learn_model_mode": "auto",
-        "learn_quiz_data": {},
-        "learn_conversation": [],
-        "learn_panel_message_id": None,
-        "learn_channel_id": None,
-        "learn_completed_lessons": [],
-        "learn_quiz_scores": {},
-        "learn_hints_used": 0,
-        "learn_total_questions": 0,
-        "learn_correct_answers": 0,
-        "learn_bookmarks": [],
-        "learn_notes": {},
-        "learn_streak": 0,
-        "learn_last_activity": None,
-        "learn_quiz_attempts": 0,
-        "learn_weak_topics": {},
-        "learn_strong_topics": {},
-        "learn_question_history": [],
-        "learn_quiz_questions": [],
-        "learn_current_quiz_index": 0,
-        "learn_hints_remaining": 3,
-        "learn_lesson_part": 0,
-    }
-
-    for key, val in default_fields.items():
-        if key not in user:
-            defaults[key] = val
-
-    if defaults:
-        await UserProfile.update_user(user_id, defaults)
-        user.update(defaults)
-
+    # learn_* defaults are resolved by get_user (see USER_DEFAULTS)
     return user
 
 
@@ -1711,18 +1674,11 @@ async def save_session_state(session: "LearnSession"):
 
 
 async def append_conversation(user_id: int, role: str, content: str):
-    user = await UserProfile.get_user(user_id)
-    if not user:
-        return
-    conv = user.get("learn_conversation", [])
-    conv.append({
+    await conversation_log.append(user_id, {
         "ts": discord.utils.utcnow().isoformat(),
         "role": role,
         "content": content[:2000],
     })
-    if len(conv) > MAX_CONVERSATION_MESSAGES:
-        conv = conv[-MAX_CONVERSATION_MESSAGES:]
-    await UserProfile.update_user(user_id, {"learn_conversation": conv})
 
 
 async def track_weakness(user_id: int, keywords: List[str], is_correct: bool):
@@ -2738,23 +2694,25 @@ Break the project into clear phases."""
         lesson = get_lesson(session.lesson_number)
 
         user = await UserProfile.get_user(session.user_id)
-        if user:
-            completed = user.get("learn_completed_lessons", [])
-            if session.lesson_number not in completed:
-                completed.append(session.lesson_number)
-                await UserProfile.update_user(session.user_id, {"learn_completed_lessons": completed})
+        # Progress, rewards and the reset session go out as one batch
+        async with db_batch():
+            if user:
+                completed = user.get("learn_completed_lessons", [])
+                if session.lesson_number not in completed:
+                    completed.append(session.lesson_number)
+                    await UserProfile.update_user(session.user_id, {"learn_completed_lessons": completed})
 
-        # Rewards
-        await UserProfile.add_xp(session.user_id, 50)
-        await UserProfile.add_credits(session.user_id, 75)
+            # Rewards
+            await UserProfile.add_xp(session.user_id, 50)
+            await UserProfile.add_credits(session.user_id, 75)
 
-        # Reset
-        session.phase = "menu"
-        session.quiz_data = {}
-        session.quiz_questions = []
-        session.current_quiz_index = 0
-        session.hints_remaining = 3
-        await save_session_state(session)
+            # Reset
+            session.phase = "menu"
+            session.quiz_data = {}
+            session.quiz_questions = []
+            session.current_quiz_index = 0
+            session.hints_remaining = 3
+            await save_session_state(session)
 
         stats = await get_progress_stats(session.user_id)
         filled = int(stats['progress_percent'] / 10)
@@ -2975,21 +2933,22 @@ Break the project into clear phases."""
         total = max(len(LESSONS), 1)
 
         user = await UserProfile.get_user(session.user_id)
-        if user:
-            completed = user.get("learn_completed_lessons", [])
-            if total not in completed:
-                completed.append(total)
-                await UserProfile.update_user(session.user_id, {"learn_completed_lessons": completed})
+        async with db_batch():
+            if user:
+                completed = user.get("learn_completed_lessons", [])
+                if total not in completed:
+                    completed.append(total)
+                    await UserProfile.update_user(session.user_id, {"learn_completed_lessons": completed})
 
-        await UserProfile.add_xp(session.user_id, 500)
-        await UserProfile.add_credits(session.user_id, 1000)
+            await UserProfile.add_xp(session.user_id, 500)
+            await UserProfile.add_credits(session.user_id, 1000)
 
-        session.phase = "menu"
-        session.quiz_data = {}
-        session.quiz_questions = []
-        session.current_quiz_index = 0
-        session.hints_remaining = 3
-        await save_session_state(session)
+            session.phase = "menu"
+            session.quiz_data = {}
+            session.quiz_questions = []
+            session.current_quiz_index = 0
+            session.hints_remaining = 3
+            await save_session_state(session)
 
         stats = await get_progress_stats(session.user_id)
 
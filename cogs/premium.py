@@ -1,7 +1,7 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-from database import UserProfile, db
+from database import UserProfile, LedgerData, LEDGER_SYSTEM, db
 from config import (
     BOT_COLOR, CREDIT_TO_PCREDIT_RATE, PCREDIT_TO_AICREDIT_RATE,
     PCREDIT_SHOP, AI_NAME, AI_CHAT_COOLDOWN_HOURS, AI_CHAT_DURATION_MINUTES,
@@ -775,13 +775,18 @@ class PremiumCog(commands.Cog):
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
 
-        new_credits = current_credits - total_cost
-        new_pcredits = current_pcredits + amount
-
-        await UserProfile.update_user(interaction.user.id, {
-            "studio_credits": new_credits,
-            "pcredits": new_pcredits
-        })
+        result = await LedgerData.batch([
+            (interaction.user.id, LEDGER_SYSTEM, "studio_credits", total_cost),
+            (LEDGER_SYSTEM, interaction.user.id, "pcredits", amount),
+        ], "convert")
+        if not result:
+            await interaction.followup.send("❌ You no longer have enough Studio Credits.", ephemeral=True)
+            return
+        balances = result["balances"][interaction.user.id]
+        new_credits = balances["studio_credits"]
+        new_pcredits = balances["pcredits"]
+        current_credits = new_credits + total_cost
+        current_pcredits = new_pcredits - amount
 
         embed = discord.Embed(
             title="✅ Conversion Successful!",
@@ -823,13 +828,18 @@ class PremiumCog(commands.Cog):
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
 
-        new_pcredits = current_pcredits - amount
-        new_ai = current_ai + ai_gained
-
-        await UserProfile.update_user(interaction.user.id, {
-            "pcredits": new_pcredits,
-            "ai_credits": new_ai
-        })
+        result = await LedgerData.batch([
+            (interaction.user.id, LEDGER_SYSTEM, "pcredits", amount),
+            (LEDGER_SYSTEM, interaction.user.id, "ai_credits", ai_gained),
+        ], "convert_ai")
+        if not result:
+            await interaction.followup.send("❌ You no longer have enough pCredits.", ephemeral=True)
+            return
+        balances = result["balances"][interaction.user.id]
+        new_pcredits = balances["pcredits"]
+        new_ai = balances["ai_credits"]
+        current_pcredits = new_pcredits + amount
+        current_ai = new_ai - ai_gained
 
         embed = discord.Embed(
             title="✅ Conversion Successful!",
@@ -209,10 +209,7 @@ class ProfileView(discord.ui.View):
         reputation = user.get('reputation', 0)
 
         roles = user.get('roles', [])
-        if isinstance(roles, list) and roles:
-            role_display = " ".join(f"{ROLES.get(r, '❓')} {r}" for r in roles)
-        else:
-            role_display = str(user.get('role', 'None'))
+        role_display = " ".join(f"{ROLES.get(r, '❓')} {r}" for r in roles) or "None"
 
         rank_emoji = get_rank_emoji(rank)
 
@@ -490,10 +487,7 @@ class ProfileView(discord.ui.View):
 
         # Roles
         roles = user.get('roles', [])
-        if isinstance(roles, list) and roles:
-            role_display = " ".join(f"{ROLES.get(r, '❓')} {r}" for r in roles)
-        else:
-            role_display = str(user.get('role', 'None'))
+        role_display = " ".join(f"{ROLES.get(r, '❓')} {r}" for r in roles) or "None"
         embed.add_field(name="🏷️ Roles", value=role_display, inline=False)
 
         return embed
@@ -566,40 +560,17 @@ class LeaderboardView(discord.ui.View):
             return False
         return True
 
-    async def _get_all_users(self):
-        """Get all users sorted for different categories"""
-        from database import _memory_users
-
-        users = list(_memory_users.values()) if _memory_users else []
-        return users
-
-    def _sort_users(self, users: list, category: str) -> list:
-        """Sort users by different criteria"""
-        sort_keys = {
-            "xp": lambda u: u.get('xp', 0),
-            "level": lambda u: (u.get('level', 1), u.get('xp', 0)),
-            "reputation": lambda u: u.get('reputation', 0),
-            "credits": lambda u: u.get('studio_credits', 0),
-            "wealth": lambda u: (u.get('pcredits', 0) * 1000) + u.get('studio_credits', 0),
-            "messages": lambda u: u.get('message_count', 0),
-            "voice": lambda u: u.get('voice_minutes', 0),
-            "ai": lambda u: u.get('ai_credits', 0),
-        }
-
-        key = sort_keys.get(category, sort_keys["xp"])
-        return sorted(users, key=key, reverse=True)
-
     async def _build_leaderboard_embed(self, category: str, page: int) -> discord.Embed:
-        users = await self._get_all_users()
-        sorted_users = self._sort_users(users, category)
+        board = await UserProfile.get_leaderboard(category, 0, 0)
+        total_users = board["total"]
 
-        total_pages = max((len(sorted_users) - 1) // self.per_page + 1, 1)
+        total_pages = max((total_users - 1) // self.per_page + 1, 1)
         page = min(page, total_pages - 1)
         self.current_page = page
 
         start = page * self.per_page
-        end = start + self.per_page
-        page_users = sorted_users[start:end]
+        board = await UserProfile.get_leaderboard(category, start, self.per_page)
+        page_users = board["users"]
 
         # Category config
         cat_config = {
@@ -674,13 +645,9 @@ class LeaderboardView(discord.ui.View):
         embed.description = "\n\n".join(lines)
 
         # Find requesting user's position
-        requesting_user_rank = None
-        for i, u in enumerate(sorted_users):
-            if u.get('_id') == self.user_id:
-                requesting_user_rank = i + 1
-                break
+        requesting_user_rank = await UserProfile.get_rank(self.user_id, category)
 
-        footer_parts = [f"Page {page + 1}/{total_pages}", f"{len(sorted_users)} developers"]
+        footer_parts = [f"Page {page + 1}/{total_pages}", f"{total_users} developers"]
         if requesting_user_rank:
             footer_parts.append(f"Your rank: #{requesting_user_rank}")
 
@@ -2,6 +2,7 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 from database import UserProfile
+from keyed_locks import locks
 from config import BOT_COLOR
 from datetime import datetime
 
@@ -525,82 +526,83 @@ class QuestListView(discord.ui.View):
 
         await interaction.response.defer(ephemeral=True)
 
-        user = await UserProfile.get_user(self.user_id)
-        if not user:
-            user = await UserProfile.create_user(self.user_id, interaction.user.name)
-
-        last_daily = user.get('last_daily')
-        now = datetime.utcnow()
-
-        if last_daily:
-            if isinstance(last_daily, str):
-                try:
-                    last_daily = datetime.fromisoformat(last_daily)
-                except Exception:
-                    last_daily = None
-
-            if last_daily and (now - last_daily).total_seconds() < 86400:
-                remaining = 86400 - (now - last_daily).total_seconds()
-                hours = int(remaining // 3600)
-                minutes = int((remaining % 3600) // 60)
-                embed = discord.Embed(
-                    title="⏰ Daily Already Claimed",
-                    description=f"Come back in **{hours}h {minutes}m**!",
-                    color=discord.Color.orange()
-                )
-                await interaction.followup.send(embed=embed, ephemeral=True)
-                return
-
-        # Streak calc
-        streak = user.get('daily_streak', 0)
-        if last_daily:
-            if isinstance(last_daily, str):
-                try:
-                    last_daily = datetime.fromisoformat(last_daily)
-                except Exception:
-                    last_daily = None
-            if last_daily and (now - last_daily).total_seconds() < 172800:
-                streak += 1
+        async with locks.lock("user", self.user_id):
+            user = await UserProfile.get_user(self.user_id)
+            if not user:
+                user = await UserProfile.create_user(self.user_id, interaction.user.name)
+
+            last_daily = user.get('last_daily')
+            now = datetime.utcnow()
+
+            if last_daily:
+                if isinstance(last_daily, str):
+                    try:
+                        last_daily = datetime.fromisoformat(last_daily)
+                    except Exception:
+                        last_daily = None
+
+                if last_daily and (now - last_daily).total_seconds() < 86400:
+                    remaining = 86400 - (now - last_daily).total_seconds()
+                    hours = int(remaining // 3600)
+                    minutes = int((remaining % 3600) // 60)
+                    embed = discord.Embed(
+                        title="⏰ Daily Already Claimed",
+                        description=f"Come back in **{hours}h {minutes}m**!",
+                        color=discord.Color.orange()
+                    )
+                    await interaction.followup.send(embed=embed, ephemeral=True)
+                    return
+
+            # Streak calc
+            streak = user.get('daily_streak', 0)
+            if last_daily:
+                if isinstance(last_daily, str):
+                    try:
+                        last_daily = datetime.fromisoformat(last_daily)
+                    except Exception:
+                        last_daily = None
+                if last_daily and (now - last_daily).total_seconds() < 172800:
+                    streak += 1
+                else:
+                    streak = 1
             else:
                 streak = 1
-        else:
-            streak = 1
-
-        bonus = min(streak, 7)
-        credits_reward = 100 + (bonus * 25)
-        xp_reward = 25 + (bonus * 10)
-
-        current_credits = user.get('studio_credits', 0)
-        current_xp = user.get('xp', 0)
-        daily_claims = user.get('daily_claims', 0)
-        current_level = user.get('level', 1)
-
-        new_xp = current_xp + xp_reward
-        new_level = current_level
-        xp_needed = new_level * 250
-        while new_xp >= xp_needed and new_level < 100:
-            new_xp -= xp_needed
-            new_level += 1
+
+            bonus = min(streak, 7)
+            credits_reward = 100 + (bonus * 25)
+            xp_reward = 25 + (bonus * 10)
+
+            current_credits = user.get('studio_credits', 0)
+            current_xp = user.get('xp', 0)
+            daily_claims = user.get('daily_claims', 0)
+            current_level = user.get('level', 1)
+
+            new_xp = current_xp + xp_reward
+            new_level = current_level
             xp_needed = new_level * 250
+            while new_xp >= xp_needed and new_level < 100:
+                new_xp -= xp_needed
+                new_level += 1
+                xp_needed = new_level * 250
 
-        if new_level >= 15:
-            new_rank = "Master"
-        elif new_level >= 10:
-            new_rank = "Expert"
-        elif new_level >= 5:
-            new_rank = "Learner"
-        else:
-            new_rank = "Beginner"
-
-        await UserProfile.update_user(self.user_id, {
-            "studio_credits": current_credits + credits_reward,
-            "xp": new_xp,
-            "level": new_level,
-            "rank": new_rank,
-            "last_daily": now.isoformat(),
-            "daily_streak": streak,
-            "daily_claims": daily_claims + 1
-        })
+            if new_level >= 15:
+                new_rank = "Master"
+            elif new_level >= 10:
+                new_rank = "Expert"
+            elif new_level >= 5:
+                new_rank = "Learner"
+            else:
+                new_rank = "Beginner"
+
+            await UserProfile.update_user(self.user_id, {
+                "studio_credits": current_credits + credits_reward,
+                "xp": new_xp,
+                "level": new_level,
+                "rank": new_rank,
+                "last_daily": now.isoformat(),
+                "daily_streak": streak,
+                "daily_claims": daily_claims + 1
+            })
 
         embed = discord.Embed(
             title="🎁 Daily Reward Claimed!",
@@ -749,82 +751,83 @@ class QuestCog(commands.Cog):
     async def daily_cmd(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
 
-        user = await UserProfile.get_user(interaction.user.id)
-        if not user:
-            await UserProfile.create_user(interaction.user.id, interaction.user.name)
+        async with locks.lock("user", interaction.user.id):
             user = await UserProfile.get_user(interaction.user.id)
-
-        last_daily = user.get('last_daily')
-        now = datetime.utcnow()
-
-        if last_daily:
-            if isinstance(last_daily, str):
-                try:
-                    last_daily = datetime.fromisoformat(last_daily)
-                except Exception:
-                    last_daily = None
-
-            if last_daily and (now - last_daily).total_seconds() < 86400:
-                remaining = 86400 - (now - last_daily).total_seconds()
-                hours = int(remaining // 3600)
-                minutes = int((remaining % 3600) // 60)
-                embed = discord.Embed(
-                    title="⏰ Daily Already Claimed",
-                    description=f"Come back in **{hours}h {minutes}m**!",
-                    color=discord.Color.orange()
-                )
-                await interaction.followup.send(embed=embed, ephemeral=True)
-                return
-
-        streak = user.get('daily_streak', 0)
-        if last_daily:
-            if isinstance(last_daily, str):
-                try:
-                    last_daily = datetime.fromisoformat(last_daily)
-                except Exception:
-                    last_daily = None
-            if last_daily and (now - last_daily).total_seconds() < 172800:
-                streak += 1
+            if not user:
+                await UserProfile.create_user(interaction.user.id, interaction.user.name)
+                user = await UserProfile.get_user(interaction.user.id)
+
+            last_daily = user.get('last_daily')
+            now = datetime.utcnow()
+
+            if last_daily:
+                if isinstance(last_daily, str):
+                    try:
+                        last_daily = datetime.fromisoformat(last_daily)
+                    except Exception:
+                        last_daily = None
+
+                if last_daily and (now - last_daily).total_seconds() < 86400:
+                    remaining = 86400 - (now - last_daily).total_seconds()
+                    hours = int(remaining // 3600)
+                    minutes = int((remaining % 3600) // 60)
+                    embed = discord.Embed(
+                        title="⏰ Daily Already Claimed",
+                        description=f"Come back in **{hours}h {minutes}m**!",
+                        color=discord.Color.orange()
+                    )
+                    await interaction.followup.send(embed=embed, ephemeral=True)
+                    return
+
+            streak = user.get('daily_streak', 0)
+            if last_daily:
+                if isinstance(last_daily, str):
+                    try:
+                        last_daily = datetime.fromisoformat(last_daily)
+                    except Exception:
+                        last_daily = None
+                if last_daily and (now - last_daily).total_seconds() < 172800:
+                    streak += 1
+                else:
+                    streak = 1
             else:
                 streak = 1
-        else:
-            streak = 1
-
-        bonus = min(streak, 7)
-        credits_reward = 100 + (bonus * 25)
-        xp_reward = 25 + (bonus * 10)
-
-        current_credits = user.get('studio_credits', 0)
-        current_xp = user.get('xp', 0)
-        daily_claims = user.get('daily_claims', 0)
-        current_level = user.get('level', 1)
-
-        new_xp = current_xp + xp_reward
-        new_level = current_level
-        xp_needed = new_level * 250
-        while new_xp >= xp_needed and new_level < 100:
-            new_xp -= xp_needed
-            new_level += 1
+
+            bonus = min(streak, 7)
+            credits_reward = 100 + (bonus * 25)
+            xp_reward = 25 + (bonus * 10)
+
+            current_credits = user.get('studio_credits', 0)
+            current_xp = user.get('xp', 0)
+            daily_claims = user.get('daily_claims', 0)
+            current_level = user.get('level', 1)
+
+            new_xp = current_xp + xp_reward
+            new_level = current_level
             xp_needed = new_level * 250
+            while new_xp >= xp_needed and new_level < 100:
+                new_xp -= xp_needed
+                new_level += 1
+                xp_needed = new_level * 250
 
-        if new_level >= 15:
-            new_rank = "Master"
-        elif new_level >= 10:
-            new_rank = "Expert"
-        elif new_level >= 5:
-            new_rank = "Learner"
-        else:
-            new_rank = "Beginner"
-
-        await UserProfile.update_user(interaction.user.id, {
-            "studio_credits": current_credits + credits_reward,
-            "xp": new_xp,
-            "level": new_level,
-            "rank": new_rank,
-            "last_daily": now.isoformat(),
-            "daily_streak": streak,
-            "daily_claims": daily_claims + 1
-        })
+            if new_level >= 15:
+                new_rank = "Master"
+            elif new_level >= 10:
+                new_rank = "Expert"
+            elif new_level >= 5:
+                new_rank = "Learner"
+            else:
+                new_rank = "Beginner"
+
+            await UserProfile.update_user(interaction.user.id, {
+                "studio_credits": current_credits + credits_reward,
+                "xp": new_xp,
+                "level": new_level,
+                "rank": new_rank,
+                "last_daily": now.isoformat(),
+                "daily_streak": streak,
+                "daily_claims": daily_claims + 1
+            })
 
         embed = discord.Embed(
             title="🎁 Daily Reward Claimed!",
@@ -1,7 +1,8 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-from database import UserProfile, MarketplaceData, TransactionData, UPLOADS_DIR
+from database import UserProfile, MarketplaceData, LedgerData, UnknownAccount, UPLOADS_DIR, db_batch
+from keyed_locks import locks
 from config import BOT_COLOR
 import os
 import uuid
@@ -26,6 +27,9 @@ class ShopView(discord.ui.View):
         self.category = None
         self.sort_by = "newest"
         self.search_query = None
+        # page -> cursor returned with the page before it (reset when filters change)
+        self.page_cursors = {}
+        self._cursor_filters = None
 
     @discord.ui.button(label="All", emoji="🛍️", style=discord.ButtonStyle.blurple, row=0)
     async def all_items(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -100,13 +104,21 @@ class ShopView(discord.ui.View):
         if not interaction.response.is_done():
             await interaction.response.defer()
 
+        filters = (self.category, self.search_query, self.sort_by)
+        if filters != self._cursor_filters:
+            self.page_cursors = {}
+            self._cursor_filters = filters
+
         result = await MarketplaceData.get_listings(
             category=self.category,
             search=self.search_query,
             sort_by=self.sort_by,
             page=self.current_page,
-            per_page=5
+            per_page=5,
+            cursor=self.page_cursors.get(self.current_page)
         )
+        if result.get('next_cursor'):
+            self.page_cursors[result['page'] + 1] = result['next_cursor']
 
         listings = result['listings']
         total = result['total']
@@ -168,6 +180,7 @@ class SearchModal(discord.ui.Modal):
 
     async def on_submit(self, interaction: discord.Interaction):
         self.shop_view.search_query = self.search_input.value
+        self.shop_view.sort_by = "relevance"
         self.shop_view.current_page = 1
         await self.shop_view.show_listings(interaction)
 
@@ -181,6 +194,7 @@ class SortSelectView(discord.ui.View):
     @discord.ui.select(
         placeholder="Select sort order...",
         options=[
+            discord.SelectOption(label="Best Match (search)", value="relevance", emoji="🔍"),
             discord.SelectOption(label="Newest First", value="newest", emoji="🆕"),
             discord.SelectOption(label="Oldest First", value="oldest", emoji="📅"),
             discord.SelectOption(label="Price: Low to High", value="price_low", emoji="💰"),
@@ -668,49 +682,57 @@ class ShopCog(commands.Cog):
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
 
-        buyer = await UserProfile.get_user(interaction.user.id)
-        if not buyer:
-            await UserProfile.create_user(interaction.user.id, interaction.user.name)
+        async with locks.lock("user", interaction.user.id):
             buyer = await UserProfile.get_user(interaction.user.id)
+            if not buyer:
+                await UserProfile.create_user(interaction.user.id, interaction.user.name)
+                buyer = await UserProfile.get_user(interaction.user.id)
 
-        buyer_credits = buyer.get('studio_credits', 0)
-        if buyer_credits < price:
-            embed = discord.Embed(
-                title="❌ Insufficient Credits",
-                description=f"You need **{price}** credits but only have **{buyer_credits}**.",
-                color=discord.Color.red()
-            )
-            await interaction.followup.send(embed=embed, ephemeral=True)
-            return
-
-        # Deduct from buyer
-        await UserProfile.update_user(interaction.user.id, {
-            "studio_credits": buyer_credits - price,
-            "purchases_count": buyer.get('purchases_count', 0) + 1
-        })
-
-        # Add to seller
-        seller = await UserProfile.get_user(seller_id)
-        if seller:
-            await UserProfile.update_user(seller_id, {
-                "studio_credits": seller.get('studio_credits', 0) + price
-            })
+            buyer_credits = buyer.get('studio_credits', 0)
+            if buyer_credits < price:
+                embed = discord.Embed(
+                    title="❌ Insufficient Credits",
+                    description=f"You need **{price}** credits but only have **{buyer_credits}**.",
+                    color=discord.Color.red()
+                )
+                await interaction.followup.send(embed=embed, ephemeral=True)
+                return
 
-        # Update listing sold count
-        await MarketplaceData.increment_sold(listing_id)
-
-        # Record transaction
-        transaction = {
-            "transaction_id": str(uuid.uuid4())[:8].upper(),
-            "listing_id": listing_id,
-            "buyer_id": interaction.user.id,
-            "seller_id": seller_id,
-            "price": price,
-            "title": listing.get('title', 'Unknown'),
-            "category": listing.get('category', 'code'),
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        await TransactionData.create_transaction(transaction)
+            # Buyer -> seller in one ledger batch (re-checks the balance at write
+            # time in case the buyer spent in the meantime) and record it
+            try:
+                result = await LedgerData.transfer(interaction.user.id, seller_id, "studio_credits", price, "purchase", {
+                    "transaction_id": str(uuid.uuid4())[:8].upper(),
+                    "listing_id": listing_id,
+                    "price": price,
+                    "title": listing.get('title', 'Unknown'),
+                    "category": listing.get('category', 'code'),
+                    "timestamp": datetime.utcnow().isoformat()
+                })
+            except UnknownAccount:
+                # The buyer was created above, so it's the seller who is gone:
+                # take the listing out of /shop and search
+                await MarketplaceData.set_status(listing_id, "inactive")
+                embed = discord.Embed(
+                    title="❌ Seller Unavailable",
+                    description="This listing's seller no longer has a profile, so it can't be bought. You were not charged.",
+                    color=discord.Color.red()
+                )
+                await interaction.followup.send(embed=embed, ephemeral=True)
+                return
+            if not result:
+                embed = discord.Embed(
+                    title="❌ Insufficient Credits",
+                    description=f"You need **{price}** credits.",
+                    color=discord.Color.red()
+                )
+                await interaction.followup.send(embed=embed, ephemeral=True)
+                return
+            remaining = result["balances"][interaction.user.id]["studio_credits"]
+            # Purchase count and listing sold count: independent, sent together
+            async with db_batch(ordered=False):
+                await UserProfile.increment(interaction.user.id, {"purchases_count": 1})
+                await MarketplaceData.increment_sold(listing_id)
 
         cat_emoji = CATEGORY_EMOJIS.get(listing.get('category', 'code'), '📝')
 
@@ -721,7 +743,7 @@ class ShopCog(commands.Cog):
         )
         embed.add_field(name="Listing ID", value=f"`{listing_id}`", inline=True)
         embed.add_field(name="Category", value=f"{cat_emoji} {listing.get('category', 'code').title()}", inline=True)
-        embed.add_field(name="Remaining Balance", value=f"💰 {buyer_credits - price}", inline=True)
+        embed.add_field(name="Remaining Balance", value=f"💰 {remaining}", inline=True)
 
         if listing.get('category') == 'code' and listing.get('code'):
             code_text = listing['code']
@@ -1,7 +1,7 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-from database import TeamData, UserProfile, MarketplaceData, _memory_teams
+from database import TeamData, UserProfile, MarketplaceData
 from config import BOT_COLOR
 import uuid
 from datetime import datetime
@@ -1189,20 +1189,7 @@ class TeamCog(commands.Cog):
             await UserProfile.create_user(interaction.user.id, interaction.user.name)
             user = await UserProfile.get_user(interaction.user.id)
 
-        from database import _memory_teams, db
-
-        found_team = None
-        for tid, team in _memory_teams.items():
-            if team.get("invite_code", "").upper() == invite_code.strip().upper():
-                found_team = team
-                break
-
-        if not found_team and db is not None:
-            try:
-                found_team = await db["teams"].find_one(
-                    {"invite_code": invite_code.strip().upper()})
-            except Exception:
-                pass
+        found_team = await TeamData.get_team_by_invite_code(invite_code)
 
         if not found_team:
             await interaction.followup.send(embed=discord.Embed(
@@ -1278,11 +1265,9 @@ class TeamCog(commands.Cog):
         if not hasattr(channel, 'category') or not channel.category:
             return
 
-        for team_id, team in _memory_teams.items():
-            if team.get("category_id") == channel.category.id:
-                if message.author.id in team.get("members", []):
-                    team_stats.add_message(team_id, message.author.id)
-                break
+        team = await TeamData.get_team_by_category(channel.category.id)
+        if team and message.author.id in team.get("members", []):
+            team_stats.add_message(team["_id"], message.author.id)
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after):
@@ -1292,19 +1277,15 @@ class TeamCog(commands.Cog):
 
         # Left a voice channel
         if before.channel and hasattr(before.channel, 'category') and before.channel.category:
-            for team_id, team in _memory_teams.items():
-                if team.get("category_id") == before.channel.category.id:
-                    if member.id in team.get("members", []):
-                        team_stats.voice_leave(team_id, member.id)
-                    break
+            team = await TeamData.get_team_by_category(before.channel.category.id)
+            if team and member.id in team.get("members", []):
+                team_stats.voice_leave(team["_id"], member.id)
 
         # Joined a voice channel
         if after.channel and hasattr(after.channel, 'category') and after.channel.category:
-            for team_id, team in _memory_teams.items():
-                if team.get("category_id") == after.channel.category.id:
-                    if member.id in team.get("members", []):
-                        team_stats.voice_join(team_id, member.id)
-                    break
+            team = await TeamData.get_team_by_category(after.channel.category.id)
+            if team and member.id in team.get("members", []):
+                team_stats.voice_join(team["_id"], member.id)
 
 
 async def setup(bot):
@@ -1,7 +1,8 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-from database import UserProfile
+from database import UserProfile, LedgerData
+from keyed_locks import locks
 from config import BOT_COLOR
 from datetime import datetime
 import asyncio
@@ -809,62 +810,64 @@ async def execute_trade(client, trade: TradeSession):
     """Execute a confirmed trade — transfer all items"""
     trade.state = "completed"
 
-    user1 = await UserProfile.get_user(trade.user1_id)
-    user2 = await UserProfile.get_user(trade.user2_id)
-
-    if not user1 or not user2:
-        # Notify both channels
-        for ch_id in [trade.user1_channel_id, trade.user2_channel_id, trade.overview_channel_id]:
-            if ch_id:
-                try:
-                    ch = client.get_channel(ch_id) or await client.fetch_channel(ch_id)
-                    await ch.send("❌ Trade failed — could not find user profiles.")
-                except Exception:
-                    pass
-        return
+    async with locks.lock("user", trade.user1_id, trade.user2_id):
+        user1 = await UserProfile.get_user(trade.user1_id)
+        user2 = await UserProfile.get_user(trade.user2_id)
 
-    # Verify all currency amounts
-    u1_credits = sum(i.data.get('amount', 0) for i in trade.user1_items if i.item_type == "credits")
-    u1_pcredits = sum(i.data.get('amount', 0) for i in trade.user1_items if i.item_type == "pcredits")
-    u1_ai = sum(i.data.get('amount', 0) for i in trade.user1_items if i.item_type == "ai_credits")
+        if not user1 or not user2:
+            # Notify both channels
+            for ch_id in [trade.user1_channel_id, trade.user2_channel_id, trade.overview_channel_id]:
+                if ch_id:
+                    try:
+                        ch = client.get_channel(ch_id) or await client.fetch_channel(ch_id)
+                        await ch.send("❌ Trade failed — could not find user profiles.")
+                    except Exception:
+                        pass
+            return
 
-    u2_credits = sum(i.data.get('amount', 0) for i in trade.user2_items if i.item_type == "credits")
-    u2_pcredits = sum(i.data.get('amount', 0) for i in trade.user2_items if i.item_type == "pcredits")
-    u2_ai = sum(i.data.get('amount', 0) for i in trade.user2_items if i.item_type == "ai_credits")
+        # Verify all currency amounts
+        u1_credits = sum(i.data.get('amount', 0) for i in trade.user1_items if i.item_type == "credits")
+        u1_pcredits = sum(i.data.get('amount', 0) for i in trade.user1_items if i.item_type == "pcredits")
+        u1_ai = sum(i.data.get('amount', 0) for i in trade.user1_items if i.item_type == "ai_credits")
 
-    # Verify balances
-    if user1.get('studio_credits', 0) < u1_credits:
-        await notify_trade_error(client, trade, f"<@{trade.user1_id}> doesn't have enough Studio Credits!")
-        return
-    if user1.get('pcredits', 0) < u1_pcredits:
-        await notify_trade_error(client, trade, f"<@{trade.user1_id}> doesn't have enough pCredits!")
-        return
-    if user1.get('ai_credits', 0) < u1_ai:
-        await notify_trade_error(client, trade, f"<@{trade.user1_id}> doesn't have enough AI Credits!")
-        return
-    if user2.get('studio_credits', 0) < u2_credits:
-        await notify_trade_error(client, trade, f"<@{trade.user2_id}> doesn't have enough Studio Credits!")
-        return
-    if user2.get('pcredits', 0) < u2_pcredits:
-        await notify_trade_error(client, trade, f"<@{trade.user2_id}> doesn't have enough pCredits!")
-        return
-    if user2.get('ai_credits', 0) < u2_ai:
-        await notify_trade_error(client, trade, f"<@{trade.user2_id}> doesn't have enough AI Credits!")
-        return
+        u2_credits = sum(i.data.get('amount', 0) for i in trade.user2_items if i.item_type == "credits")
+        u2_pcredits = sum(i.data.get('amount', 0) for i in trade.user2_items if i.item_type == "pcredits")
+        u2_ai = sum(i.data.get('amount', 0) for i in trade.user2_items if i.item_type == "ai_credits")
 
-    # Execute currency transfers
-    # User1 gives, User2 receives
-    await UserProfile.update_user(trade.user1_id, {
-        "studio_credits": user1.get('studio_credits', 0) - u1_credits + u2_credits,
-        "pcredits": user1.get('pcredits', 0) - u1_pcredits + u2_pcredits,
-        "ai_credits": user1.get('ai_credits', 0) - u1_ai + u2_ai,
-    })
-
-    await UserProfile.update_user(trade.user2_id, {
-        "studio_credits": user2.get('studio_credits', 0) - u2_credits + u1_credits,
-        "pcredits": user2.get('pcredits', 0) - u2_pcredits + u1_pcredits,
-        "ai_credits": user2.get('ai_credits', 0) - u2_ai + u1_ai,
-    })
+        # Verify balances
+        if user1.get('studio_credits', 0) < u1_credits:
+            await notify_trade_error(client, trade, f"<@{trade.user1_id}> doesn't have enough Studio Credits!")
+            return
+        if user1.get('pcredits', 0) < u1_pcredits:
+            await notify_trade_error(client, trade, f"<@{trade.user1_id}> doesn't have enough pCredits!")
+            return
+        if user1.get('ai_credits', 0) < u1_ai:
+            await notify_trade_error(client, trade, f"<@{trade.user1_id}> doesn't have enough AI Credits!")
+            return
+        if user2.get('studio_credits', 0) < u2_credits:
+            await notify_trade_error(client, trade, f"<@{trade.user2_id}> doesn't have enough Studio Credits!")
+            return
+        if user2.get('pcredits', 0) < u2_pcredits:
+            await notify_trade_error(client, trade, f"<@{trade.user2_id}> doesn't have enough pCredits!")
+            return
+        if user2.get('ai_credits', 0) < u2_ai:
+            await notify_trade_error(client, trade, f"<@{trade.user2_id}> doesn't have enough AI Credits!")
+            return
+
+        # Execute every currency leg as one ledger batch (balances are re-checked
+        # at write time in case either user spent in the meantime)
+        legs = [
+            (from_id, to_id, currency, amount)
+            for from_id, to_id, amounts in (
+                (trade.user1_id, trade.user2_id, (u1_credits, u1_pcredits, u1_ai)),
+                (trade.user2_id, trade.user1_id, (u2_credits, u2_pcredits, u2_ai)),
+            )
+            for currency, amount in zip(("studio_credits", "pcredits", "ai_credits"), amounts)
+            if amount > 0
+        ]
+        if legs and not await LedgerData.batch(legs, "trade"):
+            await notify_trade_error(client, trade, "One of you no longer has enough currency!")
+            return
 
     # Send files and code to the receiving user's DMs
     try:
@@ -0,0 +1,99 @@
+"""Slot-based user records for the in-memory store
+
+A plain dict per user pays for a hash table sized for its keys plus the
+per-key entries. CompactUser keeps the identity fields and the scalar
+counters every active member accumulates (xp, credits, message counts,
+duel stats...) in __slots__, and anything else in a small overflow dict
+that only exists once such a field is set.
+
+It behaves like a dict (MutableMapping), so database.py and the cogs can
+use it wherever they used a user document: a slot that was never assigned
+is simply a missing key, which keeps the sparse-schema semantics of
+USER_DEFAULTS intact. Enabled with COMPACT_USERS (see config.py).
+"""
+from collections.abc import Mapping, MutableMapping
+
+# Stored in slots; every other field goes to the overflow dict
+SLOT_FIELDS = (
+    "_id", "username", "player_id", "created_at", "schema_version",
+    "rank", "xp", "level", "reputation",
+    "studio_credits", "pcredits", "ai_credits", "message_count", "voice_minutes",
+    "daily_streak", "daily_claims", "last_daily", "last_quest",
+    "sales_count", "purchases_count", "reviews_given",
+    "duel_wins", "duel_losses", "duel_draws", "duel_credits_won", "duel_credits_lost",
+    "duel_streak", "duel_best_streak", "duel_rank", "duel_title_emoji",
+    "bughunt_wins", "bughunt_games", "bughunt_bugs_found",
+)
+_SLOTS = frozenset(SLOT_FIELDS)
+
+
+class CompactUser(MutableMapping):
+    """dict-compatible user record backed by __slots__"""
+
+    __slots__ = SLOT_FIELDS + ("_extra",)
+
+    def __init__(self, doc: Mapping = None):
+        self._extra = None
+        if doc:
+            for key, value in doc.items():
+                self[key] = value
+
+    def __getitem__(self, key):
+        if key in _SLOTS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in _SLOTS:
+            setattr(self, key, value)
+        elif self._extra is None:
+            self._extra = {key: value}
+        else:
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _SLOTS:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+            return
+        if self._extra is None:
+            raise KeyError(key)
+        del self._extra[key]
+        if not self._extra:
+            self._extra = None
+
+    def __iter__(self):
+        for key in SLOT_FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._extra is not None:
+            yield from list(self._extra)
+
+    def __len__(self):
+        return sum(1 for key in SLOT_FIELDS if hasattr(self, key)) + len(self._extra or ())
+
+    # Faster than the MutableMapping defaults, which go through __getitem__
+    def __contains__(self, key):
+        if key in _SLOTS:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def get(self, key, default=None):
+        if key in _SLOTS:
+            return getattr(self, key, default)
+        if self._extra is None:
+            return default
+        return self._extra.get(key, default)
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"CompactUser({self.to_dict()!r})"
@@ -11,6 +11,37 @@ GUILD_ID = int(os.getenv("GUILD_ID", "0"))
 # Database
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 DB_NAME = "ashrails_studio"
+MONGO_BREAKER_THRESHOLD = int(os.getenv("MONGO_BREAKER_THRESHOLD", "3"))  # failures before falling back to local
+MONGO_PROBE_INTERVAL = float(os.getenv("MONGO_PROBE_INTERVAL", "15"))  # seconds between reconnect probes
+MONGO_RESYNC_QUEUE = int(os.getenv("MONGO_RESYNC_QUEUE", "10000"))  # max writes replayed after an outage
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))  # cached user documents (0 disables)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))  # seconds before a cached user is re-read
+COMPACT_USERS = os.getenv("COMPACT_USERS", "false").lower() in ("1", "true", "yes")  # slot-based in-memory user records
+
+# Local storage
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()  # "json" or "sqlite"
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join("data", "studio.db"))
+PRELOAD_DATA = os.getenv("PRELOAD_DATA", "true").lower() in ("1", "true", "yes")  # read data files in parallel at startup (false: on first use)
+DATA_PRETTY_JSON = os.getenv("DATA_PRETTY_JSON", "false").lower() in ("1", "true", "yes")  # indent data files (bigger, slower to write)
+DATA_COMPRESS = [f.strip() for f in os.getenv("DATA_COMPRESS", "").split(",") if f.strip()]  # data files written compressed, e.g. "duels.json,transactions.json"
+DATA_COMPRESSION = os.getenv("DATA_COMPRESSION", "zstd").lower()  # "zstd" (gzip if zstandard isn't installed) or "gzip"
+SAVE_INTERVAL_SECONDS = float(os.getenv("SAVE_INTERVAL_SECONDS", "5"))  # write-behind flush interval
+SNAPSHOT_QUEUE_SIZE = int(os.getenv("SNAPSHOT_QUEUE_SIZE", "64"))  # queued file writes before savers block (back-pressure)
+ACTIVITY_FLUSH_SECONDS = float(os.getenv("ACTIVITY_FLUSH_SECONDS", "5"))  # batched message/voice XP writes
+DIAGNOSTICS_LOG_SECONDS = float(os.getenv("DIAGNOSTICS_LOG_SECONDS", "900"))  # seconds between runtime counter log lines (0 disables)
+JOURNAL_COMPACT_BYTES = int(os.getenv("JOURNAL_COMPACT_BYTES", str(4 * 1024 * 1024)))  # fold journal into snapshot past this
+STATS_HISTORY_INTERVAL = float(os.getenv("STATS_HISTORY_INTERVAL", "3600"))  # seconds between /stats history snapshots
+STATS_HISTORY_SIZE = int(os.getenv("STATS_HISTORY_SIZE", "720"))  # snapshots kept (30 days hourly)
+MARKET_SEARCH_LOCAL_LIMIT = int(os.getenv("MARKET_SEARCH_LOCAL_LIMIT", "200000"))  # above this many Mongo listings, search via $text
+TTL_SWEEP_INTERVAL = float(os.getenv("TTL_SWEEP_INTERVAL", "600"))  # seconds between expiry sweeps (0 disables)
+TTL_SWEEP_BATCH = int(os.getenv("TTL_SWEEP_BATCH", "500"))  # records deleted per batch
+ACTIVE_DUEL_TTL = int(os.getenv("ACTIVE_DUEL_TTL", "7200"))  # seconds before an unfinished duel is dropped
+BUGHUNT_LOBBY_TTL = int(os.getenv("BUGHUNT_LOBBY_TTL", "7200"))  # seconds before a bug hunt lobby is dropped
+VOUCH_TTL = int(os.getenv("VOUCH_TTL", "86400"))  # vouch cooldown records, useless once the 24h cooldown is over
+TRANSACTION_TTL = int(os.getenv("TRANSACTION_TTL", "0"))  # seconds of transaction history kept (0 keeps everything)
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() in ("1", "true", "yes")  # upgrade old user documents in the background after startup
+MIGRATION_CHUNK = int(os.getenv("MIGRATION_CHUNK", "200"))  # user documents migrated per chunk
+MIGRATION_PAUSE = float(os.getenv("MIGRATION_PAUSE", "0.25"))  # seconds between chunks, so the bot keeps up with commands
 
 # Features
 PREFIX = "/"
@@ -1,10 +1,36 @@
+import asyncio
+import contextlib
+import contextvars
+import copy
+import gc
+import gzip
 import json
 import os
+import time
 import uuid
 import random
 import string
-from datetime import datetime
-from config import MONGODB_URI, DB_NAME
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+from config import (
+    MONGODB_URI, DB_NAME, SAVE_INTERVAL_SECONDS, JOURNAL_COMPACT_BYTES,
+    STORAGE_BACKEND, SQLITE_PATH,
+    MONGO_BREAKER_THRESHOLD, MONGO_PROBE_INTERVAL, MONGO_RESYNC_QUEUE,
+    USER_CACHE_SIZE, USER_CACHE_TTL, STATS_HISTORY_INTERVAL, STATS_HISTORY_SIZE,
+    MARKET_SEARCH_LOCAL_LIMIT, COMPACT_USERS,
+    DATA_PRETTY_JSON, DATA_COMPRESS, DATA_COMPRESSION, SNAPSHOT_QUEUE_SIZE,
+    TTL_SWEEP_INTERVAL, TTL_SWEEP_BATCH, ACTIVE_DUEL_TTL, BUGHUNT_LOBBY_TTL, VOUCH_TTL, TRANSACTION_TTL,
+    MIGRATION_CHUNK, MIGRATION_PAUSE,
+)
+from aggregates import UserAggregates
+from compact_user import CompactUser
+from lazy_collection import LazyCollection
+from snapshot_writer import SnapshotWriter, write_atomic, append_durable
+from search_index import InvertedIndex
+from keyed_locks import locks
+from memory_index import CollectionIndexes
 
 # File-based persistence paths
 DATA_DIR = "data"
@@ -12,49 +38,665 @@ USERS_FILE = os.path.join(DATA_DIR, "users.json")
 TEAMS_FILE = os.path.join(DATA_DIR, "teams.json")
 MARKETPLACE_FILE = os.path.join(DATA_DIR, "marketplace.json")
 TRANSACTIONS_FILE = os.path.join(DATA_DIR, "transactions.json")
-
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
+AGGREGATES_FILE = os.path.join(DATA_DIR, "aggregates.json")
 
 UPLOADS_DIR = os.path.join(DATA_DIR, "uploads")
-if not os.path.exists(UPLOADS_DIR):
-    os.makedirs(UPLOADS_DIR)
+_data_dirs_ready = False
+
+
+def ensure_data_dirs():
+    """Create data/ and data/uploads/ (first write or startup, not at import)"""
+    global _data_dirs_ready
+    if not _data_dirs_ready:
+        os.makedirs(UPLOADS_DIR, exist_ok=True)
+        _data_dirs_ready = True
+
+
+# ===== JSON CODEC =====
+# Data files are encoded with orjson when it is installed and with the
+# stdlib (compact separators) otherwise; DATA_PRETTY_JSON indents them for
+# hand editing. Reading sniffs the content, so old pretty-printed files and
+# gzip/zstd-compressed ones (DATA_COMPRESS) load the same way.
+try:
+    import orjson
+    # datetimes go through _json_default (str) like they do with the stdlib
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# Payloads past this are parsed with the cyclic GC paused: a big users.json
+# allocates millions of containers and would otherwise trigger it over and
+# over for nothing (the parsed tree has no cycles)
+GC_PAUSE_BYTES = 1024 * 1024
+
+
+def _json_default(value):
+    """Encoder fallback: dict-like records (CompactUser) as objects, anything else as str"""
+    if isinstance(value, Mapping):
+        return dict(value.items())
+    return str(value)
+
+
+def json_dumps(data, pretty: bool = False) -> bytes:
+    """Encode to UTF-8 JSON bytes (one line unless `pretty`)"""
+    if orjson is not None:
+        options = _ORJSON_OPTIONS | (orjson.OPT_INDENT_2 if pretty else 0)
+        try:
+            return orjson.dumps(data, default=_json_default, option=options)
+        except TypeError:
+            pass  # e.g. an integer past 64 bits; the stdlib encoder copes
+    if pretty:
+        text = json.dumps(data, indent=2, ensure_ascii=False, default=_json_default)
+    else:
+        text = json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=_json_default)
+    return text.encode("utf-8")
+
+
+def json_loads(raw):
+    """Decode JSON bytes/str, decompressing gzip or zstd content first"""
+    if raw[:2] == GZIP_MAGIC:
+        raw = gzip.decompress(raw)
+    elif raw[:4] == ZSTD_MAGIC:
+        if zstandard is None:
+            raise ValueError("zstd-compressed data file but the zstandard package is not installed")
+        raw = zstandard.ZstdDecompressor().decompressobj().decompress(raw)
+    pause = len(raw) > GC_PAUSE_BYTES and gc.isenabled()
+    if pause:
+        gc.disable()
+    try:
+        if orjson is not None:
+            return orjson.loads(raw)
+        return json.loads(raw)
+    finally:
+        if pause:
+            gc.enable()
+
+
+def _compress(raw: bytes) -> bytes:
+    if DATA_COMPRESSION == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    return gzip.compress(raw, compresslevel=6)
 
 
 def load_json(file_path, default_val):
-    if os.path.exists(file_path):
+    """Load a snapshot (plus its journal)
+
+    If the file is missing or unreadable, the temp file of an interrupted
+    write and then the last-known-good backup (see snapshot_writer.py) are
+    tried before falling back to `default_val`.
+    """
+    data = default_val
+    for candidate in (file_path, file_path + ".tmp", file_path + ".bak"):
+        if not os.path.exists(candidate):
+            continue
         try:
-            with open(file_path, "r") as f:
-                data = json.load(f)
-                if isinstance(data, type(default_val)):
-                    return data
-                return default_val
-        except Exception:
-            return default_val
-    return default_val
+            with open(candidate, "rb") as f:
+                loaded = json_loads(f.read())
+        except Exception as e:
+            print(f"⚠️ Could not read {candidate}: {e}")
+            continue
+        if not isinstance(loaded, type(default_val)):
+            print(f"⚠️ Ignoring {candidate}: expected a {type(default_val).__name__}")
+            continue
+        if candidate != file_path:
+            print(f"⚠️ {file_path} was missing or unreadable, recovered from {candidate}")
+        data = loaded
+        break
+    if isinstance(data, dict):
+        data = _replay_journal(file_path, data)
+    return data
+
+
+def _snapshot_compressor(file_path):
+    return _compress if os.path.basename(file_path) in DATA_COMPRESS else None
+
+
+def _encode_snapshot(file_path, data, compress: bool = True) -> bytes:
+    if isinstance(data, LazyCollection):
+        data = data.data
+    raw = json_dumps(data, pretty=DATA_PRETTY_JSON)
+    compressor = _snapshot_compressor(file_path)
+    if compress and compressor is not None:
+        raw = compressor(raw)
+    return raw
 
 
 def save_json(file_path, data):
+    """Write a snapshot now, atomically, on the calling thread"""
     try:
-        with open(file_path, "w") as f:
-            json.dump(data, f, indent=4, default=str)
+        raw = _encode_snapshot(file_path, data)
+        ensure_data_dirs()
+        write_atomic(file_path, raw)
+        return True
     except Exception as e:
         print(f"Error saving {file_path}: {e}")
+        return False
+
+
+# Thread doing the file I/O of the write-behind flusher (started with it)
+snapshot_writer = SnapshotWriter(SNAPSHOT_QUEUE_SIZE)
+
+
+def _write_snapshot(file_path, data, truncate_journal: str = None):
+    """Snapshot `data` through the writer thread when it runs, inline otherwise
+
+    Encoding happens here, on the caller's thread, so the snapshot is
+    consistent with the collection at this moment; the writer thread does
+    the compression and the file I/O (temp file, fsync, rename). Encoding
+    there instead would not free the event loop: the JSON encoder holds the
+    GIL for the whole call, and the copy it would need to work from is
+    slower than the encode itself.
+    """
+    if not snapshot_writer.running:
+        if save_json(file_path, data) and truncate_journal:
+            try:
+                open(truncate_journal, "wb").close()
+            except Exception as e:
+                print(f"Error truncating {truncate_journal}: {e}")
+        return
+    try:
+        raw = _encode_snapshot(file_path, data, compress=False)
+    except Exception as e:
+        print(f"Error encoding {file_path}: {e}")
+        return
+    ensure_data_dirs()
+    snapshot_writer.write_snapshot(file_path, raw, truncate_journal, _snapshot_compressor(file_path))
+
+
+# ===== WRITE-BEHIND PERSISTENCE =====
+# Mutations mark a collection dirty instead of rewriting its file inline.
+# A background task coalesces repeated writes and flushes each dirty file
+# once per SAVE_INTERVAL_SECONDS, plus a final flush on shutdown. The file
+# writes themselves happen on snapshot_writer's thread.
+_dirty_collections = {}
+_flush_task = None
+persistence_stats = {
+    "marked": 0, "coalesced": 0, "flushes": 0, "files_written": 0,
+    "journal_entries": 0, "compactions": 0,
+}
+
+
+def mark_dirty(file_path, data):
+    """Schedule `data` to be written to `file_path` on the next flush"""
+    persistence_stats["marked"] += 1
+    batch = _active_batch()
+    if batch is not None:
+        batch.dirty[file_path] = data  # saved once when the batch commits
+        return
+    if _flush_task is None or _flush_task.done():
+        # No writer running (scripts, tooling) -> keep the old write-through behaviour
+        save_json(file_path, data)
+        persistence_stats["files_written"] += 1
+        return
+    if file_path in _dirty_collections:
+        persistence_stats["coalesced"] += 1
+    _dirty_collections[file_path] = data
+
+
+def flush_dirty():
+    """Write every dirty collection (and pending journal entries) to disk now"""
+    flush_journals()
+    if not _dirty_collections:
+        return 0
+    pending = list(_dirty_collections.items())
+    _dirty_collections.clear()
+    for file_path, data in pending:
+        _write_snapshot(file_path, data)
+    persistence_stats["flushes"] += 1
+    persistence_stats["files_written"] += len(pending)
+    return len(pending)
+
+
+async def _flush_loop(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            flush_dirty()
+        except Exception as e:
+            print(f"Error flushing data: {e}")
+
+
+def start_write_behind(interval: float = None):
+    """Start the background flusher (call from inside the running event loop)"""
+    global _flush_task
+    if _flush_task is not None and not _flush_task.done():
+        return _flush_task
+    snapshot_writer.start()
+    _flush_task = asyncio.get_running_loop().create_task(
+        _flush_loop(interval or SAVE_INTERVAL_SECONDS)
+    )
+    return _flush_task
+
+
+async def stop_write_behind():
+    """Stop the background flusher and write out anything still pending"""
+    global _flush_task
+    task, _flush_task = _flush_task, None
+    if task is not None and not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    loop = asyncio.get_running_loop()
+    flush_dirty()
+    # Let queued appends land so the forced compaction sees every journal
+    await loop.run_in_executor(None, snapshot_writer.drain)
+    compact_journals(force=True)
+    await loop.run_in_executor(None, snapshot_writer.stop)
+
+
+async def shutdown_storage():
+    """Flush pending writes and close the local store"""
+    await stop_write_behind()
+    if _sqlite is not None:
+        _sqlite.close()
+
+
+# ===== APPEND-ONLY JOURNAL =====
+# Keyed collections (users, teams, marketplace, transactions, bug hunt
+# lobbies) append each change to "<file>.journal" instead of rewriting the
+# whole snapshot. Entries are buffered and fsynced on every flush, load_json
+# replays them over the snapshot, and once a journal passes
+# JOURNAL_COMPACT_BYTES it is folded into a fresh snapshot. Every op is
+# idempotent (absolute values, never deltas; "push" appends carry a sequence
+# number and are skipped once applied), so replaying a journal that was
+# already folded in is harmless.
+_journal_buffers = {}
+_journal_sources = {}
+
+
+def _journal_path(file_path):
+    return file_path + ".journal"
+
+
+def _replay_journal(file_path, data):
+    path = _journal_path(file_path)
+    if not os.path.exists(path):
+        return data
+    try:
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json_loads(line)
+                except ValueError:
+                    break  # torn tail from a crash mid-append
+                key = str(entry.get("key"))
+                op = entry.get("op")
+                if op == "put":
+                    data[key] = entry.get("data", {})
+                elif op == "set":
+                    if key in data:
+                        data[key].update(entry.get("data", {}))
+                elif op == "del":
+                    data.pop(key, None)
+                elif op == "push":
+                    push = entry.get("data", {})
+                    record = data.setdefault(key, {"seq": 0, "entries": []})
+                    if push.get("seq", 0) > record.get("seq", 0):
+                        record["entries"] = (record["entries"] + [push.get("entry")])[-push.get("cap", 50):]
+                        record["seq"] = push["seq"]
+    except Exception as e:
+        print(f"Error replaying {path}: {e}")
+    return data
+
+
+def journal_record(file_path, data, op, key, value=None, flush=True):
+    """Append a put/set/del/push for `key` to the collection journal
+
+    `data` is the in-memory collection the entry applies to; it is what
+    gets written out when the journal is compacted. With flush=False the
+    entry stays buffered even when no flush task is running, so several
+    entries can go out together in one append (see LedgerData).
+    """
+    entry = {"op": op, "key": str(key)}
+    if value is not None:
+        entry["data"] = value
+    _journal_buffers.setdefault(file_path, []).append(json_dumps(entry))
+    _journal_sources[file_path] = data
+    persistence_stats["journal_entries"] += 1
+    batch = _active_batch()
+    if batch is not None:
+        batch.journaled = True  # appended once when the batch commits
+    elif flush and (_flush_task is None or _flush_task.done()):
+        flush_journals()
+
+
+def flush_journals():
+    """Append and fsync buffered journal entries, compacting oversized journals"""
+    for file_path, lines in list(_journal_buffers.items()):
+        if not lines:
+            continue
+        _journal_buffers[file_path] = []
+        path = _journal_path(file_path)
+        raw = b"\n".join(lines) + b"\n"
+        ensure_data_dirs()
+        if snapshot_writer.running:
+            snapshot_writer.append(path, raw)
+            continue
+        try:
+            append_durable(path, raw)
+        except Exception as e:
+            print(f"Error appending {path}: {e}")
+    compact_journals()
+
+
+def compact_journals(force: bool = False, files=None):
+    """Fold journals into fresh snapshots once they pass the size threshold
 
+    `files` limits compaction to those data files.
+    """
+    for file_path, data in list(_journal_sources.items()):
+        if files is not None and file_path not in files:
+            continue
+        path = _journal_path(file_path)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        if size == 0 or (not force and size < JOURNAL_COMPACT_BYTES):
+            continue
+        if _journal_buffers.get(file_path):
+            continue  # unflushed entries must reach the journal first
+        if snapshot_writer.is_pending(file_path):
+            continue  # a compaction is already queued
+        # The writer truncates the journal only once the snapshot is on disk,
+        # and after every append queued before it
+        _write_snapshot(file_path, data, truncate_journal=path)
+        persistence_stats["compactions"] += 1
+
+
+# Every JSON collection of the in-memory store, in creation order
+_collections = []
+
+
+def _load_collection(file_path, transform=None):
+    """A JSON collection for the in-memory store (empty under SQLite)
+
+    Nothing is read until the collection is first used, or until
+    load_collections() preloads everything at startup.
+    """
+    def load():
+        if STORAGE_BACKEND == "sqlite":
+            return {}
+        data = load_json(file_path, {})
+        return transform(data) if transform else data
+    collection = LazyCollection(os.path.basename(file_path), load)
+    _collections.append(collection)
+    return collection
+
+
+async def load_collections(parallel: bool = True):
+    """Load every collection that is still on disk, in an executor
+
+    With `parallel`, files are read on concurrent worker threads (parsing
+    holds the GIL, so this mostly overlaps disk reads); otherwise one after
+    another on a single worker. The SQLite store, if used, is opened too.
+    Returns {file name: seconds} for the collections loaded by this call.
+    """
+    ensure_data_dirs()
+    loop = asyncio.get_running_loop()
+    pending = [c for c in _collections if not c.loaded]
+    if parallel:
+        await asyncio.gather(*(loop.run_in_executor(None, c.load) for c in pending))
+    else:
+        def load_all():
+            for collection in pending:
+                collection.load()
+        await loop.run_in_executor(None, load_all)
+    files = {c.name: c.load_seconds for c in pending}
+    if _sqlite is not None:
+        started = time.perf_counter()
+        await _sqlite.open()
+        files[os.path.basename(SQLITE_PATH)] = time.perf_counter() - started
+    return files
+
+
+def _user_record(doc):
+    """How a user document is held in _memory_users (see compact_user.py)"""
+    return CompactUser(doc) if COMPACT_USERS else doc
 
-# Initial Load
-_memory_users = load_json(USERS_FILE, {})
-_memory_teams = load_json(TEAMS_FILE, {})
-_memory_marketplace = load_json(MARKETPLACE_FILE, {})
-_memory_transactions = load_json(TRANSACTIONS_FILE, {})
 
 # Convert string keys back to int for users if loaded from JSON
-_memory_users = {int(k): v for k, v in _memory_users.items()}
+_memory_users = _load_collection(
+    USERS_FILE, lambda data: {int(k): _user_record(v) for k, v in data.items()}
+)
+_memory_teams = _load_collection(TEAMS_FILE)
+_memory_marketplace = _load_collection(MARKETPLACE_FILE)
+_memory_transactions = _load_collection(TRANSACTIONS_FILE)
+
+
+def _upper_key(value):
+    return str(value).strip().upper() if value else None
+
+
+# Secondary indexes over the in-memory collections (see memory_index.py).
+# Every create/update below is followed by .put(), every delete by .drop().
+_team_indexes = CollectionIndexes(
+    _memory_teams,
+    invite_code=lambda t: [_upper_key(t.get("invite_code"))],
+    member=lambda t: t.get("members") or [],
+    category_id=lambda t: [t.get("category_id")],
+    public=lambda t: [] if t.get("private", True) else [True],
+)
+_listing_indexes = CollectionIndexes(
+    _memory_marketplace,
+    listing_id=lambda l: [_upper_key(l.get("listing_id"))],
+    seller_id=lambda l: [l.get("seller_id")],
+    status=lambda l: [l.get("status", "active")],
+)
+_transaction_indexes = CollectionIndexes(
+    _memory_transactions,
+    party=lambda t: [t.get("buyer_id"), t.get("seller_id")],
+)
+
+# ===== MONGO CIRCUIT BREAKER =====
+# `db` is wrapped so every Motor call goes through a health-tracked breaker.
+# After MONGO_BREAKER_THRESHOLD consecutive connection failures the breaker
+# opens: calls fail instantly with MongoUnavailable (so each method's existing
+# `except` falls straight through to the local store), writes are queued, and
+# a background task pings Mongo every MONGO_PROBE_INTERVAL seconds. When a ping
+# succeeds the queued writes are replayed in order and the breaker closes.
+
+class MongoUnavailable(Exception):
+    """Raised instead of touching Mongo while the circuit breaker is open"""
+
+
+_WRITE_METHODS = {
+    "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "find_one_and_update", "bulk_write",
+}
+
+try:
+    from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, InsertOne, ReturnDocument, UpdateOne
+    from pymongo.errors import ConnectionFailure as _MongoConnectionError
+except Exception:
+    ReturnDocument = UpdateOne = InsertOne = IndexModel = None
+    ASCENDING, DESCENDING, TEXT = 1, -1, "text"
+    _MongoConnectionError = OSError
+
+
+class MongoCircuitBreaker:
+
+    def __init__(self, client, threshold, probe_interval, max_queue):
+        self.client = client
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+        self.max_queue = max_queue
+        self.state = "closed"
+        self.failures = 0
+        self.pending_writes = []
+        self._dropped = 0  # since the last completed resync
+        self._probe_task = None
+        self.stats = {"trips": 0, "short_circuited": 0, "queued_writes": 0,
+                      "dropped_writes": 0, "resynced_writes": 0}
+
+    @property
+    def is_open(self):
+        return self.state == "open"
+
+    def record_success(self):
+        self.failures = 0
+        if self.pending_writes and self.state == "closed":
+            # writes that failed without tripping the breaker
+            self.state = "half_open"
+            asyncio.get_running_loop().create_task(self._resync())
+
+    def record_failure(self, error):
+        self.failures += 1
+        if self.state == "closed" and self.failures >= self.threshold:
+            self.trip(error)
+
+    def trip(self, error=None):
+        self.state = "open"
+        self.stats["trips"] += 1
+        print(f"⚠️ MongoDB circuit opened ({type(error).__name__}); serving from local storage")
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = loop.create_task(self._probe_loop())
+
+    def queue_write(self, coll_name, method, args, kwargs):
+        self.stats["queued_writes"] += 1
+        self.pending_writes.append((coll_name, method, args, kwargs))
+        if len(self.pending_writes) > self.max_queue:
+            self.pending_writes.pop(0)
+            self.stats["dropped_writes"] += 1
+            if not self._dropped:
+                print(f"⚠️ MongoDB resync queue full ({self.max_queue}); dropping the oldest queued writes")
+            self._dropped += 1
+
+    async def _probe_loop(self):
+        while self.state == "open":
+            await asyncio.sleep(self.probe_interval)
+            try:
+                await self.client.admin.command("ping")
+            except Exception:
+                continue
+            await self._resync()
+
+    async def _resync(self):
+        self.state = "half_open"
+        raw_db = self.client[DB_NAME]
+        while self.pending_writes:
+            coll_name, method, args, kwargs = self.pending_writes[0]
+            try:
+                if coll_name is None:
+                    await method(raw_db, *args, **kwargs)  # several writes queued as one unit
+                else:
+                    await getattr(raw_db[coll_name], method)(*args, **kwargs)
+            except _MongoConnectionError as e:
+                self.state = "open"  # went away again mid-resync; keep probing
+                print(f"⚠️ MongoDB resync interrupted: {e}")
+                return
+            except Exception:
+                pass  # duplicate keys etc. -- the local copy already won
+            self.pending_writes.pop(0)
+            self.stats["resynced_writes"] += 1
+        self.state = "closed"
+        self.failures = 0
+        print("✓ MongoDB reachable again; circuit closed")
+        if self._dropped:
+            print(f"⚠️ MongoDB resync incomplete: {self._dropped} writes were dropped while it was down "
+                  f"(raise MONGO_RESYNC_QUEUE); those changes exist only in local storage")
+            self._dropped = 0
+
+
+class _GuardedCursor:
+    """Cursor wrapper so `find(...).sort(...).limit(...).to_list(n)` is guarded"""
+
+    def __init__(self, breaker, cursor):
+        self._breaker = breaker
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name == "to_list":
+            async def guarded_to_list(*args, **kwargs):
+                return await _guarded_call(self._breaker, attr, args, kwargs)
+            return guarded_to_list
+
+        def chain(*args, **kwargs):
+            self._cursor = attr(*args, **kwargs)
+            return self
+        return chain
+
+
+class _GuardedCollection:
+
+    def __init__(self, breaker, collection):
+        self._breaker = breaker
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in ("find", "aggregate"):
+            def open_cursor(*args, **kwargs):
+                return _GuardedCursor(self._breaker, attr(*args, **kwargs))
+            return open_cursor
+        if not callable(attr):
+            return attr
+        if name in _BATCHED_METHODS:
+            batch = _active_batch()
+            if batch is not None:
+                async def queued(*args, **kwargs):
+                    batch.queue(self._collection.name, name, args, kwargs)
+                return queued
+
+        async def guarded(*args, **kwargs):
+            try:
+                return await _guarded_call(self._breaker, attr, args, kwargs)
+            except (MongoUnavailable, _MongoConnectionError):
+                if name in _WRITE_METHODS:
+                    self._breaker.queue_write(self._collection.name, name, args, kwargs)
+                raise
+        return guarded
+
+
+class _GuardedDatabase:
+
+    def __init__(self, breaker, database):
+        self._breaker = breaker
+        self._database = database
+
+    def __getitem__(self, name):
+        return _GuardedCollection(self._breaker, self._database[name])
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+
+async def _guarded_call(breaker, fn, args, kwargs):
+    if breaker.state != "closed":
+        breaker.stats["short_circuited"] += 1
+        raise MongoUnavailable("MongoDB circuit open")
+    try:
+        result = await fn(*args, **kwargs)
+    except _MongoConnectionError as e:
+        breaker.record_failure(e)
+        raise
+    breaker.record_success()
+    return result
+
+
+mongo_breaker = None
 
 try:
     import motor.motor_asyncio
     client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URI, serverSelectionTimeoutMS=2000)
-    db = client[DB_NAME]
+    mongo_breaker = MongoCircuitBreaker(
+        client, MONGO_BREAKER_THRESHOLD, MONGO_PROBE_INTERVAL, MONGO_RESYNC_QUEUE
+    )
+    db = _GuardedDatabase(mongo_breaker, client[DB_NAME])
     print("✓ MongoDB connected")
 except Exception as e:
     print(f"⚠️ MongoDB not available: {e}")
@@ -62,150 +704,1133 @@ except Exception as e:
     db = None
 
 
+# ===== WRITE BATCHES =====
+# Inside `async with db_batch():` the Mongo update_one/insert_one calls are
+# queued and go out as one bulk_write per collection when the block exits,
+# and local saves (mark_dirty snapshots, journal appends) are written once
+# at the end. UserProfile.increment joins the batch too unless it needs the
+# write's result (`floor` or `before`). Reads and every other write
+# (find_one_and_update, ...) still run immediately and don't see queued
+# writes, so a batch is for fan-out writes nobody reads back inside the
+# block. Ordered batches keep call order and stop at the first failing
+# collection; unordered ones send all collections concurrently and carry on
+# past errors.
+_BATCHED_METHODS = {"update_one", "insert_one"}
+_current_batch = contextvars.ContextVar("db_batch", default=None)
+batch_stats = {
+    "batches": 0, "ops": 0, "bulk_writes": 0, "errors": 0,
+    "last_ms": 0.0, "max_ms": 0.0, "total_ms": 0.0,
+}
+
+
+def _active_batch():
+    batch = _current_batch.get()
+    return batch if batch is not None and not batch.closed else None
+
+
+class WriteBatch:
+    """Writes collected by one db_batch() block"""
+
+    def __init__(self, ordered: bool = True):
+        self.ordered = ordered
+        self.closed = False
+        self.ops = {}    # collection -> [UpdateOne / InsertOne] in call order
+        self.dirty = {}  # file -> collection, saved once on exit
+        self.journaled = False
+        self.op_count = 0
+        self.failed = 0  # bulk writes that failed outright (not queued for resync)
+        self.elapsed_ms = None
+
+    def queue(self, collection, method, args, kwargs):
+        if method == "insert_one":
+            op = InsertOne(args[0] if args else kwargs["document"])
+        else:
+            query = args[0] if args else kwargs["filter"]
+            update = args[1] if len(args) > 1 else kwargs["update"]
+            op = UpdateOne(query, update, upsert=kwargs.get("upsert", False))
+        self.ops.setdefault(collection, []).append(op)
+        self.op_count += 1
+
+    async def _bulk(self, collection, ops):
+        try:
+            await db[collection].bulk_write(ops, ordered=self.ordered)
+            batch_stats["bulk_writes"] += 1
+            return True
+        except (MongoUnavailable, _MongoConnectionError):
+            batch_stats["errors"] += 1
+            return True  # queued for resync by the circuit breaker, in order
+        except Exception as e:
+            batch_stats["errors"] += 1
+            self.failed += 1
+            print(f"⚠️ Batched write of {len(ops)} ops to {collection} failed: {e}")
+            return False
+
+    async def commit(self):
+        self.closed = True
+        start = time.perf_counter()
+        ops, self.ops = self.ops, {}
+        if ops and db is not None:
+            if self.ordered:
+                for collection, coll_ops in ops.items():
+                    if not await self._bulk(collection, coll_ops):
+                        break
+            else:
+                await asyncio.gather(*(self._bulk(c, o) for c, o in ops.items()))
+        for file_path, data in self.dirty.items():
+            mark_dirty(file_path, data)
+        if self.journaled and (_flush_task is None or _flush_task.done()):
+            flush_journals()
+        self.elapsed_ms = round((time.perf_counter() - start) * 1000, 2)
+        batch_stats["batches"] += 1
+        batch_stats["ops"] += self.op_count
+        batch_stats["last_ms"] = self.elapsed_ms
+        batch_stats["max_ms"] = max(batch_stats["max_ms"], self.elapsed_ms)
+        batch_stats["total_ms"] = round(batch_stats["total_ms"] + self.elapsed_ms, 2)
+
+
+@contextlib.asynccontextmanager
+async def db_batch(ordered: bool = True):
+    """Collect the writes made inside the block and commit them together
+
+    Queued writes have no result yet: update_one/insert_one return None, and
+    so does UserProfile.increment (on every backend, so callers behave the
+    same everywhere). Pass `floor` or `before=True` to increment to run it
+    immediately with its result. A db_batch() inside another one joins the
+    outer batch.
+    """
+    outer = _active_batch()
+    if outer is not None:
+        yield outer
+        return
+    batch = WriteBatch(ordered)
+    token = _current_batch.set(batch)
+    try:
+        yield batch
+    finally:
+        _current_batch.reset(token)
+        await batch.commit()
+
+
+# ===== MONGO INDEXES =====
+# collection -> list of (keys, options); keys are (field, direction) pairs
+MONGO_INDEXES = {
+    "users": [
+        ([("level", DESCENDING)], {}),
+        ([("xp", DESCENDING)], {}),
+        ([("duel_wins", DESCENDING)], {}),
+    ],
+    "teams": [
+        ([("members", ASCENDING)], {}),
+        ([("private", ASCENDING)], {}),
+        ([("invite_code", ASCENDING)], {}),
+        ([("category_id", ASCENDING)], {}),
+    ],
+    "marketplace": [
+        ([("listing_id", ASCENDING)], {}),
+        ([("status", ASCENDING), ("category", ASCENDING)], {}),
+        ([("seller_id", ASCENDING)], {}),
+        ([("title", TEXT), ("description", TEXT)],
+         {"weights": {"title": 3, "description": 1}, "name": "listing_text"}),
+        # One per /shop sort mode, with and without a category filter
+        *[([("status", ASCENDING), (field, DESCENDING), ("_id", DESCENDING)], {})
+          for field in ("created_at", "price", "rating", "sold")],
+        *[([("status", ASCENDING), ("category", ASCENDING), (field, DESCENDING), ("_id", DESCENDING)], {})
+          for field in ("created_at", "price", "rating", "sold")],
+    ],
+    "transactions": [
+        ([("buyer_id", ASCENDING)], {}),
+        ([("seller_id", ASCENDING)], {}),
+    ],
+    "duels": [
+        ([("winner_id", ASCENDING), ("loser_id", ASCENDING)], {}),
+        ([("loser_id", ASCENDING), ("winner_id", ASCENDING)], {}),
+    ],
+    "active_duels": [
+        ([("status", ASCENDING), ("guild_id", ASCENDING)], {}),
+    ],
+    "bughunt": [
+        ([("status", ASCENDING), ("guild_id", ASCENDING)], {}),
+    ],
+}
+
+# Records that expire: collection -> (timestamp field, TTL in seconds, 0 = never).
+# Mongo removes them itself through a TTL index on TTL_FIELD, a BSON date
+# stamped on every Mongo write (TTL indexes ignore the ISO strings the
+# timestamp fields hold); ttl_sweeper covers older documents and the local
+# stores.
+TTL_FIELD = "ttl_at"
+TTL_POLICIES = {
+    "active_duels": ("created_at", ACTIVE_DUEL_TTL),
+    "bughunt": ("created_at", BUGHUNT_LOBBY_TTL),
+    "vouches": ("last_vouch", VOUCH_TTL),
+    "transactions": ("created_at", TRANSACTION_TTL),
+}
+for _coll, (_field, _ttl) in TTL_POLICIES.items():
+    if _ttl > 0:
+        MONGO_INDEXES.setdefault(_coll, []).append(([(TTL_FIELD, ASCENDING)], {"expireAfterSeconds": _ttl}))
+
+
+async def ensure_indexes():
+    """Create the indexes the hot queries rely on (no-op if they already exist)"""
+    if db is None:
+        return 0
+    created = 0
+    for coll, indexes in MONGO_INDEXES.items():
+        try:
+            names = await db[coll].create_indexes(
+                [IndexModel(keys, **options) for keys, options in indexes]
+            )
+            created += len(names)
+        except Exception as e:
+            print(f"⚠️ Could not create indexes on {coll}: {e}")
+            if mongo_breaker is not None and mongo_breaker.is_open:
+                break
+    if created:
+        print(f"✓ Ensured {created} MongoDB indexes")
+    return created
+
+
+def _projection(fields):
+    """Mongo projection for a `fields` list (None -> whole document)"""
+    if not fields:
+        return None
+    return {field: 1 for field in fields}
+
+
+def _sqlite_seed():
+    """Existing JSON data, imported once when the SQLite database is created"""
+    users = load_json(USERS_FILE, {})
+    return {
+        "users": {int(k): v for k, v in users.items()},
+        "teams": load_json(TEAMS_FILE, {}),
+        "marketplace": load_json(MARKETPLACE_FILE, {}),
+        "transactions": load_json(TRANSACTIONS_FILE, {}),
+        "duels": load_json(DUEL_FILE, {}),
+        "duel_config": load_json(DUEL_CONFIG_FILE, {}),
+        "active_duels": load_json(ACTIVE_DUELS_FILE, {}),
+        "bughunt": load_json(BUGHUNT_FILE, {}),
+        "vouches": load_json(VOUCH_FILE, {}),
+    }
+
+
+# Optional SQLite backend: replaces the in-memory dicts + JSON files for
+# servers that outgrow RAM but don't run MongoDB. Like the JSON collections
+# it is opened (and seeded) by load_collections() at startup or on first use.
+_sqlite = None
+if STORAGE_BACKEND == "sqlite":
+    from sqlite_store import SQLiteStore
+    _sqlite = SQLiteStore(SQLITE_PATH, seed=_sqlite_seed)
+    print(f"✓ Using SQLite storage ({SQLITE_PATH})")
+
+
+# ===== USER DOCUMENT CACHE =====
+class LRUCache:
+    """Bounded LRU cache with a per-entry TTL and hit/miss/eviction counters"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+        self._data.move_to_end(key)
+        self.stats["hits"] += 1
+        return value
+
+    def peek(self, key):
+        """Cached value without touching recency or counters"""
+        entry = self._data.get(key)
+        return entry[1] if entry is not None else None
+
+    def put(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, key):
+        if self._data.pop(key, None) is not None:
+            self.stats["invalidations"] += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def info(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+        }
+
+
+# Shared by every cog. Only used when user documents live outside process
+# memory (Mongo or SQLite); the plain JSON store already is an in-memory map.
+user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+
+def _user_cache_enabled():
+    return USER_CACHE_SIZE > 0 and (db is not None or _sqlite is not None)
+
+
+# ===== USER SCHEMA =====
+# Every user field and its default, in one place. A user document only
+# stores what differs from these defaults (plus USER_STORED_FIELDS); reads
+# resolve the rest, so new fields cost nothing until a user actually sets
+# them. Documents written before a schema change carry an older
+# `schema_version`: reads upgrade them in memory, and MigrationRunner
+# rewrites them in storage (see MIGRATION RUNNER below).
+USER_SCHEMA_VERSION = 3
+
+USER_DEFAULTS = {
+    "roles": [],
+    "rank": "Beginner",
+    "xp": 0,
+    "level": 1,
+    "experience_months": 0,
+    "voice_minutes": 0,
+    "message_count": 0,
+    "reputation": 0,
+    "studio_credits": 10,
+    "pcredits": 0,
+    "ai_credits": 0,
+    "max_teams": 3,
+    "max_projects": 2,
+    # Premium unlocks
+    "has_agent_mode": False,
+    "has_super_agent": False,
+    "has_premium_badge": False,
+    "has_custom_color": False,
+    "has_team_storage": False,
+    "has_team_banner": False,
+    "has_featured_listing": False,
+    "custom_color": None,
+    "auto_agent_switch": False,
+    "temp_chat_cooldown": None,
+    "last_quest": None,
+    "last_daily": None,
+    "daily_streak": 0,
+    "daily_claims": 0,
+    "portfolio_games": [],
+    "reviews_given": 0,
+    "reviews_received": [],
+    "sales_count": 0,
+    "purchases_count": 0,
+    "claimed_quests": [],
+    "seller_rating": 5.0,
+    "can_sell": True,
+    # Duels
+    "duel_wins": 0,
+    "duel_losses": 0,
+    "duel_draws": 0,
+    "duel_credits_won": 0,
+    "duel_credits_lost": 0,
+    "duel_streak": 0,
+    "duel_best_streak": 0,
+    "duel_rank": "Novice Duelist",
+    "duel_title_emoji": "🥉",
+    "duel_powerups": {
+        "shield": 0,
+        "extra_time": 0,
+        "peek": 0,
+        "sabotage": 0,
+        "reroll": 0
+    },
+    # Bug hunt
+    "bughunt_wins": 0,
+    "bughunt_games": 0,
+    "bughunt_bugs_found": 0,
+    "bughunt_powerups": {
+        "hint": 0,
+        "time_freeze": 0,
+        "auto_find": 0,
+        "shield": 0,
+        "bug_bomb": 0,
+        "reveal": 0
+    },
+    # /learn
+    "learn_lesson": 1,
+    "learn_phase": "menu",
+    "learn_model_mode": "auto",
+    "learn_quiz_data": {},
+    "learn_panel_message_id": None,
+    "learn_channel_id": None,
+    "learn_completed_lessons": [],
+    "learn_quiz_scores": {},
+    "learn_hints_used": 0,
+    "learn_total_questions": 0,
+    "learn_correct_answers": 0,
+    "learn_bookmarks": [],
+    "learn_notes": {},
+    "learn_streak": 0,
+    "learn_last_activity": None,
+    "learn_quiz_attempts": 0,
+    "learn_weak_topics": {},
+    "learn_strong_topics": {},
+    "learn_question_history": [],
+    "learn_quiz_questions": [],
+    "learn_current_quiz_index": 0,
+    "learn_hints_remaining": 3,
+    "learn_lesson_part": 0,
+}
+
+# Written even when equal to the default. studio_credits is $inc'ed from a
+# non-zero default, and $inc on a missing field would count from 0.
+USER_STORED_FIELDS = {"_id", "username", "player_id", "created_at", "schema_version", "studio_credits"}
+
+# $inc counts a missing field up from 0, not from its default, so a sparse
+# field can only be incremented if it defaults to 0
+_NON_ZERO_DEFAULTS = {
+    field for field, default in USER_DEFAULTS.items()
+    if field not in USER_STORED_FIELDS and isinstance(default, (int, float))
+    and not isinstance(default, bool) and default != 0
+}
+
+
+def _check_increment_fields(fields):
+    bad = _NON_ZERO_DEFAULTS.intersection(fields)
+    if bad:
+        raise ValueError(f"can't increment {', '.join(sorted(bad))}: missing values default to non-zero "
+                         f"(use update_user, or $max for level)")
+
+
+# dict defaults whose keys are always present on read
+_NESTED_DEFAULTS = [field for field, default in USER_DEFAULTS.items() if isinstance(default, dict) and default]
+
+
+def _user_default(field):
+    default = USER_DEFAULTS[field]
+    return copy.deepcopy(default) if isinstance(default, (dict, list)) else default
+
+
+def _with_defaults(doc: dict, fields: list = None):
+    """A copy of a stored user document with its missing fields resolved
+
+    With `fields` (a projected read) only those fields are filled in. Nested
+    dicts and lists are copied too, so callers can't edit the cached document.
+    """
+    if doc is None:
+        return None
+    user = {}
+    for field in (USER_DEFAULTS if fields is None else fields):
+        if field not in doc and field in USER_DEFAULTS:
+            user[field] = _user_default(field)
+    for field, value in doc.items():
+        user[field] = copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+    for field in _NESTED_DEFAULTS:
+        # $inc on "duel_powerups.shield" stores a partial dict
+        value = user.get(field)
+        if isinstance(value, dict) and value.keys() != USER_DEFAULTS[field].keys():
+            user[field] = {**USER_DEFAULTS[field], **value}
+    return user
+
+
+def _is_default(field, value):
+    return field in USER_DEFAULTS and field not in USER_STORED_FIELDS and USER_DEFAULTS[field] == value
+
+
+def _sparse_updates(updates: dict):
+    """Split a $set into (fields to set, fields to unset because they are back at their default)"""
+    sets, unsets = {}, []
+    for field, value in updates.items():
+        if _is_default(field, value):
+            unsets.append(field)
+        else:
+            sets[field] = value
+    return sets, unsets
+
+
+def _migrate_sparse(doc: dict):
+    """v1 -> v2: drop every field that just repeats its default"""
+    return {}, [field for field, value in doc.items() if _is_default(field, value)]
+
+
+def _migrate_roles(doc: dict):
+    """v2 -> v3: fold the old single `role` into `roles`, complete powerup dicts"""
+    sets, unsets = {}, []
+    roles = doc.get("roles") or []
+    if isinstance(roles, str):
+        roles = [roles]
+    role = doc.get("role")
+    if role and role != "None" and role not in roles:
+        roles = [role] + list(roles)
+    if roles != doc.get("roles", []):
+        sets["roles"] = roles
+    if "role" in doc:
+        unsets.append("role")
+    for field in _NESTED_DEFAULTS:
+        value = doc.get(field)
+        if isinstance(value, dict):
+            full = {**USER_DEFAULTS[field], **value}
+            if full == USER_DEFAULTS[field]:
+                unsets.append(field)
+            elif full != value:
+                sets[field] = full
+    return sets, unsets
+
+
+# target version -> fn(doc) -> ($set, $unset fields)
+USER_MIGRATIONS = {
+    2: _migrate_sparse,
+    3: _migrate_roles,
+}
+
+
+def _migrate_user_doc(doc: dict):
+    """Bring a stored document up to USER_SCHEMA_VERSION in place
+
+    Returns the ($set, $unset) that has to be written back, or None if the
+    document is already current.
+    """
+    version = doc.get("schema_version", 1)
+    if version >= USER_SCHEMA_VERSION:
+        return None
+    stored = list(doc)
+    touched = ["schema_version"]
+    for target in range(version + 1, USER_SCHEMA_VERSION + 1):
+        step_set, step_unset = USER_MIGRATIONS[target](doc)
+        for field in step_unset:
+            doc.pop(field, None)
+        doc.update(step_set)
+        touched += step_set
+    doc["schema_version"] = USER_SCHEMA_VERSION
+    sets = {field: doc[field] for field in touched if field in doc}
+    return sets, [field for field in stored if field not in doc]
+
+
+def _upgraded_user(doc: dict):
+    """`doc` as of USER_SCHEMA_VERSION: itself if current, else an upgraded copy"""
+    if doc.get("schema_version", 1) >= USER_SCHEMA_VERSION:
+        return doc
+    doc = dict(doc)
+    _migrate_user_doc(doc)
+    return doc
+
+
+async def _write_user_fields(user_id, sets: dict, unsets: list, expect: dict = None):
+    """Persist a $set + $unset on one user (no cache/leaderboard bookkeeping)
+
+    With `expect` ({field: value}) the unsets only happen where the stored
+    value is still the expected one, so a concurrent write is not undone.
+    """
+    if db is not None:
+        query = {"_id": user_id, **(expect or {})}
+        update = {}
+        if sets:
+            update["$set"] = sets
+        if unsets:
+            update["$unset"] = {f: "" for f in unsets}
+        try:
+            await db["users"].update_one(query, update)
+        except Exception:
+            pass
+
+    if _sqlite is not None:
+        if unsets:
+            await _sqlite.unset("users", user_id, unsets, sets, expect)
+        else:
+            await _sqlite.update("users", user_id, sets)
+    elif user_id in _memory_users:
+        user = _memory_users[user_id]
+        user.update(sets)
+        if unsets:
+            for field in unsets:
+                user.pop(field, None)
+            journal_record(USERS_FILE, _memory_users, "put", user_id, user)
+        else:
+            journal_record(USERS_FILE, _memory_users, "set", user_id, sets)
+
+
+def _increment_floors(inc: dict, floor):
+    """{field: minimum} for every decremented field covered by `floor`"""
+    if floor is None:
+        return {}
+    if isinstance(floor, dict):
+        return {f: m for f, m in floor.items() if f in inc}
+    return {f: floor for f, delta in inc.items() if delta < 0}
+
+
+def _apply_increment(doc: dict, inc: dict, set: dict = None, max: dict = None):
+    """Apply $inc/$set/$max semantics to a local document in place"""
+    for field, delta in inc.items():
+        doc[field] = doc.get(field, 0) + delta
+    if set:
+        doc.update(set)
+    for field, value in (max or {}).items():
+        current = doc.get(field)
+        if current is None or value > current:
+            doc[field] = value
+    changed = list(inc) + list(set or {}) + list(max or {})
+    return {field: doc[field] for field in changed}
+
+
+def _mirror_increment(user_id, inc: dict, set: dict = None, max: dict = None):
+    """Apply a Mongo increment that returned no document to the cached user and the JSON mirror"""
+    cached = user_cache.peek(user_id)
+    mirror = _memory_users.get(user_id)
+    if cached is not None and cached is not mirror:
+        _apply_increment(cached, inc, set, max)
+    if mirror is not None:
+        changed = _apply_increment(mirror, inc, set, max)
+        journal_record(USERS_FILE, _memory_users, "set", user_id, changed)
+
+
 def _generate_invite_code():
     """Generate a random 6-char uppercase invite code"""
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
 
 
+# ===== LEADERBOARDS =====
+# Every ranking is kept sorted as users change, instead of sorting the whole
+# user collection per request. Each board is a sorted list of
+# (-score..., user_id) keys: rank lookups are a bisect, a page is a slice.
+# The index holds a small row (LEADERBOARD_FIELDS) per user so pages can be
+# rendered without fetching full documents; every row change is also fed to
+# the /stats aggregates (see aggregates.py).
+
+# Enough of a user to render a leaderboard row
+LEADERBOARD_FIELDS = [
+    "username", "rank", "roles", "xp", "level", "reputation",
+    "studio_credits", "pcredits", "ai_credits", "message_count", "voice_minutes",
+    "duel_wins", "duel_losses", "duel_draws", "duel_streak", "duel_best_streak",
+    "duel_rank", "duel_title_emoji",
+]
+
+# metric -> score tuple (higher ranks first)
+LEADERBOARD_METRICS = {
+    "xp": lambda u: (u.get("xp") or 0,),
+    "level": lambda u: (u.get("level") or 1, u.get("xp") or 0),
+    "reputation": lambda u: (u.get("reputation") or 0,),
+    "credits": lambda u: (u.get("studio_credits") or 0,),
+    "wealth": lambda u: ((u.get("pcredits") or 0) * 1000 + (u.get("studio_credits") or 0),),
+    "messages": lambda u: (u.get("message_count") or 0,),
+    "voice": lambda u: (u.get("voice_minutes") or 0,),
+    "ai": lambda u: (u.get("ai_credits") or 0,),
+    "duel_wins": lambda u: (u.get("duel_wins") or 0,),
+}
+
+
+class Leaderboard:
+    """One metric's ranking"""
+
+    def __init__(self, score_fn):
+        self.score_fn = score_fn
+        self._keys = []
+        self._key_of = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, user_id, row):
+        key = tuple(-v for v in self.score_fn(row)) + (user_id,)
+        old = self._key_of.get(user_id)
+        if old == key:
+            return
+        if old is not None:
+            del self._keys[bisect_left(self._keys, old)]
+        insort(self._keys, key)
+        self._key_of[user_id] = key
+
+    def remove(self, user_id):
+        old = self._key_of.pop(user_id, None)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, old)]
+
+    def rank(self, user_id):
+        key = self._key_of.get(user_id)
+        if key is None:
+            return None
+        return bisect_left(self._keys, key) + 1
+
+    def slice(self, start, count):
+        return [key[-1] for key in self._keys[start:start + count]]
+
+
+class LeaderboardIndex:
+    """All leaderboards plus the per-user rows they rank"""
+
+    def __init__(self, metrics, aggregates=None):
+        self.rows = {}
+        self.boards = {name: Leaderboard(fn) for name, fn in metrics.items()}
+        self.aggregates = aggregates
+        self.ready = False
+        self._build_lock = None
+
+    async def ensure_built(self):
+        if not self.ready:
+            await self.rebuild()
+
+    async def rebuild(self):
+        """(Re)load every user's row from storage"""
+        if self._build_lock is None:
+            self._build_lock = asyncio.Lock()
+        async with self._build_lock:
+            if self.aggregates is not None and not self.ready:
+                # Keeps the persisted history; the totals are recomputed below
+                self.aggregates.load(load_json(AGGREGATES_FILE, {}))
+            docs = await _load_leaderboard_rows()
+            self.rows = {}
+            self.boards = {name: Leaderboard(b.score_fn) for name, b in self.boards.items()}
+            for doc in docs:
+                self._put(doc)
+            self.ready = True
+            if self.aggregates is not None:
+                drift = self.aggregates.rebuild(self.rows.values())
+                self._aggregates_changed()
+                return drift
+            return {}
+
+    def _put(self, doc):
+        user_id = doc.get("_id")
+        if user_id is None:
+            return None
+        row = {"_id": user_id}
+        for field in LEADERBOARD_FIELDS:
+            if field in doc:
+                row[field] = doc[field]
+            elif field in USER_DEFAULTS:
+                row[field] = _user_default(field)
+        old = self.rows.get(user_id)
+        self.rows[user_id] = row
+        for board in self.boards.values():
+            board.update(user_id, row)
+        return old, row
+
+    def _aggregates_changed(self):
+        mark_dirty(AGGREGATES_FILE, self.aggregates.data)
+
+    def put(self, doc):
+        """A user was created (or fully replaced)"""
+        if not self.ready:
+            return
+        put = self._put(doc)
+        if put is None or self.aggregates is None:
+            return
+        old, row = put
+        if old is None:
+            self.aggregates.add(row)
+        else:
+            self.aggregates.change(old, row)
+        self._aggregates_changed()
+
+    def apply(self, user_id, inc=None, set=None, max=None):
+        """Mirror a write ($inc/$set/$max) onto the user's row and re-rank them"""
+        if not self.ready:
+            return
+        row = self.rows.get(user_id)
+        if row is None:
+            return
+        inc = {f: d for f, d in (inc or {}).items() if f in LEADERBOARD_FIELDS}
+        set = {f: v for f, v in (set or {}).items() if f in LEADERBOARD_FIELDS}
+        max = {f: v for f, v in (max or {}).items() if f in LEADERBOARD_FIELDS}
+        if not (inc or set or max):
+            return
+        old = dict(row) if self.aggregates is not None else None
+        _apply_increment(row, inc, set, max)
+        for board in self.boards.values():
+            board.update(user_id, row)
+        if old is not None and self.aggregates.change(old, row):
+            self._aggregates_changed()
+
+    def remove(self, user_id):
+        row = self.rows.pop(user_id, None)
+        for board in self.boards.values():
+            board.remove(user_id)
+        if row is not None and self.aggregates is not None:
+            self.aggregates.remove(row)
+            self._aggregates_changed()
+
+    def page(self, metric, start, count):
+        board = self.boards.get(metric) or self.boards["xp"]
+        return [self.rows[uid] for uid in board.slice(max(start, 0), count)]
+
+    def rank(self, metric, user_id):
+        board = self.boards.get(metric) or self.boards["xp"]
+        return board.rank(user_id)
+
+    def total(self, metric):
+        board = self.boards.get(metric) or self.boards["xp"]
+        return len(board)
+
+
+async def _load_leaderboard_rows():
+    if db is not None:
+        try:
+            return await db["users"].find({}, _projection(LEADERBOARD_FIELDS)).to_list(None)
+        except Exception:
+            pass
+    if _sqlite is not None:
+        return await _sqlite.find("users")
+    return list(_memory_users.values())
+
+
+user_aggregates = UserAggregates(STATS_HISTORY_INTERVAL, STATS_HISTORY_SIZE)
+leaderboards = LeaderboardIndex(LEADERBOARD_METRICS, user_aggregates)
+
+
 class UserProfile:
     """User data model"""
 
     @staticmethod
     async def create_user(user_id: int, username: str):
+        """Create a user; only identity fields are stored, everything else
+        resolves to its USER_DEFAULTS entry on read"""
         player_id = f"DEV-{str(user_id)[-6:]}-{str(uuid.uuid4())[:4].upper()}"
         user = {
             "_id": user_id,
             "username": username,
             "player_id": player_id,
-            "role": None,
-            "roles": [],
-            "rank": "Beginner",
-            "xp": 0,
-            "level": 1,
-            "experience_months": 0,
-            "voice_minutes": 0,
-            "message_count": 0,
-            "reputation": 0,
-            "studio_credits": 10,
-            "pcredits": 0,
-            "ai_credits": 0,
-            "max_teams": 3,
-            "max_projects": 2,
-            # Premium unlocks
-            "has_agent_mode": False,
-            "has_super_agent": False,
-            "has_premium_badge": False,
-            "has_custom_color": False,
-            "has_team_storage": False,
-            "has_team_banner": False,
-            "has_featured_listing": False,
-            "custom_color": None,
-            "auto_agent_switch": False,
-            "temp_chat_cooldown": None,
-            "created_at":
-            datetime.utcnow().isoformat(),
-            "last_quest": None,
-            "last_daily": None,
-            "daily_streak": 0,
-            "daily_claims": 0,
-            "portfolio_games": [],
-            "reviews_given": 0,
-            "reviews_received": [],
-            "sales_count": 0,
-            "purchases_count": 0,
-            "claimed_quests": [],
-            "seller_rating": 5.0,
-            "can_sell": True,
-            "duel_wins": 0,
-            "duel_losses": 0,
-            "duel_draws": 0,
-            "duel_credits_won": 0,
-            "duel_credits_lost": 0,
-            "duel_streak": 0,
-            "duel_best_streak": 0,
-            "duel_rank": "Novice Duelist",
-            "duel_title_emoji": "🥉",
-            "duel_history": [],
-            "duel_powerups": {
-                "shield": 0,
-                "extra_time": 0,
-                "peek": 0,
-                "sabotage": 0,
-                "reroll": 0
-            },
-            
-            "bughunt_wins": 0,
-            "bughunt_games": 0,
-            "bughunt_bugs_found": 0,
-            "bughunt_powerups": {
-                "hint": 0,
-                "time_freeze": 0,
-                "auto_find": 0,
-                "shield": 0,
-                "bug_bomb": 0,
-                "reveal": 0
-            },
+            "studio_credits": USER_DEFAULTS["studio_credits"],
+            "created_at": datetime.utcnow().isoformat(),
+            "schema_version": USER_SCHEMA_VERSION,
         }
-            
+
         if db is not None:
             try:
                 await db["users"].insert_one(user)
             except Exception:
                 pass
 
-        _memory_users[user_id] = user
-        save_json(USERS_FILE, _memory_users)
-        return user
+        if _user_cache_enabled():
+            user_cache.put(user_id, user)
+        leaderboards.put(user)
+
+        if _sqlite is not None:
+            await _sqlite.insert("users", user)
+            return _with_defaults(user)
+
+        _memory_users[user_id] = _user_record(user)
+        journal_record(USERS_FILE, _memory_users, "put", user_id, user)
+        return _with_defaults(user)
 
     @staticmethod
-    async def get_user(user_id: int):
+    async def get_user(user_id: int, fields: list = None):
+        """Fetch a user document
+
+        `fields` limits what Mongo sends back (e.g. ["ai_credits"] for a
+        credit check); the result may still contain more fields when it is
+        served from the cache or local storage. Partial documents are never
+        cached.
+
+        The result is a copy with schema defaults filled in (see
+        USER_DEFAULTS); documents on an older schema_version are upgraded
+        on the way, without writing them back (MigrationRunner does that).
+        """
+        caching = _user_cache_enabled()
+        if caching:
+            user = user_cache.get(user_id)
+            if user is not None:
+                return _with_defaults(user, fields)
         if db is not None:
             try:
-                user = await db["users"].find_one({"_id": user_id})
+                user = await db["users"].find_one({"_id": user_id}, _projection(fields))
                 if user:
-                    return user
+                    if fields:
+                        return _with_defaults(user, fields)
+                    user = _upgraded_user(user)
+                    if caching:
+                        user_cache.put(user_id, user)
+                    return _with_defaults(user)
             except Exception:
                 pass
-        return _memory_users.get(user_id)
+        if _sqlite is not None:
+            user = await _sqlite.get("users", user_id)
+            if user is not None:
+                user = _upgraded_user(user)
+                if caching:
+                    user_cache.put(user_id, user)
+            return _with_defaults(user, fields)
+        user = _memory_users.get(user_id)
+        if user is not None:
+            user = _upgraded_user(user)
+        return _with_defaults(user, fields)
+
+    @staticmethod
+    def invalidate_user(user_id: int):
+        """Drop a user from the document cache (next get_user re-reads storage)"""
+        user_cache.invalidate(user_id)
 
     @staticmethod
     async def update_user(user_id: int, updates: dict):
+        """$set fields on a user; values back at their default are unset instead"""
+        sets, unsets = _sparse_updates(updates)
+        cached = user_cache.peek(user_id)
+        if cached is not None:
+            cached.update(sets)
+            for field in unsets:
+                cached.pop(field, None)
+        leaderboards.apply(user_id, set=updates)
+        await _write_user_fields(user_id, sets, unsets)
+
+    @staticmethod
+    async def unset_fields(user_id: int, fields: list):
+        """Remove fields from a user document"""
+        cached = user_cache.peek(user_id)
+        if cached is not None:
+            for field in fields:
+                cached.pop(field, None)
+
         if db is not None:
             try:
-                await db["users"].update_one({"_id": user_id}, {"$set": updates})
+                await db["users"].update_one({"_id": user_id}, {"$unset": {f: "" for f in fields}})
             except Exception:
                 pass
 
-        if user_id in _memory_users:
-            _memory_users[user_id].update(updates)
-            save_json(USERS_FILE, _memory_users)
+        if _sqlite is not None:
+            await _sqlite.unset("users", user_id, fields)
+        elif user_id in _memory_users:
+            user = _memory_users[user_id]
+            for field in fields:
+                user.pop(field, None)
+            journal_record(USERS_FILE, _memory_users, "put", user_id, user)
 
     @staticmethod
-    async def add_xp(user_id: int, amount: int):
-        user = await UserProfile.get_user(user_id)
-        if not user:
-            return
-        new_xp = user.get("xp", 0) + amount
-        level = (new_xp // 250) + 1
-        await UserProfile.update_user(user_id, {"xp": new_xp, "level": level})
+    async def increment(user_id: int, inc: dict, set: dict = None, floor=None,
+                        max: dict = None, before: bool = False):
+        """Atomically add `inc` ({field: delta}) to a user's counters in one round-trip
+
+        `set` and `max` are applied in the same write ($set / $max). `floor`
+        is the minimum a decremented field may reach -- a number for every
+        negative delta or {field: minimum}; if it would be crossed nothing is
+        written. Returns the updated user (the pre-update one with
+        before=True), or None if the user is missing or the floor check failed.
+        Inside db_batch() without `floor` or `before` the write joins the
+        batch and None is returned. Raises ValueError for fields with a
+        non-zero default (see _NON_ZERO_DEFAULTS).
+        """
+        _check_increment_fields(inc)
+        inc = {f: d for f, d in inc.items() if d}
+        floors = _increment_floors(inc, floor)
+        if not (inc or set or max):
+            return None if _active_batch() is not None else await UserProfile.get_user(user_id)
+        if not (floors or before) and _active_batch() is not None:
+            await UserProfile._queue_increment(user_id, inc, set, max)
+            return None
+
+        if db is not None:
+            try:
+                query = {"_id": user_id}
+                for field, minimum in floors.items():
+                    query[field] = {"$gte": minimum - inc[field]}
+                update = {}
+                if inc:
+                    update["$inc"] = inc
+                if set:
+                    update["$set"] = set
+                if max:
+                    update["$max"] = max
+                user = await db["users"].find_one_and_update(
+                    query, update,
+                    return_document=ReturnDocument.BEFORE if before else ReturnDocument.AFTER
+                )
+                if user is None:
+                    user_cache.invalidate(user_id)
+                    return None
+                leaderboards.apply(user_id, inc, set, max)
+                if before:
+                    user_cache.invalidate(user_id)
+                elif _user_cache_enabled():
+                    user_cache.put(user_id, user)
+                mirror = _memory_users.get(user_id)
+                if mirror is not None:
+                    changed = _apply_increment(mirror, inc, set, max)
+                    journal_record(USERS_FILE, _memory_users, "set", user_id, changed)
+                return _with_defaults(user)
+            except Exception:
+                pass
+
+        if _sqlite is not None:
+            user = await _sqlite.increment("users", user_id, inc, set, floors, max, before)
+            if user is not None:
+                leaderboards.apply(user_id, inc, set, max)
+            if before or user is None:
+                user_cache.invalidate(user_id)
+            elif _user_cache_enabled():
+                user_cache.put(user_id, user)
+            return _with_defaults(user)
+
+        # No await between the check and the write, so this is atomic on the event loop
+        user = _memory_users.get(user_id)
+        if user is None:
+            return None
+        for field, minimum in floors.items():
+            if user.get(field, 0) + inc[field] < minimum:
+                return None
+        old = _with_defaults(user) if before else None
+        changed = _apply_increment(user, inc, set, max)
+        journal_record(USERS_FILE, _memory_users, "set", user_id, changed)
+        leaderboards.apply(user_id, inc, set, max)
+        return old if before else _with_defaults(user)
 
     @staticmethod
-    async def add_credits(user_id: int, amount: int):
-        user = await UserProfile.get_user(user_id)
-        if not user:
+    async def _queue_increment(user_id: int, inc: dict, set: dict = None, max: dict = None):
+        """increment() inside a db_batch(): nothing is read back"""
+        if db is not None:
+            update = {}
+            if inc:
+                update["$inc"] = inc
+            if set:
+                update["$set"] = set
+            if max:
+                update["$max"] = max
+            try:
+                await db["users"].update_one({"_id": user_id}, update)
+            except Exception:
+                pass
+            leaderboards.apply(user_id, inc, set, max)
+            _mirror_increment(user_id, inc, set, max)
+            return
+        if _sqlite is not None:
+            user = await _sqlite.increment("users", user_id, inc, set, None, max)
+            if user is not None:
+                leaderboards.apply(user_id, inc, set, max)
+                if _user_cache_enabled():
+                    user_cache.put(user_id, user)
             return
-        new_credits = user.get("studio_credits", 0) + amount
-        await UserProfile.update_user(user_id, {"studio_credits": new_credits})
+        user = _memory_users.get(user_id)
+        if user is not None:
+            changed = _apply_increment(user, inc, set, max)
+            journal_record(USERS_FILE, _memory_users, "set", user_id, changed)
+            leaderboards.apply(user_id, inc, set, max)
 
     @staticmethod
-    async def get_top_users(limit: int = 10):
+    async def bulk_increment(deltas: dict):
+        """Apply {user_id: {field: delta}} for many users in one bulk write
+
+        Levels of users whose XP changed are recomputed afterwards (one more
+        bulk write, only for users who actually levelled up). Unknown users
+        are skipped. Returns the number of users updated. Raises ValueError
+        like increment() does.
+        """
+        for inc in deltas.values():
+            _check_increment_fields(inc)
+        deltas = {uid: {f: d for f, d in inc.items() if d} for uid, inc in deltas.items()}
+        deltas = {uid: inc for uid, inc in deltas.items() if inc}
+        if not deltas:
+            return 0
+        xp_users = [uid for uid, inc in deltas.items() if "xp" in inc]
+
         if db is not None:
             try:
-                return await db["users"].find({}).sort("level", -1).limit(limit).to_list(limit)
+                result = await db["users"].bulk_write(
+                    [UpdateOne({"_id": uid}, {"$inc": inc}) for uid, inc in deltas.items()],
+                    ordered=False
+                )
+                level_ups = {}
+                if xp_users:
+                    docs = await db["users"].find(
+                        {"_id": {"$in": xp_users}}, {"xp": 1, "level": 1}
+                    ).to_list(None)
+                    for doc in docs:
+                        level = UserProfile.level_for_xp(doc.get("xp", 0))
+                        if doc.get("level", 1) < level:
+                            level_ups[doc["_id"]] = level
+                    if level_ups:
+                        await db["users"].bulk_write(
+                            [UpdateOne({"_id": uid}, {"$max": {"level": lvl}}) for uid, lvl in level_ups.items()],
+                            ordered=False
+                        )
+                for uid, inc in deltas.items():
+                    max_level = {"level": level_ups[uid]} if uid in level_ups else None
+                    leaderboards.apply(uid, inc, max=max_level)
+                    _mirror_increment(uid, inc, max=max_level)
+                return result.matched_count
             except Exception:
                 pass
-        users = sorted(_memory_users.values(), key=lambda x: x.get("level", 0), reverse=True)[:limit]
-        return users
+
+        if _sqlite is not None:
+            docs = await _sqlite.bulk_increment("users", {uid: (inc, None) for uid, inc in deltas.items()})
+            level_ups = {}
+            for uid in xp_users:
+                doc = docs.get(uid)
+                if doc and doc.get("level", 1) < UserProfile.level_for_xp(doc.get("xp", 0)):
+                    level_ups[uid] = ({}, {"level": UserProfile.level_for_xp(doc.get("xp", 0))})
+            if level_ups:
+                docs.update(await _sqlite.bulk_increment("users", level_ups))
+            for uid, doc in docs.items():
+                leaderboards.apply(uid, set={f: doc[f] for f in LEADERBOARD_FIELDS if f in doc})
+                if _user_cache_enabled():
+                    user_cache.put(uid, doc)
+            return len(docs)
+
+        updated = 0
+        for uid, inc in deltas.items():
+            user = _memory_users.get(uid)
+            if user is None:
+                continue
+            max_level = None
+            if "xp" in inc:
+                max_level = {"level": UserProfile.level_for_xp(user.get("xp", 0) + inc["xp"])}
+            changed = _apply_increment(user, inc, max=max_level)
+            journal_record(USERS_FILE, _memory_users, "set", uid, changed)
+            leaderboards.apply(uid, inc, max=max_level)
+            updated += 1
+        return updated
+
+    @staticmethod
+    def level_for_xp(xp: int):
+        return (xp // 250) + 1
+
+    @staticmethod
+    async def sync_level(user_id: int, user: dict):
+        """Raise a user's stored level to match their XP (no write if already correct)"""
+        level = UserProfile.level_for_xp(user.get("xp", 0))
+        if user.get("level", 1) < level:
+            await UserProfile.increment(user_id, {}, max={"level": level})
+            user["level"] = level
+        return user
+
+    @staticmethod
+    async def add_xp(user_id: int, amount: int):
+        # before=True: the new XP is needed for the level even inside a db_batch()
+        user = await UserProfile.increment(user_id, {"xp": amount}, before=True)
+        if not user:
+            return
+        user["xp"] = user.get("xp", 0) + amount
+        return await UserProfile.sync_level(user_id, user)
+
+    @staticmethod
+    async def add_credits(user_id: int, amount: int):
+        return await UserProfile.increment(user_id, {"studio_credits": amount})
+
+    LEADERBOARD_FIELDS = LEADERBOARD_FIELDS
+
+    @staticmethod
+    async def get_top_users(limit: int = 10):
+        board = await UserProfile.get_leaderboard("level", 0, limit)
+        return board["users"]
+
+    @staticmethod
+    async def get_leaderboard(metric: str, start: int = 0, count: int = 10):
+        """One page of a leaderboard: {"users": [rows...], "total": n}
+
+        Rows carry LEADERBOARD_FIELDS only. See LEADERBOARD_METRICS for the
+        available metrics.
+        """
+        await leaderboards.ensure_built()
+        return {
+            "users": leaderboards.page(metric, start, count),
+            "total": leaderboards.total(metric),
+        }
+
+    @staticmethod
+    async def get_rank(user_id: int, metric: str):
+        """1-based position of a user on a leaderboard (None if not ranked)"""
+        await leaderboards.ensure_built()
+        return leaderboards.rank(metric, user_id)
 
 
 class TeamData:
@@ -216,11 +1841,10 @@ class TeamData:
         invite_code = _generate_invite_code()
         # Make sure invite code is unique
         for _ in range(10):
-            exists = False
-            for t in _memory_teams.values():
-                if t.get("invite_code") == invite_code:
-                    exists = True
-                    break
+            if _sqlite is not None:
+                exists = await _sqlite.find_one("teams", {"invite_code": invite_code}) is not None
+            else:
+                exists = _team_indexes.exists("invite_code", invite_code)
             if not exists:
                 break
             invite_code = _generate_invite_code()
@@ -250,8 +1874,12 @@ class TeamData:
                 await db["teams"].insert_one(team)
             except Exception:
                 pass
+        if _sqlite is not None:
+            await _sqlite.insert("teams", team)
+            return team
         _memory_teams[team_id] = team
-        save_json(TEAMS_FILE, _memory_teams)
+        _team_indexes.put(team_id, team)
+        journal_record(TEAMS_FILE, _memory_teams, "put", team_id, team)
         return team
 
     @staticmethod
@@ -261,8 +1889,32 @@ class TeamData:
                 return await db["teams"].find_one({"_id": team_id})
             except Exception:
                 pass
+        if _sqlite is not None:
+            return await _sqlite.get("teams", team_id)
         return _memory_teams.get(team_id)
 
+    @staticmethod
+    async def get_team_by_invite_code(invite_code: str):
+        """Find a team by its (case-insensitive) invite code"""
+        invite_code = invite_code.strip().upper()
+        if db is not None:
+            try:
+                team = await db["teams"].find_one({"invite_code": invite_code})
+                if team:
+                    return team
+            except Exception:
+                pass
+        if _sqlite is not None:
+            return await _sqlite.find_one("teams", {"invite_code": invite_code})
+        return _team_indexes.find_one("invite_code", invite_code)
+
+    @staticmethod
+    async def get_team_by_category(category_id: int):
+        """Find the team that owns a Discord channel category"""
+        if _sqlite is not None:
+            return await _sqlite.find_one("teams", {"category_id": category_id})
+        return _team_indexes.find_one("category_id", category_id)
+
     @staticmethod
     async def update_team(team_id: str, updates: dict):
         if db is not None:
@@ -270,9 +1922,12 @@ class TeamData:
                 await db["teams"].update_one({"_id": team_id}, {"$set": updates})
             except Exception:
                 pass
-        if team_id in _memory_teams:
+        if _sqlite is not None:
+            await _sqlite.update("teams", team_id, updates)
+        elif team_id in _memory_teams:
             _memory_teams[team_id].update(updates)
-            save_json(TEAMS_FILE, _memory_teams)
+            _team_indexes.put(team_id, _memory_teams[team_id])
+            journal_record(TEAMS_FILE, _memory_teams, "set", team_id, updates)
 
     @staticmethod
     async def delete_team(team_id: str):
@@ -281,9 +1936,12 @@ class TeamData:
                 await db["teams"].delete_one({"_id": team_id})
             except Exception:
                 pass
-        if team_id in _memory_teams:
+        if _sqlite is not None:
+            await _sqlite.delete("teams", team_id)
+        elif team_id in _memory_teams:
             del _memory_teams[team_id]
-            save_json(TEAMS_FILE, _memory_teams)
+            _team_indexes.drop(team_id)
+            journal_record(TEAMS_FILE, _memory_teams, "del", team_id)
 
     @staticmethod
     async def add_member(team_id: str, user_id: int):
@@ -321,11 +1979,10 @@ class TeamData:
                     return results
             except Exception:
                 pass
+        if _sqlite is not None:
+            return await _sqlite.get_user_teams(user_id)
         # Fallback to memory
-        for team_id, team in _memory_teams.items():
-            if user_id in team.get("members", []):
-                results.append(team)
-        return results
+        return _team_indexes.find("member", user_id)
 
     @staticmethod
     async def get_all_teams():
@@ -339,10 +1996,9 @@ class TeamData:
                     return results
             except Exception:
                 pass
-        for team_id, team in _memory_teams.items():
-            if not team.get("private", True):
-                results.append(team)
-        return results
+        if _sqlite is not None:
+            return await _sqlite.find("teams", {"private": False})
+        return _team_indexes.find("public", True)
 
     @staticmethod
     async def add_project(team_id: str, project_name: str, description: str = ""):
@@ -361,6 +2017,187 @@ class TeamData:
         return True
 
 
+# ===== MARKETPLACE INDEX =====
+# Active listings are kept in an inverted index (search_index.py) so /shop
+# searches are a few posting-list lookups instead of a substring scan over
+# every listing. Alongside it the index keeps each listing's category and
+# sort fields, so a search can be filtered, sorted and paged before any
+# document is fetched, plus one pre-sorted view per sort field (overall and
+# per category) that the JSON backend pages through. With more than
+# MARKET_SEARCH_LOCAL_LIMIT listings in Mongo the local index is skipped and
+# searches use the listing_text index.
+
+# Fields a search can filter or sort on without fetching the listing
+LISTING_SEARCH_FIELDS = ["category", "created_at", "price", "rating", "sold"]
+
+# sort_by -> (field, descending)
+LISTING_SORTS = {
+    "newest": ("created_at", True),
+    "oldest": ("created_at", False),
+    "price_low": ("price", False),
+    "price_high": ("price", True),
+    "rating": ("rating", True),
+    "best_selling": ("sold", True),
+}
+
+
+def _listing_sort_value(meta, field):
+    value = meta.get(field)
+    if value is None:
+        return "" if field == "created_at" else 0
+    return value
+
+
+class SortedView:
+    """Listing ids kept sorted by (value, id); pages can be read either way"""
+
+    def __init__(self, field):
+        self.field = field
+        self._keys = []
+        self._key_of = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, listing_id, meta):
+        key = (_listing_sort_value(meta, self.field), listing_id)
+        old = self._key_of.get(listing_id)
+        if old == key:
+            return
+        if old is not None:
+            del self._keys[bisect_left(self._keys, old)]
+        insort(self._keys, key)
+        self._key_of[listing_id] = key
+
+    def remove(self, listing_id):
+        old = self._key_of.pop(listing_id, None)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, old)]
+
+    def page(self, start, count, descending=False):
+        if descending:
+            end = len(self._keys) - start
+            return [key[1] for key in reversed(self._keys[max(end - count, 0):max(end, 0)])]
+        return [key[1] for key in self._keys[start:start + count]]
+
+
+class ListingIndex:
+
+    def __init__(self):
+        self.index = InvertedIndex({"title": 3, "description": 1})
+        self.meta = {}
+        self.views = {}  # (category or None, field) -> SortedView
+        self.ready = False
+        self.use_mongo_text = False
+        self._build_lock = None
+
+    async def ensure_built(self):
+        if not self.ready:
+            await self.rebuild()
+
+    async def rebuild(self):
+        if self._build_lock is None:
+            self._build_lock = asyncio.Lock()
+        async with self._build_lock:
+            self.index = InvertedIndex(self.index.weights)
+            self.meta = {}
+            self.views = {}
+            self.use_mongo_text = False
+            listings = None
+            if db is not None:
+                try:
+                    if await db["marketplace"].estimated_document_count() > MARKET_SEARCH_LOCAL_LIMIT:
+                        self.use_mongo_text = True
+                        listings = []
+                    else:
+                        listings = await db["marketplace"].find(
+                            {"status": "active"},
+                            _projection(["listing_id", "title", "description", "status"] + LISTING_SEARCH_FIELDS)
+                        ).to_list(None)
+                except Exception:
+                    listings = None
+            if listings is None:
+                if _sqlite is not None:
+                    listings = await _sqlite.find("marketplace", {"status": "active"})
+                else:
+                    listings = list(_memory_marketplace.values())
+            for listing in listings:
+                self._put(listing)
+            self.ready = True
+
+    def _put(self, listing):
+        listing_id = listing.get("listing_id") or listing.get("_id")
+        if listing_id is None:
+            return
+        if listing.get("status", "active") != "active":
+            self.remove(listing_id)
+            return
+        old = self.meta.get(listing_id)
+        if old is not None and old.get("category") != listing.get("category"):
+            self.remove(listing_id)
+        self.index.add(listing_id, listing)
+        meta = self.meta[listing_id] = {f: listing.get(f) for f in LISTING_SEARCH_FIELDS}
+        self._update_views(listing_id, meta)
+
+    def _views_for(self, category):
+        for scope in ((None,) if category is None else (None, category)):
+            for field in ("created_at", "price", "rating", "sold"):
+                view = self.views.get((scope, field))
+                if view is None:
+                    view = self.views[(scope, field)] = SortedView(field)
+                yield view
+
+    def _update_views(self, listing_id, meta):
+        for view in self._views_for(meta.get("category")):
+            view.update(listing_id, meta)
+
+    def put(self, listing):
+        """A listing was created or its status changed"""
+        if self.ready:
+            self._put(listing)
+
+    def update(self, listing_id, set=None, inc=None):
+        """Keep the sort fields of an indexed listing current"""
+        meta = self.meta.get(listing_id)
+        if meta is not None:
+            _apply_increment(
+                meta,
+                {f: d for f, d in (inc or {}).items() if f in meta},
+                {f: v for f, v in (set or {}).items() if f in meta and f != "category"},
+            )
+            self._update_views(listing_id, meta)
+
+    def remove(self, listing_id):
+        self.index.remove(listing_id)
+        meta = self.meta.pop(listing_id, None)
+        if meta is not None:
+            for view in self._views_for(meta.get("category")):
+                view.remove(listing_id)
+
+    def count(self, category=None):
+        view = self.views.get((category, "created_at"))
+        return len(view) if view is not None else 0
+
+    def page(self, category, sort_by, start, count):
+        """Listing ids for one page of a category (None = all) in `sort_by` order"""
+        field, descending = LISTING_SORTS.get(sort_by, LISTING_SORTS["newest"])
+        view = self.views.get((category, field))
+        return view.page(start, count, descending) if view is not None else []
+
+    def search(self, query, category=None, sort_by="relevance"):
+        """Matching listing ids, ordered by relevance or LISTING_SORTS[sort_by]"""
+        ids = [listing_id for listing_id, _ in self.index.search(query)]
+        if category:
+            ids = [i for i in ids if self.meta[i].get("category") == category]
+        if sort_by in LISTING_SORTS:
+            field, descending = LISTING_SORTS[sort_by]
+            ids.sort(key=lambda i: _listing_sort_value(self.meta[i], field), reverse=descending)
+        return ids
+
+
+listing_index = ListingIndex()
+
+
 class MarketplaceData:
     @staticmethod
     async def create_listing(listing):
@@ -378,9 +2215,15 @@ class MarketplaceData:
                 await db["marketplace"].insert_one(listing)
             except Exception:
                 pass
+        listing_index.put(listing)
+
+        if _sqlite is not None:
+            await _sqlite.insert("marketplace", listing)
+            return listing["listing_id"]
 
         _memory_marketplace[listing["listing_id"]] = listing
-        save_json(MARKETPLACE_FILE, _memory_marketplace)
+        _listing_indexes.put(listing["listing_id"], listing)
+        journal_record(MARKETPLACE_FILE, _memory_marketplace, "put", listing["listing_id"], listing)
         return listing["listing_id"]
 
     @staticmethod
@@ -396,73 +2239,207 @@ class MarketplaceData:
                     return result
             except Exception:
                 pass
+        if _sqlite is not None:
+            return await _sqlite.find_one("marketplace", {"listing_id": listing_id})
         if listing_id in _memory_marketplace:
             return _memory_marketplace[listing_id]
-        for key, val in _memory_marketplace.items():
-            if val.get("listing_id", "").upper() == listing_id:
-                return val
-        return None
+        return _listing_indexes.find_one("listing_id", listing_id)
 
     @staticmethod
-    async def get_listings(category=None, search=None, sort_by="newest", page=1, per_page=5):
-        all_listings = []
+    async def set_status(listing_id: str, status: str):
+        """Change a listing's status ("active" listings are the ones shown/searched)"""
+        listing_id = listing_id.strip().upper()
         if db is not None:
             try:
-                query = {"status": "active"}
-                if category:
-                    query["category"] = category
-                results = await db["marketplace"].find(query).to_list(500)
-                all_listings = results
+                await db["marketplace"].update_one({"listing_id": listing_id}, {"$set": {"status": status}})
             except Exception:
-                all_listings = list(_memory_marketplace.values())
+                pass
+        listing = None
+        if _sqlite is not None:
+            listing = await _sqlite.find_one("marketplace", {"listing_id": listing_id})
+            if listing:
+                await _sqlite.update("marketplace", listing["_id"], {"status": status})
+        elif listing_id in _memory_marketplace:
+            listing = _memory_marketplace[listing_id]
+            listing["status"] = status
+            _listing_indexes.put(listing_id, listing)
+            journal_record(MARKETPLACE_FILE, _memory_marketplace, "set", listing_id, {"status": status})
+        if listing is None:
+            listing = await MarketplaceData.get_listing_by_id(listing_id)
+        if listing is not None:
+            listing["status"] = status
+            listing_index.put(listing)
         else:
-            all_listings = list(_memory_marketplace.values())
-
-        if not (db is not None):
-            all_listings = [l for l in all_listings if l.get("status", "active") == "active"]
-            if category:
-                all_listings = [l for l in all_listings if l.get("category") == category]
+            listing_index.remove(listing_id)
 
+    @staticmethod
+    async def get_listings(category=None, search=None, sort_by="newest", page=1, per_page=5, cursor=None):
+        """One page of active listings
+
+        Sorting and paging happen in the store (Mongo/SQLite) or on the
+        pre-sorted listing views, so only `per_page` listings are read.
+        `cursor` is the "next_cursor" of the previous page's result: it
+        carries the last row's sort key and the total, so turning to that
+        page seeks straight to it and skips the count.
+        """
         if search:
-            search_lower = search.lower()
-            filtered = []
-            for l in all_listings:
-                title = l.get("title", "").lower()
-                desc = l.get("description", "").lower()
-                if search_lower in title or search_lower in desc:
-                    filtered.append(l)
-            all_listings = filtered
-
-        if sort_by == "newest":
-            all_listings.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-        elif sort_by == "oldest":
-            all_listings.sort(key=lambda x: x.get("created_at", ""))
-        elif sort_by == "price_low":
-            all_listings.sort(key=lambda x: x.get("price", 0))
-        elif sort_by == "price_high":
-            all_listings.sort(key=lambda x: x.get("price", 0), reverse=True)
-        elif sort_by == "rating":
-            all_listings.sort(key=lambda x: x.get("rating", 0), reverse=True)
-        elif sort_by == "best_selling":
-            all_listings.sort(key=lambda x: x.get("sold", 0), reverse=True)
-
-        total = len(all_listings)
+            return await MarketplaceData._search_listings(category, search, sort_by, page, per_page)
+        if sort_by not in LISTING_SORTS:
+            sort_by = "newest"
+        if cursor is not None and cursor.get("page") != page:
+            cursor = None
+        if db is not None:
+            try:
+                return await MarketplaceData._get_listings_mongo(category, sort_by, page, per_page, cursor)
+            except Exception:
+                pass
+        if _sqlite is not None:
+            return await MarketplaceData._get_listings_sqlite(category, sort_by, page, per_page, cursor)
+
+        await listing_index.ensure_built()
+        total = listing_index.count(category)
+        page, total_pages = MarketplaceData._clamp_page(total, page, per_page)
+        page_ids = listing_index.page(category, sort_by, (page - 1) * per_page, per_page)
+        return {
+            "listings": [_memory_marketplace[i] for i in page_ids if i in _memory_marketplace],
+            "total": total,
+            "page": page,
+            "total_pages": total_pages
+        }
+
+    @staticmethod
+    def _clamp_page(total, page, per_page):
         total_pages = max(1, (total + per_page - 1) // per_page)
-        if page < 1:
-            page = 1
-        if page > total_pages:
-            page = total_pages
-        start = (page - 1) * per_page
-        end = start + per_page
-        page_listings = all_listings[start:end]
+        return min(max(page, 1), total_pages), total_pages
+
+    @staticmethod
+    def _next_cursor(listings, field, page, total_pages, total):
+        if page >= total_pages or not listings:
+            return None
+        last = listings[-1]
+        return {"page": page + 1, "after": [last.get(field), last.get("_id")], "total": total}
 
+    @staticmethod
+    async def _get_listings_mongo(category, sort_by, page, per_page, cursor):
+        query = {"status": "active"}
+        if category:
+            query["category"] = category
+        field, descending = LISTING_SORTS[sort_by]
+        if cursor is not None and cursor.get("total") is not None:
+            total = cursor["total"]
+        else:
+            total = await db["marketplace"].count_documents(query)
+        page, total_pages = MarketplaceData._clamp_page(total, page, per_page)
+        direction = DESCENDING if descending else ASCENDING
+        after = cursor.get("after") if cursor is not None else None
+        if after and after[0] is not None and cursor["page"] == page:
+            # Keyset: continue after the previous page's last (value, _id)
+            op = "$lt" if descending else "$gt"
+            query["$or"] = [{field: {op: after[0]}}, {field: after[0], "_id": {op: after[1]}}]
+            skip = 0
+        else:
+            skip = (page - 1) * per_page
+        listings = await db["marketplace"].find(query).sort(
+            [(field, direction), ("_id", direction)]
+        ).skip(skip).limit(per_page).to_list(per_page)
+        return {
+            "listings": listings,
+            "total": total,
+            "page": page,
+            "total_pages": total_pages,
+            "next_cursor": MarketplaceData._next_cursor(listings, field, page, total_pages, total),
+        }
+
+    @staticmethod
+    async def _search_listings(category, search, sort_by, page, per_page):
+        """Ranked search ("relevance" sort) or search + LISTING_SORTS order"""
+        await listing_index.ensure_built()
+        if listing_index.use_mongo_text:
+            try:
+                return await MarketplaceData._search_listings_mongo(category, search, sort_by, page, per_page)
+            except Exception:
+                pass
+        ids = listing_index.search(search, category, sort_by)
+        total = len(ids)
+        total_pages = max(1, (total + per_page - 1) // per_page)
+        page = min(max(page, 1), total_pages)
+        page_ids = ids[(page - 1) * per_page:page * per_page]
+        return {
+            "listings": await MarketplaceData._get_listings_by_ids(page_ids),
+            "total": total,
+            "page": page,
+            "total_pages": total_pages
+        }
+
+    @staticmethod
+    async def _search_listings_mongo(category, search, sort_by, page, per_page):
+        query = {"$text": {"$search": search}, "status": "active"}
+        if category:
+            query["category"] = category
+        total = await db["marketplace"].count_documents(query)
+        total_pages = max(1, (total + per_page - 1) // per_page)
+        page = min(max(page, 1), total_pages)
+        if sort_by in LISTING_SORTS:
+            field, descending = LISTING_SORTS[sort_by]
+            sort = [(field, DESCENDING if descending else ASCENDING)]
+        else:
+            sort = [("score", {"$meta": "textScore"})]
+        listings = await db["marketplace"].find(
+            query, {"score": {"$meta": "textScore"}}
+        ).sort(sort).skip((page - 1) * per_page).limit(per_page).to_list(per_page)
         return {
-            "listings": page_listings,
+            "listings": listings,
             "total": total,
             "page": page,
             "total_pages": total_pages
         }
 
+    @staticmethod
+    async def _get_listings_by_ids(listing_ids):
+        """Fetch listings, keeping the order of `listing_ids`"""
+        if not listing_ids:
+            return []
+        found = {}
+        if db is not None:
+            try:
+                docs = await db["marketplace"].find({"listing_id": {"$in": listing_ids}}).to_list(None)
+                found = {d.get("listing_id"): d for d in docs}
+            except Exception:
+                found = {}
+        if not found:
+            for listing_id in listing_ids:
+                if _sqlite is not None:
+                    listing = await _sqlite.get("marketplace", listing_id)
+                else:
+                    listing = _memory_marketplace.get(listing_id)
+                if listing is not None:
+                    found[listing_id] = listing
+        return [found[i] for i in listing_ids if i in found]
+
+    @staticmethod
+    async def _get_listings_sqlite(category, sort_by, page, per_page, cursor):
+        field, descending = LISTING_SORTS[sort_by]
+        order_by = [(field, descending), ("id", descending)]
+        if cursor is not None and cursor.get("total") is not None:
+            total = cursor["total"]
+        else:
+            _, total = await _sqlite.search_listings(category, limit=0)
+        page, total_pages = MarketplaceData._clamp_page(total, page, per_page)
+        after = cursor.get("after") if cursor is not None else None
+        if not (after and after[0] is not None and cursor["page"] == page):
+            after = None
+        rows, _ = await _sqlite.search_listings(
+            category, order_by=order_by, limit=per_page, offset=(page - 1) * per_page,
+            after=after, count=False
+        )
+        return {
+            "listings": rows,
+            "total": total,
+            "page": page,
+            "total_pages": total_pages,
+            "next_cursor": MarketplaceData._next_cursor(rows, field, page, total_pages, total),
+        }
+
     @staticmethod
     async def get_user_listings(user_id: int):
         if db is not None:
@@ -470,7 +2447,9 @@ class MarketplaceData:
                 return await db["marketplace"].find({"seller_id": user_id}).to_list(100)
             except Exception:
                 pass
-        return [l for l in _memory_marketplace.values() if l.get("seller_id") == user_id]
+        if _sqlite is not None:
+            return await _sqlite.find("marketplace", {"seller_id": user_id})
+        return _listing_indexes.find("seller_id", user_id)
 
     @staticmethod
     async def can_user_sell(user_id: int):
@@ -492,15 +2471,20 @@ class MarketplaceData:
                 )
             except Exception:
                 pass
-        if listing_id in _memory_marketplace:
+        listing_index.update(listing_id, inc={"sold": 1})
+        if _sqlite is not None:
+            listing = await _sqlite.find_one("marketplace", {"listing_id": listing_id})
+            if listing:
+                await _sqlite.increment("marketplace", listing["_id"], {"sold": 1})
+        elif listing_id in _memory_marketplace:
             _memory_marketplace[listing_id]["sold"] = _memory_marketplace[listing_id].get("sold", 0) + 1
-            save_json(MARKETPLACE_FILE, _memory_marketplace)
+            journal_record(MARKETPLACE_FILE, _memory_marketplace, "set", listing_id,
+                           {"sold": _memory_marketplace[listing_id]["sold"]})
         else:
-            for key, val in _memory_marketplace.items():
-                if val.get("listing_id", "").upper() == listing_id:
-                    val["sold"] = val.get("sold", 0) + 1
-                    save_json(MARKETPLACE_FILE, _memory_marketplace)
-                    break
+            for key in _listing_indexes.keys("listing_id", listing_id)[:1]:
+                val = _memory_marketplace[key]
+                val["sold"] = val.get("sold", 0) + 1
+                journal_record(MARKETPLACE_FILE, _memory_marketplace, "set", key, {"sold": val["sold"]})
 
     @staticmethod
     async def add_rating(listing_id: str, seller_id: int, rating: int):
@@ -523,17 +2507,17 @@ class MarketplaceData:
                     )
                 except Exception:
                     pass
-            if listing_id in _memory_marketplace:
-                _memory_marketplace[listing_id]["rating"] = new_rating
-                _memory_marketplace[listing_id]["ratings_count"] = new_count
-                save_json(MARKETPLACE_FILE, _memory_marketplace)
+            rating_update = {"rating": new_rating, "ratings_count": new_count}
+            listing_index.update(listing_id, set=rating_update)
+            if _sqlite is not None:
+                await _sqlite.update("marketplace", listing["_id"], rating_update)
+            elif listing_id in _memory_marketplace:
+                _memory_marketplace[listing_id].update(rating_update)
+                journal_record(MARKETPLACE_FILE, _memory_marketplace, "set", listing_id, rating_update)
             else:
-                for key, val in _memory_marketplace.items():
-                    if val.get("listing_id", "").upper() == listing_id:
-                        val["rating"] = new_rating
-                        val["ratings_count"] = new_count
-                        save_json(MARKETPLACE_FILE, _memory_marketplace)
-                        break
+                for key in _listing_indexes.keys("listing_id", listing_id)[:1]:
+                    _memory_marketplace[key].update(rating_update)
+                    journal_record(MARKETPLACE_FILE, _memory_marketplace, "set", key, rating_update)
 
         seller = await UserProfile.get_user(seller_id)
         if seller:
@@ -554,13 +2538,18 @@ class TransactionData:
 
             if db is not None:
                 try:
-                    await db["transactions"].insert_one(tx)
+                    await db["transactions"].insert_one({**tx, TTL_FIELD: datetime.utcnow()})
                 except Exception:
                     pass
 
+            if _sqlite is not None:
+                await _sqlite.insert("transactions", tx, key=tx.get("transaction_id", str(uuid.uuid4())))
+                return
+
             tx_key = tx.get("transaction_id", str(len(_memory_transactions)))
             _memory_transactions[tx_key] = tx
-            save_json(TRANSACTIONS_FILE, _memory_transactions)
+            _transaction_indexes.put(tx_key, tx)
+            journal_record(TRANSACTIONS_FILE, _memory_transactions, "put", tx_key, tx)
             return
 
     @staticmethod
@@ -572,16 +2561,425 @@ class TransactionData:
                 ).to_list(50)
             except Exception:
                 pass
-        return [
-            t for t in _memory_transactions.values()
-            if t.get("seller_id") == user_id or t.get("buyer_id") == user_id
-        ]
+        if _sqlite is not None:
+            return await _sqlite.get_user_transactions(user_id)
+        return _transaction_indexes.find("party", user_id)
+
+
+# ===== CREDIT LEDGER =====
+# Every movement of studio_credits / pcredits / ai_credits goes through
+# LedgerData as a batch of legs (from, to, currency, amount). A batch is
+# all-or-nothing: it is netted into one delta per user, every balance is
+# checked against zero, and only then is anything written. Balances stay on
+# the user document -- the projection the leaderboards, the SQLite hot
+# columns and the Mongo indexes already cover -- and each batch is also
+# stored as one double-entry document (entries sum to zero per currency) in
+# the transactions collection, so it shows up in get_user_transactions.
+#
+# If Mongo is unreachable a batch is applied to local storage and queued
+# for resync as one unit (balances + transaction), never leg by leg.
+#
+# LEDGER_SYSTEM is the outside world: credits minted (rewards, conversions)
+# come from it and credits spent (shop items, bounties) go to it. It has no
+# balance and is never checked.
+LEDGER_CURRENCIES = ("studio_credits", "pcredits", "ai_credits")
+LEDGER_SYSTEM = 0
+
+
+class UnknownAccount(LookupError):
+    """Raised by LedgerData when a leg names a user without a profile"""
+
+    def __init__(self, user_id):
+        super().__init__(f"No user profile for {user_id}")
+        self.user_id = user_id
+
+
+def _ledger_deltas(legs):
+    """Validate legs; returns (double-entry lines, {user_id: {currency: net delta}})"""
+    entries, deltas = [], {}
+    for from_id, to_id, currency, amount in legs:
+        if currency not in LEDGER_CURRENCIES:
+            raise ValueError(f"Unknown currency: {currency}")
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount <= 0:
+            raise ValueError(f"Ledger amounts must be positive, got {amount!r}")
+        if from_id == to_id:
+            raise ValueError(f"Ledger leg from {from_id} to itself")
+        for account, delta in ((from_id, -amount), (to_id, amount)):
+            entries.append({"account": account, "currency": currency, "amount": delta})
+            if account != LEDGER_SYSTEM:
+                user = deltas.setdefault(account, {})
+                user[currency] = user.get(currency, 0) + delta
+    deltas = {uid: {c: d for c, d in inc.items() if d} for uid, inc in deltas.items()}
+    return entries, {uid: inc for uid, inc in deltas.items() if inc}
+
+
+async def _ledger_call(coll, method, *args, **kwargs):
+    """A guarded Mongo call that is never queued for resync on its own
+
+    When Mongo is down a batch falls back to local storage and queues itself
+    whole (see _ledger_replay); queueing single legs would replay half of it.
+    """
+    collection = db[coll]
+    return await _guarded_call(collection._breaker, getattr(collection._collection, method), args, kwargs)
+
+
+async def _ledger_replay(raw_db, deltas, tx):
+    """Resync a batch that was applied locally while Mongo was down"""
+    await raw_db["users"].bulk_write(
+        [UpdateOne({"_id": uid}, {"$inc": inc}) for uid, inc in deltas.items()], ordered=False
+    )
+    await raw_db["transactions"].replace_one(
+        {"transaction_id": tx["transaction_id"]}, {**tx, TTL_FIELD: datetime.utcnow()}, upsert=True
+    )
+
+
+def _ledger_project(user_id, inc, doc=None):
+    """Mirror a committed ledger delta onto the leaderboards and caches"""
+    leaderboards.apply(user_id, inc)
+    if doc is not None and _user_cache_enabled():
+        user_cache.put(user_id, doc)
+    else:
+        user_cache.invalidate(user_id)
+
+
+class LedgerData:
+    """Atomic credit transfers between users (and LEDGER_SYSTEM)"""
+
+    @staticmethod
+    async def transfer(from_id: int, to_id: int, currency: str, amount, reason: str, meta: dict = None):
+        """Move `amount` of `currency` from one account to another
+
+        Returns the same result as batch(), or None if the payer can't
+        cover it. Raises UnknownAccount if either user doesn't exist.
+        """
+        return await LedgerData.batch([(from_id, to_id, currency, amount)], reason, meta)
+
+    @staticmethod
+    async def batch(legs, reason: str, meta: dict = None):
+        """Apply several (from_id, to_id, currency, amount) legs atomically
+
+        `reason` is stored as the transaction type, `meta` (listing id,
+        title...) is merged into the transaction document. Returns
+        {"transaction": doc, "balances": {user_id: {currency: new balance}}},
+        or None -- with nothing written -- if any net balance would go
+        negative. Raises UnknownAccount (nothing written either) if a user
+        doesn't exist, ValueError for malformed legs.
+        """
+        entries, deltas = _ledger_deltas(legs)
+        result = await LedgerData._apply(entries, deltas, reason, meta)
+        if result is None:
+            # Every backend reports a missing user like a short balance; tell them apart
+            for user_id in deltas:
+                if await UserProfile.get_user(user_id, ["_id"]) is None:
+                    raise UnknownAccount(user_id)
+        return result
+
+    @staticmethod
+    async def _apply(entries, deltas, reason, meta):
+        payers = [e["account"] for e in entries if e["amount"] < 0 and e["account"] != LEDGER_SYSTEM]
+        payees = [e["account"] for e in entries if e["amount"] > 0 and e["account"] != LEDGER_SYSTEM]
+        buyer_id = payers[0] if payers else None
+        tx = {
+            "transaction_id": uuid.uuid4().hex[:12].upper(),
+            "buyer_id": buyer_id,
+            "seller_id": next((uid for uid in payees if uid != buyer_id), None),
+            "created_at": datetime.utcnow().isoformat(),
+            **(meta or {}),
+            "type": reason,
+            "entries": entries,
+            "parties": sorted(set(payers + payees)),
+            "status": "completed",
+        }
+
+        mongo_down = False
+        if db is not None:
+            try:
+                balances = await LedgerData._apply_mongo(deltas, tx)
+                return None if balances is None else {"transaction": tx, "balances": balances}
+            except Exception:
+                mongo_down = True  # nothing was written to Mongo
+
+        if _sqlite is not None:
+            docs = await _sqlite.ledger_apply(deltas, tx)
+            if docs is None:
+                return None
+            for user_id, inc in deltas.items():
+                _ledger_project(user_id, inc, docs[user_id])
+            if mongo_down:
+                mongo_breaker.queue_write(None, _ledger_replay, (deltas, tx), {})
+            return {"transaction": tx, "balances": {
+                uid: {c: docs[uid].get(c, 0) for c in inc} for uid, inc in deltas.items()
+            }}
+
+        # No await between the checks and the writes, so this is atomic on the event loop
+        users = {uid: _memory_users.get(uid) for uid in deltas}
+        if any(user is None for user in users.values()):
+            return None
+        for uid, inc in deltas.items():
+            if any(users[uid].get(c, 0) + d < 0 for c, d in inc.items() if d < 0):
+                return None
+        balances = {}
+        for uid, inc in deltas.items():
+            balances[uid] = _apply_increment(users[uid], inc)
+            journal_record(USERS_FILE, _memory_users, "set", uid, balances[uid], flush=False)
+            _ledger_project(uid, inc)
+        _memory_transactions[tx["transaction_id"]] = tx
+        _transaction_indexes.put(tx["transaction_id"], tx)
+        # The balance entries above are only buffered and go out with this
+        # one in the same flush, but as appends to two journal files: a
+        # crash between them can replay the balances without the entry
+        journal_record(TRANSACTIONS_FILE, _memory_transactions, "put", tx["transaction_id"], tx)
+        if mongo_down:
+            mongo_breaker.queue_write(None, _ledger_replay, (deltas, tx), {})
+        return {"transaction": tx, "balances": balances}
+
+    @staticmethod
+    async def _apply_mongo(deltas, tx):
+        """Debits first (conditional on the balance), then credits + the entry
+
+        A standalone Mongo server has no multi-document transactions, so a
+        failed leg is undone with compensating $inc writes. Debits run
+        concurrently in one round-trip, credits and the transaction insert
+        in a second one. Only raises when nothing has been written yet.
+        """
+        async def write(user_id, inc, guarded):
+            query = {"_id": user_id}
+            if guarded:
+                query.update({c: {"$gte": -d} for c, d in inc.items() if d < 0})
+            return await _ledger_call(
+                "users", "find_one_and_update", query, {"$inc": inc}, return_document=ReturnDocument.AFTER
+            )
+
+        async def undo(user_ids):
+            if not user_ids:
+                return
+            try:
+                await db["users"].bulk_write(
+                    [UpdateOne({"_id": uid}, {"$inc": {c: -d for c, d in deltas[uid].items()}})
+                     for uid in user_ids],
+                    ordered=False
+                )
+            except Exception as e:
+                print(f"⚠️ Ledger rollback of {tx['transaction_id']} failed for {user_ids}: {e}")
+
+        debits = [uid for uid, inc in deltas.items() if any(d < 0 for d in inc.values())]
+        credits = [uid for uid in deltas if uid not in debits]
+        results = await asyncio.gather(*(write(uid, deltas[uid], True) for uid in debits),
+                                       return_exceptions=True)
+        docs = {uid: doc for uid, doc in zip(debits, results) if isinstance(doc, dict)}
+        if len(docs) < len(debits):
+            await undo(list(docs))
+            errors = [r for r in results if isinstance(r, BaseException)]
+            if errors and not docs:
+                raise errors[0]  # nothing was written: let batch() fall back
+            for uid in debits:
+                user_cache.invalidate(uid)
+            return None
+
+        results = await asyncio.gather(*(write(uid, deltas[uid], False) for uid in credits),
+                                       _ledger_call("transactions", "insert_one",
+                                                    {**tx, TTL_FIELD: datetime.utcnow()}),
+                                       return_exceptions=True)
+        inserted = not isinstance(results[-1], BaseException)
+        docs.update({uid: doc for uid, doc in zip(credits, results) if isinstance(doc, dict)})
+        if not docs and not inserted:
+            raise next(r for r in results if isinstance(r, BaseException))  # nothing written: fall back
+        if len(docs) < len(deltas) or not inserted:
+            await undo(list(docs))
+            if inserted:
+                await db["transactions"].delete_one({"transaction_id": tx["transaction_id"]})
+            for uid in deltas:
+                user_cache.invalidate(uid)
+            return None
+
+        for uid, inc in deltas.items():
+            _ledger_project(uid, inc, docs[uid])
+            mirror = _memory_users.get(uid)
+            if mirror is not None:
+                journal_record(USERS_FILE, _memory_users, "set", uid, _apply_increment(mirror, inc))
+        return {uid: {c: docs[uid].get(c, 0) for c in inc} for uid, inc in deltas.items()}
+
+# ===== CAPPED PER-USER LOGS =====
+# Append-heavy per-user lists (duel history, /learn conversation) live outside
+# the user document, so get_user/update_user never load or rewrite them.
+# Mongo keeps one {_id: user_id, entries: [...]} document per user trimmed by
+# $push/$slice, SQLite keeps rows in user_logs, and the JSON store keeps
+# "<name>.json" with each append journaled as a "push".
+# log name -> UserLog. Older user documents may still embed the list under
+# a field of the same name; MigrationRunner moves it into the log.
+USER_LOGS = {}
+
+
+class UserLog:
+    """The newest `cap` entries per user, oldest first"""
+
+    def __init__(self, name: str, cap: int):
+        self.name = name
+        self.cap = cap
+        self.file = os.path.join(DATA_DIR, f"{name}.json")
+        self._memory = _load_collection(self.file)
+        USER_LOGS[name] = self
+
+    async def append(self, user_id: int, entry: dict):
+        if db is not None:
+            try:
+                await db[self.name].update_one(
+                    {"_id": user_id},
+                    {"$push": {"entries": {"$each": [entry], "$slice": -self.cap}}},
+                    upsert=True
+                )
+            except Exception:
+                pass
+        if _sqlite is not None:
+            await _sqlite.log_append(self.name, user_id, [entry], self.cap)
+            return
+        key = str(user_id)
+        record = self._memory.setdefault(key, {"seq": 0, "entries": []})
+        record["seq"] += 1
+        record["entries"].append(entry)
+        if len(record["entries"]) > self.cap:
+            del record["entries"][:-self.cap]
+        journal_record(self.file, self._memory, "push", key,
+                       {"seq": record["seq"], "entry": entry, "cap": self.cap})
+
+    async def read(self, user_id: int, limit: int = None):
+        if db is not None:
+            try:
+                doc = await db[self.name].find_one(
+                    {"_id": user_id}, {"entries": {"$slice": -limit}} if limit else None
+                )
+                return (doc or {}).get("entries", [])
+            except Exception:
+                pass
+        if _sqlite is not None:
+            return await _sqlite.log_read(self.name, user_id, limit)
+        entries = self._memory.get(str(user_id), {}).get("entries", [])
+        return entries[-limit:] if limit else list(entries)
+
+    async def import_legacy(self, user_id: int, entries: list):
+        """Add entries that predate everything logged so far (kept in front)"""
+        if not entries:
+            return
+        if db is not None:
+            try:
+                await db[self.name].update_one(
+                    {"_id": user_id},
+                    {"$push": {"entries": {"$each": list(entries), "$position": 0, "$slice": -self.cap}}},
+                    upsert=True
+                )
+            except Exception:
+                pass
+        if _sqlite is not None:
+            await _sqlite.log_append(self.name, user_id, entries, self.cap, prepend=True)
+            return
+        key = str(user_id)
+        record = self._memory.setdefault(key, {"seq": 0, "entries": []})
+        record["entries"] = (list(entries) + record["entries"])[-self.cap:]
+        record["seq"] += 1
+        journal_record(self.file, self._memory, "put", key, record)
+
+
+duel_history_log = UserLog("duel_history", 50)
+conversation_log = UserLog("learn_conversation", 50)
+
 
 # ===== DUEL DATA =====
 DUEL_FILE = os.path.join(DATA_DIR, "duels.json")
 DUEL_CONFIG_FILE = os.path.join(DATA_DIR, "duel_config.json")
-_memory_duels = load_json(DUEL_FILE, {})
-_memory_duel_config = load_json(DUEL_CONFIG_FILE, {})
+_memory_duels = _load_collection(DUEL_FILE)
+_memory_duel_config = _load_collection(DUEL_CONFIG_FILE)
+
+
+# ===== DUEL HISTORY INDEX =====
+# Head-to-head records are kept per normalized (low_id, high_id) pair: a
+# running win tally plus the last few duels, appended in time order. Each
+# user also gets their own recent-duels list. Built once from storage, then
+# fed by record_duel, so /duel-h2h never scans the duel collection.
+DUEL_RECENT = 10
+
+
+def duel_pair(user1_id, user2_id):
+    return (user1_id, user2_id) if user1_id <= user2_id else (user2_id, user1_id)
+
+
+class DuelIndex:
+
+    def __init__(self, recent: int = DUEL_RECENT):
+        self.recent = recent
+        self.pairs = {}  # (low, high) -> {"total": n, "wins": {user_id: n}, "recent": deque}
+        self.users = {}  # user_id -> deque of recent duels
+        self.ready = False
+        self._build_lock = None
+
+    async def ensure_built(self):
+        if not self.ready:
+            await self.rebuild()
+
+    async def rebuild(self):
+        if self._build_lock is None:
+            self._build_lock = asyncio.Lock()
+        async with self._build_lock:
+            docs = await _load_duel_rows()
+            docs.sort(key=lambda d: d.get("created_at") or "")
+            self.pairs = {}
+            self.users = {}
+            for duel in docs:
+                self._add(duel)
+            self.ready = True
+
+    def _add(self, duel):
+        winner_id, loser_id = duel.get("winner_id"), duel.get("loser_id")
+        if winner_id is None or loser_id is None:
+            return
+        # The round-by-round data isn't needed for history listings
+        duel = {k: v for k, v in duel.items() if k != "rounds"}
+        pair = self.pairs.get(duel_pair(winner_id, loser_id))
+        if pair is None:
+            pair = self.pairs[duel_pair(winner_id, loser_id)] = {
+                "total": 0, "wins": {}, "recent": deque(maxlen=self.recent)
+            }
+        pair["total"] += 1
+        pair["wins"][winner_id] = pair["wins"].get(winner_id, 0) + 1
+        pair["recent"].append(duel)
+        for user_id in (winner_id, loser_id):
+            history = self.users.get(user_id)
+            if history is None:
+                history = self.users[user_id] = deque(maxlen=self.recent)
+            history.append(duel)
+
+    def add(self, duel):
+        """A duel was recorded"""
+        if self.ready:
+            self._add(duel)
+
+    def head_to_head(self, user1_id, user2_id):
+        pair = self.pairs.get(duel_pair(user1_id, user2_id))
+        if pair is None:
+            return {"total_duels": 0, "user1_wins": 0, "user2_wins": 0, "history": []}
+        return {
+            "total_duels": pair["total"],
+            "user1_wins": pair["wins"].get(user1_id, 0),
+            "user2_wins": pair["wins"].get(user2_id, 0),
+            "history": list(pair["recent"]),
+        }
+
+    def recent_for(self, user_id, limit=None):
+        history = list(self.users.get(user_id, ()))
+        return history[-limit:] if limit else history
+
+
+async def _load_duel_rows():
+    if db is not None:
+        try:
+            return await db["duels"].find({}, {"rounds": 0}).to_list(None)
+        except Exception:
+            pass
+    if _sqlite is not None:
+        return await _sqlite.find("duels")
+    return list(_memory_duels.values())
+
+
+duel_index = DuelIndex()
 
 
 class DuelData:
@@ -625,21 +3023,27 @@ class DuelData:
                 await db["duels"].insert_one(duel)
             except Exception:
                 pass
+        duel_index.add(duel)
 
-        _memory_duels[duel_id] = duel
-        save_json(DUEL_FILE, _memory_duels)
-
-        # Update winner
-        winner = await UserProfile.get_user(winner_id)
+        if _sqlite is not None:
+            await _sqlite.insert("duels", duel)
+        else:
+            _memory_duels[duel_id] = duel
+            mark_dirty(DUEL_FILE, _memory_duels)
+
+        # Update winner (before=True: the new streak is needed, even inside a db_batch())
+        winner = await UserProfile.increment(winner_id, {
+            "duel_wins": 1,
+            "duel_streak": 1,
+            "duel_credits_won": bet,
+        }, before=True)
         if winner:
             new_wins = winner.get("duel_wins", 0) + 1
             new_streak = winner.get("duel_streak", 0) + 1
             best_streak = max(new_streak, winner.get("duel_best_streak", 0))
-            new_credits_won = winner.get("duel_credits_won", 0) + bet
             rank_info = DuelData.get_rank(new_wins)
 
-            history = winner.get("duel_history", [])
-            history.append({
+            await duel_history_log.append(winner_id, {
                 "duel_id": duel_id,
                 "opponent": loser_id,
                 "result": "win",
@@ -647,18 +3051,11 @@ class DuelData:
                 "mode": mode,
                 "date": datetime.utcnow().isoformat()
             })
-            if len(history) > 50:
-                history = history[-50:]
-
-            await UserProfile.update_user(winner_id, {
-                "duel_wins": new_wins,
-                "duel_streak": new_streak,
-                "duel_best_streak": best_streak,
-                "duel_credits_won": new_credits_won,
+
+            await UserProfile.increment(winner_id, {}, set={
                 "duel_rank": rank_info["rank"],
                 "duel_title_emoji": rank_info["emoji"],
-                "duel_history": history
-            })
+            }, max={"duel_best_streak": new_streak})
 
             return {
                 "duel_id": duel_id,
@@ -673,40 +3070,26 @@ class DuelData:
 
     @staticmethod
     async def record_loss(loser_id: int, bet: int):
-        loser = await UserProfile.get_user(loser_id)
+        loser = await UserProfile.increment(loser_id, {
+            "duel_losses": 1,
+            "duel_credits_lost": bet,
+        }, set={"duel_streak": 0}, before=True)
         if loser:
             old_streak = loser.get("duel_streak", 0)
-            new_losses = loser.get("duel_losses", 0) + 1
-            new_credits_lost = loser.get("duel_credits_lost", 0) + bet
 
-            history = loser.get("duel_history", [])
-            history.append({
+            await duel_history_log.append(loser_id, {
                 "opponent": None,
                 "result": "loss",
                 "bet": bet,
                 "date": datetime.utcnow().isoformat()
             })
-            if len(history) > 50:
-                history = history[-50:]
-
-            await UserProfile.update_user(loser_id, {
-                "duel_losses": new_losses,
-                "duel_streak": 0,
-                "duel_credits_lost": new_credits_lost,
-                "duel_history": history
-            })
 
             return {"old_streak": old_streak}
         return {}
 
     @staticmethod
     async def record_draw(user1_id: int, user2_id: int):
-        for uid in [user1_id, user2_id]:
-            user = await UserProfile.get_user(uid)
-            if user:
-                await UserProfile.update_user(uid, {
-                    "duel_draws": user.get("duel_draws", 0) + 1
-                })
+        await UserProfile.bulk_increment({user1_id: {"duel_draws": 1}, user2_id: {"duel_draws": 1}})
 
     @staticmethod
     async def get_duel_stats(user_id: int):
@@ -734,87 +3117,65 @@ class DuelData:
             "rank": rank_info["rank"],
             "rank_emoji": rank_info["emoji"],
             "powerups": user.get("duel_powerups", {}),
-            "history": user.get("duel_history", [])
+            "history": await duel_history_log.read(user_id)
         }
 
     @staticmethod
     async def get_head_to_head(user1_id: int, user2_id: int):
-        all_duels = []
-        if db is not None:
-            try:
-                cursor = db["duels"].find({
-                    "$or": [
-                        {"winner_id": user1_id, "loser_id": user2_id},
-                        {"winner_id": user2_id, "loser_id": user1_id}
-                    ]
-                })
-                all_duels = await cursor.to_list(100)
-            except Exception:
-                pass
+        """Win tally between two users plus their last DUEL_RECENT duels (oldest first)"""
+        await duel_index.ensure_built()
+        return duel_index.head_to_head(user1_id, user2_id)
 
-        if not all_duels:
-            for d in _memory_duels.values():
-                if (d.get("winner_id") == user1_id and d.get("loser_id") == user2_id) or \
-                   (d.get("winner_id") == user2_id and d.get("loser_id") == user1_id):
-                    all_duels.append(d)
-
-        u1_wins = sum(1 for d in all_duels if d.get("winner_id") == user1_id)
-        u2_wins = sum(1 for d in all_duels if d.get("winner_id") == user2_id)
-
-        return {
-            "total_duels": len(all_duels),
-            "user1_wins": u1_wins,
-            "user2_wins": u2_wins,
-            "history": all_duels[-10:]
-        }
+    @staticmethod
+    async def get_recent_duels(user_id: int, limit: int = DUEL_RECENT):
+        """A user's most recent duels (oldest first, without round data)"""
+        await duel_index.ensure_built()
+        return duel_index.recent_for(user_id, limit)
 
     @staticmethod
     async def add_powerup(user_id: int, powerup_name: str, amount: int = 1):
-        user = await UserProfile.get_user(user_id)
-        if not user:
-            return False
-        powerups = user.get("duel_powerups", {
-            "shield": 0, "extra_time": 0,
-            "peek": 0, "sabotage": 0, "reroll": 0
-        })
-        if powerup_name not in powerups:
-            return False
-        powerups[powerup_name] = powerups.get(powerup_name, 0) + amount
-        await UserProfile.update_user(user_id, {"duel_powerups": powerups})
-        return True
+        # Read-modify-write of the whole dict: serialize per user
+        async with locks.lock("duel_powerups", user_id):
+            user = await UserProfile.get_user(user_id)
+            if not user:
+                return False
+            powerups = user.get("duel_powerups", {
+                "shield": 0, "extra_time": 0,
+                "peek": 0, "sabotage": 0, "reroll": 0
+            })
+            if powerup_name not in powerups:
+                return False
+            powerups[powerup_name] = powerups.get(powerup_name, 0) + amount
+            await UserProfile.update_user(user_id, {"duel_powerups": powerups})
+            return True
 
     @staticmethod
     async def use_powerup(user_id: int, powerup_name: str):
-        user = await UserProfile.get_user(user_id)
-        if not user:
-            return False
-        powerups = user.get("duel_powerups", {})
-        if powerups.get(powerup_name, 0) <= 0:
-            return False
-        powerups[powerup_name] -= 1
-        await UserProfile.update_user(user_id, {"duel_powerups": powerups})
-        return True
+        async with locks.lock("duel_powerups", user_id):
+            user = await UserProfile.get_user(user_id)
+            if not user:
+                return False
+            powerups = user.get("duel_powerups", {})
+            if powerups.get(powerup_name, 0) <= 0:
+                return False
+            powerups[powerup_name] -= 1
+            await UserProfile.update_user(user_id, {"duel_powerups": powerups})
+            return True
 
     @staticmethod
     async def get_duel_leaderboard(limit: int = 10):
-        if db is not None:
-            try:
-                return await db["users"].find(
-                    {"duel_wins": {"$gt": 0}}
-                ).sort("duel_wins", -1).limit(limit).to_list(limit)
-            except Exception:
-                pass
-        users = [u for u in _memory_users.values() if u.get("duel_wins", 0) > 0]
-        users.sort(key=lambda x: x.get("duel_wins", 0), reverse=True)
-        return users[:limit]
+        board = await UserProfile.get_leaderboard("duel_wins", 0, limit)
+        return [u for u in board["users"] if u.get("duel_wins", 0) > 0]
 
     # ===== STREAK CHANNEL CONFIG =====
     @staticmethod
     async def set_streak_channel(guild_id: int, channel_id: int):
-        _memory_duel_config[str(guild_id)] = {
-            "streak_channel_id": channel_id
-        }
-        save_json(DUEL_CONFIG_FILE, _memory_duel_config)
+        config = {"streak_channel_id": channel_id}
+        if _sqlite is not None:
+            await _sqlite.insert("duel_config", config, key=str(guild_id))
+        else:
+            _memory_duel_config[str(guild_id)] = config
+            mark_dirty(DUEL_CONFIG_FILE, _memory_duel_config)
 
         if db is not None:
             try:
@@ -835,14 +3196,22 @@ class DuelData:
                     return config.get("streak_channel_id")
             except Exception:
                 pass
-        config = _memory_duel_config.get(str(guild_id), {})
+        if _sqlite is not None:
+            config = await _sqlite.get("duel_config", str(guild_id)) or {}
+        else:
+            config = _memory_duel_config.get(str(guild_id), {})
         return config.get("streak_channel_id")
 
 # Add at bottom of database.py
 # After DuelData class
 
 ACTIVE_DUELS_FILE = os.path.join(DATA_DIR, "active_duels.json")
-_memory_active_duels = load_json(ACTIVE_DUELS_FILE, {})
+_memory_active_duels = _load_collection(ACTIVE_DUELS_FILE)
+_active_duel_indexes = CollectionIndexes(
+    _memory_active_duels,
+    status=lambda d: [d.get("status")],
+    status_guild=lambda d: [(d.get("status"), d.get("guild_id"))],
+)
 
 
 class ActiveDuelData:
@@ -869,12 +3238,16 @@ class ActiveDuelData:
 
         if db is not None:
             try:
-                await db["active_duels"].insert_one(duel)
+                await db["active_duels"].insert_one({**duel, TTL_FIELD: datetime.utcnow()})
             except Exception:
                 pass
 
+        if _sqlite is not None:
+            await _sqlite.insert("active_duels", duel)
+            return duel
         _memory_active_duels[duel_id] = duel
-        save_json(ACTIVE_DUELS_FILE, _memory_active_duels)
+        _active_duel_indexes.put(duel_id, duel)
+        mark_dirty(ACTIVE_DUELS_FILE, _memory_active_duels)
         return duel
 
     @staticmethod
@@ -884,6 +3257,8 @@ class ActiveDuelData:
                 return await db["active_duels"].find_one({"_id": duel_id})
             except Exception:
                 pass
+        if _sqlite is not None:
+            return await _sqlite.get("active_duels", duel_id)
         return _memory_active_duels.get(duel_id)
 
     @staticmethod
@@ -893,9 +3268,12 @@ class ActiveDuelData:
                 await db["active_duels"].update_one({"_id": duel_id}, {"$set": updates})
             except Exception:
                 pass
-        if duel_id in _memory_active_duels:
+        if _sqlite is not None:
+            await _sqlite.update("active_duels", duel_id, updates)
+        elif duel_id in _memory_active_duels:
             _memory_active_duels[duel_id].update(updates)
-            save_json(ACTIVE_DUELS_FILE, _memory_active_duels)
+            _active_duel_indexes.put(duel_id, _memory_active_duels[duel_id])
+            mark_dirty(ACTIVE_DUELS_FILE, _memory_active_duels)
 
     @staticmethod
     async def delete_active_duel(duel_id):
@@ -904,9 +3282,12 @@ class ActiveDuelData:
                 await db["active_duels"].delete_one({"_id": duel_id})
             except Exception:
                 pass
-        if duel_id in _memory_active_duels:
+        if _sqlite is not None:
+            await _sqlite.delete("active_duels", duel_id)
+        elif duel_id in _memory_active_duels:
             del _memory_active_duels[duel_id]
-            save_json(ACTIVE_DUELS_FILE, _memory_active_duels)
+            _active_duel_indexes.drop(duel_id)
+            mark_dirty(ACTIVE_DUELS_FILE, _memory_active_duels)
 
     @staticmethod
     async def get_all_active_duels(guild_id=None):
@@ -921,12 +3302,14 @@ class ActiveDuelData:
                     return duels
             except Exception:
                 pass
-        for d in _memory_active_duels.values():
-            if d.get("status") == "active":
-                if guild_id and d.get("guild_id") != guild_id:
-                    continue
-                duels.append(d)
-        return duels
+        if _sqlite is not None:
+            query = {"status": "active"}
+            if guild_id:
+                query["guild_id"] = guild_id
+            return await _sqlite.find("active_duels", query)
+        if guild_id:
+            return _active_duel_indexes.find("status_guild", ("active", guild_id))
+        return _active_duel_indexes.find("status", "active")
 
     @staticmethod
     async def add_spectator(duel_id, user_id):
@@ -943,8 +3326,13 @@ class ActiveDuelData:
 # ===== BUG HUNT DATA =====
 BUGHUNT_FILE = os.path.join(DATA_DIR, "bughunt.json")
 VOUCH_FILE = os.path.join(DATA_DIR, "vouches.json")
-_memory_bughunt = load_json(BUGHUNT_FILE, {})
-_memory_vouches = load_json(VOUCH_FILE, {})
+_memory_bughunt = _load_collection(BUGHUNT_FILE)
+_lobby_indexes = CollectionIndexes(
+    _memory_bughunt,
+    status=lambda l: [l.get("status")],
+    status_guild=lambda l: [(l.get("status"), l.get("guild_id"))],
+)
+_memory_vouches = _load_collection(VOUCH_FILE)
 
 
 class BugHuntData:
@@ -964,11 +3352,15 @@ class BugHuntData:
         }
         if db is not None:
             try:
-                await db["bughunt"].insert_one(lobby)
+                await db["bughunt"].insert_one({**lobby, TTL_FIELD: datetime.utcnow()})
             except Exception:
                 pass
+        if _sqlite is not None:
+            await _sqlite.insert("bughunt", lobby)
+            return lobby
         _memory_bughunt[lobby_id] = lobby
-        save_json(BUGHUNT_FILE, _memory_bughunt)
+        _lobby_indexes.put(lobby_id, lobby)
+        journal_record(BUGHUNT_FILE, _memory_bughunt, "put", lobby_id, lobby)
         return lobby
 
     @staticmethod
@@ -978,6 +3370,8 @@ class BugHuntData:
                 return await db["bughunt"].find_one({"_id": lobby_id})
             except Exception:
                 pass
+        if _sqlite is not None:
+            return await _sqlite.get("bughunt", lobby_id)
         return _memory_bughunt.get(lobby_id)
 
     @staticmethod
@@ -987,9 +3381,12 @@ class BugHuntData:
                 await db["bughunt"].update_one({"_id": lobby_id}, {"$set": updates})
             except Exception:
                 pass
-        if lobby_id in _memory_bughunt:
+        if _sqlite is not None:
+            await _sqlite.update("bughunt", lobby_id, updates)
+        elif lobby_id in _memory_bughunt:
             _memory_bughunt[lobby_id].update(updates)
-            save_json(BUGHUNT_FILE, _memory_bughunt)
+            _lobby_indexes.put(lobby_id, _memory_bughunt[lobby_id])
+            journal_record(BUGHUNT_FILE, _memory_bughunt, "set", lobby_id, updates)
 
     @staticmethod
     async def delete_lobby(lobby_id):
@@ -998,9 +3395,12 @@ class BugHuntData:
                 await db["bughunt"].delete_one({"_id": lobby_id})
             except Exception:
                 pass
-        if lobby_id in _memory_bughunt:
+        if _sqlite is not None:
+            await _sqlite.delete("bughunt", lobby_id)
+        elif lobby_id in _memory_bughunt:
             del _memory_bughunt[lobby_id]
-            save_json(BUGHUNT_FILE, _memory_bughunt)
+            _lobby_indexes.drop(lobby_id)
+            journal_record(BUGHUNT_FILE, _memory_bughunt, "del", lobby_id)
 
     @staticmethod
     async def join_lobby(lobby_id, user_id, user_name):
@@ -1042,12 +3442,14 @@ class BugHuntData:
                     return lobbies
             except Exception:
                 pass
-        for l in _memory_bughunt.values():
-            if l.get("status") == "waiting":
-                if guild_id and l.get("guild_id") != guild_id:
-                    continue
-                lobbies.append(l)
-        return lobbies
+        if _sqlite is not None:
+            query = {"status": "waiting"}
+            if guild_id:
+                query["guild_id"] = guild_id
+            return await _sqlite.find("bughunt", query)
+        if guild_id:
+            return _lobby_indexes.find("status_guild", ("waiting", guild_id))
+        return _lobby_indexes.find("status", "waiting")
 
 
 class VouchData:
@@ -1072,7 +3474,10 @@ class VouchData:
             except Exception:
                 pass
 
-        record = _memory_vouches.get(key, {})
+        if _sqlite is not None:
+            record = await _sqlite.get("vouches", key) or {}
+        else:
+            record = _memory_vouches.get(key, {})
         last = record.get("last_vouch", "")
         if last:
             try:
@@ -1100,10 +3505,367 @@ class VouchData:
             try:
                 await db["vouches"].update_one(
                     {"_id": key},
-                    {"$set": record},
+                    {"$set": {**record, TTL_FIELD: datetime.utcnow()}},
                     upsert=True
                 )
             except Exception:
                 pass
+        if _sqlite is not None:
+            await _sqlite.insert("vouches", record)
+            return
         _memory_vouches[key] = record
-        save_json(VOUCH_FILE, _memory_vouches)
\ No newline at end of file
+        mark_dirty(VOUCH_FILE, _memory_vouches)
+
+# ===== TTL SWEEPER =====
+# Unfinished duels, abandoned bug hunt lobbies and spent vouch cooldowns are
+# only removed when a code path deletes them, so anything left behind by a
+# crash or restart used to stay forever. TTLSweeper periodically drops the
+# records older than their TTL_POLICIES entry, TTL_SWEEP_BATCH at a time,
+# from Mongo (documents written before the TTL index existed) and from the
+# local store, then compacts what backs the local store.
+def _ttl_local_collections():
+    """collection -> (file, in-memory dict, secondary indexes, journaled)"""
+    return {
+        "active_duels": (ACTIVE_DUELS_FILE, _memory_active_duels, _active_duel_indexes, False),
+        "bughunt": (BUGHUNT_FILE, _memory_bughunt, _lobby_indexes, True),
+        "vouches": (VOUCH_FILE, _memory_vouches, None, False),
+        "transactions": (TRANSACTIONS_FILE, _memory_transactions, _transaction_indexes, True),
+    }
+
+
+class TTLSweeper:
+    """Background task expiring stale records (see TTL_POLICIES)"""
+
+    def __init__(self, interval: float = TTL_SWEEP_INTERVAL, batch: int = TTL_SWEEP_BATCH):
+        self.interval = interval
+        self.batch = max(1, batch)
+        self._task = None
+        self.stats = {"sweeps": 0, "reclaimed": 0, "by_collection": {}, "last_sweep_ms": 0.0}
+
+    async def sweep(self, now: datetime = None):
+        """Expire everything past its TTL now; returns {collection: records removed}"""
+        start = time.perf_counter()
+        now = now or datetime.utcnow()
+        reclaimed = {}
+        for coll, (field, ttl) in TTL_POLICIES.items():
+            if ttl <= 0:
+                continue
+            cutoff = (now - timedelta(seconds=ttl)).isoformat()
+            remote = await self._sweep_mongo(coll, field, cutoff)
+            if _sqlite is not None:
+                local = await self._sweep_sqlite(coll, field, cutoff)
+            else:
+                local = await self._sweep_memory(coll, field, cutoff)
+            count = max(remote, local)  # the local store mirrors Mongo's records
+            if count:
+                reclaimed[coll] = count
+        if reclaimed and _sqlite is not None:
+            await _sqlite.checkpoint()
+
+        total = sum(reclaimed.values())
+        self.stats["sweeps"] += 1
+        self.stats["reclaimed"] += total
+        for coll, count in reclaimed.items():
+            self.stats["by_collection"][coll] = self.stats["by_collection"].get(coll, 0) + count
+        self.stats["last_sweep_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        if total:
+            print(f"🧹 Expired {total} stale records ("
+                  + ", ".join(f"{coll} {count}" for coll, count in reclaimed.items()) + ")")
+        return reclaimed
+
+    async def _sweep_mongo(self, coll, field, cutoff):
+        if db is None:
+            return 0
+        removed = 0
+        try:
+            while True:
+                docs = await db[coll].find({field: {"$lt": cutoff}}, {"_id": 1}).limit(self.batch).to_list(self.batch)
+                if not docs:
+                    break
+                result = await db[coll].delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+                removed += result.deleted_count
+                if len(docs) < self.batch:
+                    break
+        except Exception as e:
+            print(f"⚠️ TTL sweep of {coll} in MongoDB failed: {e}")
+        return removed
+
+    async def _sweep_sqlite(self, coll, field, cutoff):
+        removed = 0
+        while True:
+            count = await _sqlite.expire(coll, field, cutoff, self.batch)
+            removed += count
+            if count < self.batch:
+                return removed
+
+    async def _sweep_memory(self, coll, field, cutoff):
+        file_path, data, indexes, journaled = _ttl_local_collections()[coll]
+        expired = [key for key, doc in data.items()
+                   if doc.get(field) and str(doc.get(field)) < cutoff]
+        for i in range(0, len(expired), self.batch):
+            for key in expired[i:i + self.batch]:
+                data.pop(key, None)
+                if indexes is not None:
+                    indexes.drop(key)
+                if journaled:
+                    journal_record(file_path, data, "del", key, flush=False)
+            await asyncio.sleep(0)  # let the event loop breathe between batches
+        if not expired:
+            return 0
+        if journaled:
+            # Fold the deletes (and everything before them) into a fresh snapshot
+            flush_journals()
+            compact_journals(force=True, files=[file_path])
+        else:
+            mark_dirty(file_path, data)
+        return len(expired)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"⚠️ TTL sweep failed: {e}")
+
+    def start(self):
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+ttl_sweeper = TTLSweeper()
+
+
+# ===== MIGRATION RUNNER =====
+# Reads upgrade old user documents in memory but never write them back, so
+# interactive commands don't pay for migrations. MigrationRunner rewrites
+# them instead: it walks the users in _id order, MIGRATION_CHUNK at a time,
+# moves lists still embedded under a USER_LOGS name into their log, applies
+# USER_MIGRATIONS, and sleeps MIGRATION_PAUSE between chunks. The last _id
+# done is checkpointed after every chunk, so a restart resumes where the
+# previous run stopped; once every document is at USER_SCHEMA_VERSION the
+# run is recorded as done and later starts skip the scan. It runs in the
+# background after startup (MIGRATE_ON_STARTUP) or offline (migrate.py).
+MIGRATIONS_FILE = os.path.join(DATA_DIR, "migrations.json")
+_memory_migrations = _load_collection(MIGRATIONS_FILE)
+
+
+def _user_needs_migration(doc: dict):
+    return doc.get("schema_version", 1) < USER_SCHEMA_VERSION or any(f in doc for f in USER_LOGS)
+
+
+class MigrationRunner:
+    """Chunked, throttled, resumable rewrite of outdated user documents"""
+
+    def __init__(self, chunk: int = MIGRATION_CHUNK, pause: float = MIGRATION_PAUSE):
+        self.chunk = max(1, chunk)
+        self.pause = pause
+        self._task = None
+        self._local_ids = None
+        self.stats = {"runs": 0, "chunks": 0, "scanned": 0, "migrated": 0, "adopted": 0,
+                      "last_chunk_ms": 0.0, "done": False}
+
+    # ---------- checkpoint ----------
+    async def load_state(self):
+        if db is not None:
+            try:
+                return await db["migrations"].find_one({"_id": "users"}) or {}
+            except Exception:
+                pass
+        if _sqlite is not None:
+            return await _sqlite.get("migrations", "users") or {}
+        return dict(_memory_migrations.get("users", {}))
+
+    async def _save_state(self, state: dict):
+        state = {"_id": "users", **state, "updated_at": datetime.utcnow().isoformat()}
+        if db is not None:
+            try:
+                await db["migrations"].replace_one({"_id": "users"}, state, upsert=True)
+            except Exception:
+                pass
+        if _sqlite is not None:
+            await _sqlite.insert("migrations", state)
+        else:
+            _memory_migrations["users"] = state
+            mark_dirty(MIGRATIONS_FILE, _memory_migrations)
+
+    # ---------- reading ----------
+    async def _next_chunk(self, after):
+        """Up to `chunk` user documents with an _id above `after`"""
+        if db is not None:
+            try:
+                query = {"$or": [{"schema_version": {"$lt": USER_SCHEMA_VERSION}},
+                                 {"schema_version": {"$exists": False}}]
+                        + [{field: {"$exists": True}} for field in USER_LOGS]}
+                if after is not None:
+                    query = {"$and": [{"_id": {"$gt": after}}, query]}
+                return await db["users"].find(query).sort("_id", ASCENDING).limit(self.chunk).to_list(self.chunk)
+            except Exception:
+                pass
+        if _sqlite is not None:
+            return await _sqlite.scan("users", after, self.chunk)
+        if self._local_ids is None:
+            self._local_ids = sorted(_memory_users)  # users created later are already current
+        start = 0 if after is None else bisect_right(self._local_ids, after)
+        ids = self._local_ids[start:start + self.chunk]
+        return [dict(_memory_users[uid]) for uid in ids if uid in _memory_users]
+
+    # ---------- writing ----------
+    async def _migrate_chunk(self, docs):
+        # Logs first: the embedded copy is only dropped once its entries are in
+        async with db_batch() as batch:
+            for doc in docs:
+                for field, log in USER_LOGS.items():
+                    if field in doc:
+                        await log.import_legacy(doc["_id"], doc[field] or [])
+        if batch.failed:
+            raise RuntimeError("could not write the user logs")
+        async with db_batch():
+            for doc in docs:
+                legacy = [field for field in USER_LOGS if field in doc]
+                if legacy:
+                    await UserProfile.unset_fields(doc["_id"], legacy)
+                    self.stats["adopted"] += 1
+                    for field in legacy:
+                        doc.pop(field)
+                loaded = dict(doc)
+                upgrade = _migrate_user_doc(doc)
+                if upgrade is None:
+                    continue
+                sets, unsets = upgrade
+                # Skipped if a command changed one of these fields meanwhile;
+                # the document is picked up again by the next run
+                expect = {field: loaded.get(field) for field in [*sets, *unsets] if field != "schema_version"}
+                await _write_user_fields(doc["_id"], sets, unsets, expect)
+                user_cache.invalidate(doc["_id"])
+                leaderboards.apply(doc["_id"], set={
+                    **{field: _user_default(field) if field in USER_DEFAULTS else None for field in unsets},
+                    **sets,
+                })
+                self.stats["migrated"] += 1
+
+    async def run(self, dry_run: bool = False, restart: bool = False):
+        """Migrate every outdated user document; returns how many need(ed) it
+
+        With `dry_run` nothing is written (not even the checkpoint).
+        `restart` ignores the checkpoint and scans from the first user.
+        """
+        state = {} if restart else await self.load_state()
+        if state.get("version") != USER_SCHEMA_VERSION:
+            state = {}
+        if state.get("done"):
+            self.stats["done"] = True
+            return 0
+        self.stats["runs"] += 1
+        after = state.get("last_id")
+        self._local_ids = None
+        pending_total = 0
+        start_run = time.perf_counter()
+        while True:
+            start = time.perf_counter()
+            docs = await self._next_chunk(after)
+            if not docs:
+                break
+            pending = [doc for doc in docs if _user_needs_migration(doc)]
+            pending_total += len(pending)
+            if pending and not dry_run:
+                await self._migrate_chunk(pending)
+            after = docs[-1]["_id"]
+            self.stats["chunks"] += 1
+            self.stats["scanned"] += len(docs)
+            self.stats["last_chunk_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            if not dry_run:
+                await self._save_state({"version": USER_SCHEMA_VERSION, "last_id": after, "done": False})
+            await asyncio.sleep(self.pause)
+        if not dry_run:
+            await self._save_state({"version": USER_SCHEMA_VERSION, "last_id": None, "done": True})
+            self.stats["done"] = True
+        if pending_total:
+            verb = "need" if dry_run else "migrated to"
+            print(f"✓ {pending_total} user documents {verb} schema v{USER_SCHEMA_VERSION} "
+                  f"({time.perf_counter() - start_run:.1f}s)")
+        return pending_total
+
+    async def _run(self):
+        try:
+            await self.run()
+        except Exception as e:
+            print(f"⚠️ User migration stopped (resumes on next start): {e}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+migration_runner = MigrationRunner()
+
+# ===== SERVER STATS =====
+class StatsData:
+    """Totals behind /stats (users come from the running aggregates)"""
+
+    @staticmethod
+    async def _collection_counts():
+        if db is not None:
+            try:
+                return {
+                    "teams": await db["teams"].estimated_document_count(),
+                    "listings": await db["marketplace"].estimated_document_count(),
+                    "active_listings": await db["marketplace"].count_documents({"status": "active"}),
+                }
+            except Exception:
+                pass
+        if _sqlite is not None:
+            return {
+                "teams": await _sqlite.count("teams"),
+                "listings": await _sqlite.count("marketplace"),
+                "active_listings": await _sqlite.count("marketplace", {"status": "active"}),
+            }
+        return {
+            "teams": len(_memory_teams),
+            "listings": len(_memory_marketplace),
+            "active_listings": len(_listing_indexes.keys("status", "active")),
+        }
+
+    @staticmethod
+    async def get_stats(delta_seconds: float = 86400):
+        """Current totals plus how the user totals moved over `delta_seconds`
+
+        Keys: users, credits, pcredits, levels, avg_level, messages, voice,
+        roles, ranks, teams, listings, active_listings and delta (None until
+        there is history to compare with).
+        """
+        await leaderboards.ensure_built()
+        stats = user_aggregates.snapshot()
+        stats.update(await StatsData._collection_counts())
+        stats["delta"] = user_aggregates.delta(delta_seconds)
+        return stats
+
+    @staticmethod
+    async def rebuild():
+        """Recompute the user aggregates from every stored user
+
+        Returns what had drifted ({total: (kept, recomputed)}); empty means
+        the running totals were exact.
+        """
+        drift = await leaderboards.rebuild()
+        if drift:
+            print(f"⚠️ /stats aggregates drifted, rebuilt: {', '.join(drift)}")
+        return drift
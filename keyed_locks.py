@@ -0,0 +1,132 @@
+"""Per-key asyncio locks shared by the cogs
+
+Mutations that read a user's state and write it back later (daily claims,
+purchases, trades, duel payouts, agent mode turns) serialize on a lock for
+that key, so two clicks or two commands from the same member can't
+interleave, while different members never wait on each other.
+
+Keys are grouped in families ("user", "agent", "trivia"...): the lock for
+("user", 42) is unrelated to ("agent", 42). A lock only exists while
+somebody holds or waits for it and is dropped on release, so the table
+never grows past the number of keys in use. Several keys of one family are
+always taken in sorted order, which rules out deadlocks between two
+callers locking the same pair the other way round.
+
+    async with locks.lock("user", buyer_id):
+        ...
+    async with locks.lock("user", user1_id, user2_id):
+        ...
+
+Contention and wait time are counted per family (see info()).
+"""
+import asyncio
+import time
+
+
+class _Entry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0  # holders + waiters; the entry is dropped at 0
+
+
+def _sort_key(key):
+    return (type(key).__name__, key)
+
+
+class _Acquisition:
+    """Async context manager returned by KeyedLocks.lock()"""
+
+    def __init__(self, owner, family, keys):
+        self._owner = owner
+        self._family = family
+        self._keys = keys
+        self._held = []
+
+    async def __aenter__(self):
+        try:
+            for key in self._keys:
+                await self._owner._acquire(self._family, key)
+                self._held.append(key)
+        except BaseException:
+            await self.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        while self._held:
+            self._owner._release(self._family, self._held.pop())
+
+
+class KeyedLocks:
+    """{(family, key): lock}, created on demand and evicted when idle"""
+
+    def __init__(self):
+        self._entries = {}
+        self.stats = {}
+
+    def _family_stats(self, family):
+        stats = self.stats.get(family)
+        if stats is None:
+            stats = self.stats[family] = {
+                "acquired": 0, "contended": 0, "wait_seconds": 0.0,
+                "max_wait_ms": 0.0, "evicted": 0,
+            }
+        return stats
+
+    def lock(self, family: str, *keys):
+        """Lock one or more keys of `family` (taken in sorted order)"""
+        if not keys:
+            raise ValueError("lock() needs at least one key")
+        return _Acquisition(self, family, sorted(set(keys), key=_sort_key))
+
+    def locked(self, family: str, key):
+        """True while someone holds (or waits for) this key"""
+        return (family, key) in self._entries
+
+    async def _acquire(self, family, key):
+        stats = self._family_stats(family)
+        entry = self._entries.get((family, key))
+        if entry is None:
+            entry = self._entries[(family, key)] = _Entry()
+        entry.users += 1
+        if not entry.lock.locked():
+            await entry.lock.acquire()  # free: returns without yielding
+            stats["acquired"] += 1
+            return
+        stats["contended"] += 1
+        start = time.perf_counter()
+        try:
+            await entry.lock.acquire()
+        except BaseException:
+            self._drop(family, key, entry)
+            raise
+        waited = time.perf_counter() - start
+        stats["acquired"] += 1
+        stats["wait_seconds"] += waited
+        stats["max_wait_ms"] = max(stats["max_wait_ms"], round(waited * 1000, 2))
+
+    def _release(self, family, key):
+        entry = self._entries[(family, key)]
+        entry.lock.release()
+        self._drop(family, key, entry)
+
+    def _drop(self, family, key, entry):
+        entry.users -= 1
+        if entry.users == 0:
+            del self._entries[(family, key)]
+            self.stats[family]["evicted"] += 1
+
+    def info(self):
+        active = {}
+        for family, _ in self._entries:
+            active[family] = active.get(family, 0) + 1
+        return {
+            family: {**stats, "wait_seconds": round(stats["wait_seconds"], 3),
+                     "active": active.get(family, 0)}
+            for family, stats in self.stats.items()
+        }
+
+
+locks = KeyedLocks()
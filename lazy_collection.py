@@ -0,0 +1,91 @@
+"""Collections that are read from disk the first time they are touched
+
+database.py used to parse every JSON data file at import time, so every
+cog import, script and tool paid for all of them. A LazyCollection is a
+dict-like stand-in that runs its loader on first access instead (or
+earlier, when the bot preloads everything in an executor during startup).
+Loading is guarded by a lock, so a preload thread and the event loop
+never parse the same file twice.
+"""
+import threading
+import time
+from collections.abc import MutableMapping
+
+
+class LazyCollection(MutableMapping):
+    """{key: document}, loaded by `loader()` on first use"""
+
+    def __init__(self, name: str, loader):
+        self.name = name
+        self._loader = loader
+        self._data = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    def load(self):
+        """Run the loader (once) and return the underlying dict"""
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    start = time.perf_counter()
+                    data = self._loader()
+                    self.load_seconds = time.perf_counter() - start
+                    self._data = data
+        return self._data
+
+    @property
+    def data(self):
+        data = self._data
+        return data if data is not None else self.load()
+
+    # ---------- mapping protocol (delegates to the loaded dict) ----------
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        del self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def keys(self):
+        return self.data.keys()
+
+    def values(self):
+        return self.data.values()
+
+    def items(self):
+        return self.data.items()
+
+    def pop(self, key, *default):
+        return self.data.pop(key, *default)
+
+    def setdefault(self, key, default=None):
+        return self.data.setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self.data.update(*args, **kwargs)
+
+    def clear(self):
+        self.data.clear()
+
+    def __repr__(self):
+        if self._data is None:
+            return f"LazyCollection({self.name!r}, not loaded)"
+        return f"LazyCollection({self.name!r}, {len(self._data)} documents)"
@@ -0,0 +1,103 @@
+"""Secondary hash indexes for the in-memory collections in database.py
+
+Each index maps a lookup key (an invite code, a seller id, a guild + status
+pair...) to the primary keys of the documents carrying it, so the local
+fallback store answers those lookups without scanning the collection. The
+collection dict stays the source of truth: database.py calls put() after
+every create/update and drop() after every delete, and put() re-derives a
+document's keys, so in-place edits (appending to `members`, flipping a
+`status`) are picked up as long as put() follows them.
+
+Indexes are built on first use, so creating them does not force a lazily
+loaded collection off the disk.
+"""
+
+
+class HashIndex:
+    """lookup key -> {primary key: None} (insertion ordered)"""
+
+    def __init__(self, key_fn):
+        # key_fn(doc) -> iterable of lookup keys (None entries are skipped)
+        self.key_fn = key_fn
+        self.buckets = {}
+        self.keys_of = {}
+
+    def put(self, pk, doc):
+        keys = [k for k in self.key_fn(doc) if k is not None]
+        keys = list(dict.fromkeys(keys))
+        old = self.keys_of.get(pk, ())
+        if old == keys:
+            return
+        for key in old:
+            if key not in keys:
+                self._discard(key, pk)
+        for key in keys:
+            self.buckets.setdefault(key, {})[pk] = None
+        if keys:
+            self.keys_of[pk] = keys
+        else:
+            self.keys_of.pop(pk, None)
+
+    def drop(self, pk):
+        for key in self.keys_of.pop(pk, ()):
+            self._discard(key, pk)
+
+    def _discard(self, key, pk):
+        bucket = self.buckets.get(key)
+        if bucket is not None:
+            bucket.pop(pk, None)
+            if not bucket:
+                del self.buckets[key]
+
+    def get(self, key):
+        return list(self.buckets.get(key, ()))
+
+
+class CollectionIndexes:
+    """The secondary indexes of one in-memory collection"""
+
+    def __init__(self, data: dict, **key_fns):
+        self.data = data
+        self.indexes = {name: HashIndex(fn) for name, fn in key_fns.items()}
+        self.built = False
+
+    def rebuild(self):
+        for index in self.indexes.values():
+            index.buckets.clear()
+            index.keys_of.clear()
+        self.built = True
+        for pk, doc in self.data.items():
+            self.put(pk, doc)
+
+    def _index(self, name):
+        if not self.built:
+            self.rebuild()
+        return self.indexes[name]
+
+    def put(self, pk, doc):
+        if not self.built:
+            self.rebuild()  # picks up `doc` from the collection
+        for index in self.indexes.values():
+            index.put(pk, doc)
+
+    def drop(self, pk):
+        if not self.built:
+            self.rebuild()
+        for index in self.indexes.values():
+            index.drop(pk)
+
+    def keys(self, name, key):
+        return self._index(name).get(key)
+
+    def find(self, name, key):
+        """Documents whose `name` index contains `key`"""
+        return [self.data[pk] for pk in self._index(name).get(key) if pk in self.data]
+
+    def find_one(self, name, key):
+        for pk in self._index(name).get(key):
+            if pk in self.data:
+                return self.data[pk]
+        return None
+
+    def exists(self, name, key):
+        return key in self._index(name).buckets
@@ -0,0 +1,37 @@
+"""Bring every stored user document up to the current schema, offline
+
+Run from the repository root while the bot is stopped (or alongside it;
+the runner only rewrites documents nobody changed in the meantime):
+
+    python migrate.py [--dry-run] [--restart]
+
+--dry-run only counts the documents that need migrating. --restart ignores
+the checkpoint left by an interrupted run and scans from the first user.
+MIGRATION_CHUNK / MIGRATION_PAUSE (see config.py) size and pace the chunks.
+"""
+import asyncio
+import sys
+
+from database import USER_SCHEMA_VERSION, migration_runner, shutdown_storage
+
+
+async def main():
+    dry_run = "--dry-run" in sys.argv
+    if dry_run:
+        migration_runner.pause = 0
+    try:
+        count = await migration_runner.run(dry_run=dry_run, restart="--restart" in sys.argv or dry_run)
+    finally:
+        await shutdown_storage()
+    stats = migration_runner.stats
+    if dry_run:
+        print(f"{count} of {stats['scanned']} user documents need schema v{USER_SCHEMA_VERSION}")
+    elif stats["done"] and not stats["runs"]:
+        print(f"Already at schema v{USER_SCHEMA_VERSION}, nothing to do")
+    else:
+        print(f"Migrated {stats['migrated']} user documents ({stats['adopted']} embedded logs moved), "
+              f"{stats['scanned']} scanned in {stats['chunks']} chunks")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,147 @@
+"""Tokenized inverted index with prefix matching and BM25 ranking
+
+Used by database.py for marketplace search. Documents are small dicts of
+text fields; each field can carry a weight (a title hit counts more than a
+description hit). Every query token must match (exactly, or as a prefix of
+an indexed term), and results come back ranked by BM25.
+"""
+import math
+import re
+from bisect import bisect_left, insort
+
+# Runs of Unicode letters/digits ("Система", "café", "v2"); "_" separates like punctuation
+TOKEN_RE = re.compile(r"[^\W_]+")
+
+# Score multiplier for a term that only matched as a prefix ("sword" -> "swords")
+PREFIX_WEIGHT = 0.6
+# Query tokens shorter than this only match exactly (a prefix of "a" would hit everything)
+MIN_PREFIX_LEN = 2
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text or "").casefold())
+
+
+class InvertedIndex:
+    """term -> {doc_id: weighted term frequency}"""
+
+    def __init__(self, weights: dict, k1: float = 1.2, b: float = 0.75):
+        self.weights = weights
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.terms = []  # sorted vocabulary, for prefix lookups
+        self.doc_terms = {}
+        self.doc_len = {}
+        self.total_len = 0
+        self.total_postings = 0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_len
+
+    def add(self, doc_id, doc: dict):
+        """Index (or re-index) one document"""
+        self.remove(doc_id)
+        tf = {}
+        for field, weight in self.weights.items():
+            for token in tokenize(doc.get(field)):
+                tf[token] = tf.get(token, 0) + weight
+        for term, freq in tf.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                insort(self.terms, term)
+            posting[doc_id] = freq
+        length = sum(tf.values())
+        self.doc_terms[doc_id] = tf
+        self.total_postings += len(tf)
+        self.doc_len[doc_id] = length
+        self.total_len += length
+
+    def remove(self, doc_id):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self.total_len -= self.doc_len.pop(doc_id)
+        self.total_postings -= len(terms)
+        for term in terms:
+            posting = self.postings[term]
+            del posting[doc_id]
+            if not posting:
+                del self.postings[term]
+                del self.terms[bisect_left(self.terms, term)]
+
+    def _expand(self, token):
+        """{indexed term: weight} for the terms a query token matches"""
+        matches = {}
+        if token in self.postings:
+            matches[token] = 1.0
+        if len(token) >= MIN_PREFIX_LEN:
+            i = bisect_left(self.terms, token)
+            while i < len(self.terms) and self.terms[i].startswith(token):
+                matches.setdefault(self.terms[i], PREFIX_WEIGHT)
+                i += 1
+        return matches
+
+    def _token_scores(self, matches, n, avg_len, candidates=None):
+        """{doc_id: best BM25 score among `matches`}
+
+        With `candidates`, only those documents are scored (by checking their
+        own terms) instead of walking every matching posting list.
+        """
+        k1, b = self.k1, self.b
+        idf = {}
+        for term in matches:
+            df = len(self.postings[term])
+            idf[term] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+        def bm25(term, doc_id, tf):
+            norm = k1 * (1 - b + b * self.doc_len[doc_id] / avg_len)
+            return matches[term] * idf[term] * tf * (k1 + 1) / (tf + norm)
+
+        scores = {}
+        if candidates is not None:
+            for doc_id in candidates:
+                for term, tf in self.doc_terms[doc_id].items():
+                    if term in matches:
+                        score = bm25(term, doc_id, tf)
+                        if score > scores.get(doc_id, 0):
+                            scores[doc_id] = score
+            return scores
+        for term in matches:
+            for doc_id, tf in self.postings[term].items():
+                score = bm25(term, doc_id, tf)
+                if score > scores.get(doc_id, 0):
+                    scores[doc_id] = score
+        return scores
+
+    def search(self, query: str, limit: int = None):
+        """[(doc_id, score)] matching every token of `query`, best first"""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or not self.doc_len:
+            return []
+        n = len(self.doc_len)
+        avg_len = (self.total_len / n) or 1
+        # Cheapest token first; later tokens only need to score its matches
+        expanded = []
+        for token in tokens:
+            matches = self._expand(token)
+            if not matches:
+                return []
+            expanded.append((sum(len(self.postings[t]) for t in matches), matches))
+        expanded.sort(key=lambda item: item[0])
+        scores = self._token_scores(expanded[0][1], n, avg_len)
+        terms_per_doc = self.total_postings / n
+        for cost, matches in expanded[1:]:
+            if len(scores) * terms_per_doc < cost:
+                other = self._token_scores(matches, n, avg_len, candidates=scores)
+            else:
+                other = self._token_scores(matches, n, avg_len)
+            scores = {doc_id: s + other[doc_id] for doc_id, s in scores.items() if doc_id in other}
+            if not scores:
+                return []
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit] if limit else ranked
@@ -0,0 +1,166 @@
+"""Crash-safe data file writes on a dedicated thread
+
+Snapshots are written to "<file>.tmp", fsynced, and renamed over the
+original, so a crash mid-write can never leave a truncated data file. The
+previous snapshot is kept as "<file>.bak" (last known good) for
+database.load_json to fall back to.
+
+SnapshotWriter runs those writes, and the journal appends, on one
+background thread in FIFO order, so the event loop never waits on disk.
+Since there is a single writer, a journal truncate queued after a snapshot
+can never overtake an append queued before it. A snapshot for a file that
+is still waiting in the queue is replaced in place (latest bytes win).
+Compression, which releases the GIL, is done on the writer thread as well. The
+queue is bounded: when it is full, the caller blocks until there is room,
+and how often and how long that happens is counted in `stats`.
+"""
+import os
+import queue
+import threading
+import time
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    except OSError:
+        return  # e.g. Windows, where directories can't be opened
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path: str, raw: bytes, backup: bool = True):
+    """Replace `path` with `raw` via temp file + fsync + rename"""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    if backup and os.path.exists(path):
+        # A crash between these two renames leaves a complete .tmp behind,
+        # which load_json tries before the .bak
+        os.replace(path, path + ".bak")
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+
+def append_durable(path: str, raw: bytes):
+    with open(path, "ab") as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class SnapshotWriter:
+    """Single background thread for snapshot writes and journal appends"""
+
+    def __init__(self, max_queue: int = 64):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}  # path -> [raw, journal to truncate or None, compress or None]
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {
+            "snapshots": 0, "appends": 0, "bytes": 0, "coalesced": 0,
+            "blocked": 0, "blocked_seconds": 0.0, "max_depth": 0,
+            "errors": 0, "last_write_ms": 0.0, "last_error": None,
+        }
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.running:
+            self._thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Write out everything queued, then stop the thread (blocking)"""
+        if self.running:
+            self._put(None)
+            self._thread.join()
+        self._thread = None
+
+    def drain(self):
+        """Block until every queued write has been done"""
+        if self.running:
+            self._queue.join()
+
+    # ---------- producers ----------
+    def write_snapshot(self, path: str, raw: bytes, truncate_journal: str = None, compress=None):
+        """Queue `raw` as the new contents of `path`
+
+        With `truncate_journal`, that journal is emptied once the snapshot
+        is safely on disk (journal compaction). `compress` (bytes -> bytes)
+        is applied to `raw` on the writer thread.
+        """
+        with self._lock:
+            pending = self._pending.get(path)
+            if pending is not None:
+                pending[0] = raw
+                pending[1] = pending[1] or truncate_journal
+                pending[2] = compress
+                self.stats["coalesced"] += 1
+                return
+            self._pending[path] = [raw, truncate_journal, compress]
+        self._put(("snapshot", path, None))
+
+    def append(self, path: str, raw: bytes):
+        self._put(("append", path, raw))
+
+    def is_pending(self, path: str):
+        with self._lock:
+            return path in self._pending
+
+    def _put(self, job):
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            # Back-pressure: the disk is behind, make the producer wait
+            start = time.perf_counter()
+            self._queue.put(job)
+            self.stats["blocked"] += 1
+            self.stats["blocked_seconds"] += time.perf_counter() - start
+        depth = self._queue.qsize()
+        if depth > self.stats["max_depth"]:
+            self.stats["max_depth"] = depth
+
+    # ---------- writer thread ----------
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._do(*job)
+            finally:
+                self._queue.task_done()
+
+    def _do(self, kind, path, raw):
+        start = time.perf_counter()
+        try:
+            if kind == "snapshot":
+                with self._lock:
+                    raw, journal, compress = self._pending.pop(path)
+                if compress is not None:
+                    raw = compress(raw)
+                write_atomic(path, raw)
+                self.stats["snapshots"] += 1
+                if journal:
+                    open(journal, "wb").close()
+            else:
+                append_durable(path, raw)
+                self.stats["appends"] += 1
+            self.stats["bytes"] += len(raw)
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.stats["last_error"] = f"{path}: {e}"
+            print(f"Error writing {path}: {e}")
+        self.stats["last_write_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+    def info(self):
+        return {**self.stats, "queued": self._queue.qsize(), "running": self.running}
@@ -0,0 +1,492 @@
+"""SQLite storage backend for database.py
+
+Used instead of the in-memory dicts + JSON files when STORAGE_BACKEND is
+"sqlite". Every collection is a table holding the full document as JSON plus
+a handful of "hot" fields copied into real, indexed columns so lookups,
+filters and sorts never need a full scan. All SQL runs on a single worker
+thread so the event loop never blocks on disk.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# collection -> (key column type, {hot column: SQL type})
+SCHEMA = {
+    "users": ("INTEGER", {
+        "username": "TEXT",
+        "xp": "INTEGER",
+        "level": "INTEGER",
+        "reputation": "INTEGER",
+        "studio_credits": "INTEGER",
+        "pcredits": "INTEGER",
+        "ai_credits": "INTEGER",
+        "message_count": "INTEGER",
+        "voice_minutes": "INTEGER",
+        "duel_wins": "INTEGER",
+        "duel_losses": "INTEGER",
+    }),
+    "teams": ("TEXT", {
+        "creator_id": "INTEGER",
+        "private": "INTEGER",
+        "invite_code": "TEXT",
+        "category_id": "INTEGER",
+    }),
+    "marketplace": ("TEXT", {
+        "listing_id": "TEXT",
+        "seller_id": "INTEGER",
+        "status": "TEXT",
+        "category": "TEXT",
+        "price": "REAL",
+        "rating": "REAL",
+        "sold": "INTEGER",
+        "created_at": "TEXT",
+    }),
+    "transactions": ("TEXT", {
+        "buyer_id": "INTEGER",
+        "seller_id": "INTEGER",
+        "created_at": "TEXT",
+    }),
+    "duels": ("TEXT", {
+        "winner_id": "INTEGER",
+        "loser_id": "INTEGER",
+        "created_at": "TEXT",
+    }),
+    "duel_config": ("TEXT", {}),
+    "active_duels": ("TEXT", {
+        "guild_id": "INTEGER",
+        "status": "TEXT",
+        "created_at": "TEXT",
+    }),
+    "bughunt": ("TEXT", {
+        "guild_id": "INTEGER",
+        "status": "TEXT",
+        "created_at": "TEXT",
+    }),
+    "vouches": ("TEXT", {
+        "voucher_id": "INTEGER",
+        "target_id": "INTEGER",
+    }),
+    "migrations": ("TEXT", {}),
+}
+
+INDEXES = [
+    ("users", ["level"]),
+    ("users", ["xp"]),
+    ("users", ["duel_wins"]),
+    ("teams", ["invite_code"]),
+    ("teams", ["private"]),
+    ("teams", ["category_id"]),
+    ("marketplace", ["listing_id"]),
+    ("marketplace", ["seller_id"]),
+    ("marketplace", ["status", "category"]),
+    ("marketplace", ["status", "created_at", "id"]),
+    ("marketplace", ["status", "category", "created_at", "id"]),
+    ("marketplace", ["status", "price", "id"]),
+    ("marketplace", ["status", "category", "price", "id"]),
+    ("marketplace", ["status", "rating", "id"]),
+    ("marketplace", ["status", "category", "rating", "id"]),
+    ("marketplace", ["status", "sold", "id"]),
+    ("marketplace", ["status", "category", "sold", "id"]),
+    ("transactions", ["buyer_id"]),
+    ("transactions", ["seller_id"]),
+    ("duels", ["winner_id", "loser_id"]),
+    ("duels", ["loser_id", "winner_id"]),
+    ("active_duels", ["status", "guild_id"]),
+    ("bughunt", ["status", "guild_id"]),
+]
+
+
+def _encode(doc):
+    return json.dumps(doc, separators=(",", ":"), default=str)
+
+
+def _column_value(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float, str)) or value is None:
+        return value
+    return str(value)
+
+
+class SQLiteStore:
+    """Document store on top of one SQLite file (WAL mode)"""
+
+    def __init__(self, path: str, seed=None):
+        """`seed` is an optional callable returning {collection: {key: doc}}
+        that is imported once when the database is first created.
+
+        Nothing is opened here: the file is created, migrated and seeded on
+        the worker thread by open() or the first query."""
+        self.path = path
+        self._seed = seed
+        self._conn = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-store")
+
+    # ---------- plumbing ----------
+    def _connect(self):
+        if self._conn is not None:
+            return self._conn
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        fresh = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='users'"
+        ).fetchone() is None
+        for coll, (key_type, columns) in SCHEMA.items():
+            cols = "".join(f", {name} {sql_type}" for name, sql_type in columns.items())
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {coll} (id {key_type} PRIMARY KEY{cols}, doc TEXT NOT NULL)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS team_members (team_id TEXT NOT NULL, user_id INTEGER NOT NULL, "
+            "PRIMARY KEY (team_id, user_id))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_team_members_user ON team_members (user_id)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_logs (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "log TEXT NOT NULL, user_id INTEGER NOT NULL, entry TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_user_logs_user ON user_logs (log, user_id, seq)")
+        for coll, fields in INDEXES:
+            name = f"idx_{coll}_{'_'.join(fields)}"
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {coll} ({', '.join(fields)})")
+        conn.commit()
+        self._conn = conn
+        if fresh and self._seed is not None:
+            seeded = self._seed() or {}
+            for coll, docs in seeded.items():
+                for key, doc in docs.items():
+                    self._put(coll, key, doc)
+            conn.commit()
+            print(f"✓ Imported JSON data into {self.path}")
+        return conn
+
+    async def open(self):
+        """Connect (creating and seeding the database if needed) ahead of the first query"""
+        await self._run(lambda: None)
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn, args)
+
+    def _call(self, fn, args):
+        with self._lock:
+            self._connect()
+            result = fn(*args)
+            self._conn.commit()
+            return result
+
+    def _put(self, coll, key, doc):
+        columns = SCHEMA[coll][1]
+        names = ["id"] + list(columns) + ["doc"]
+        values = [key] + [_column_value(doc.get(c)) for c in columns] + [_encode(doc)]
+        if coll == "marketplace" and values[1] is not None:
+            values[1] = str(values[1]).upper()
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO {coll} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+            values,
+        )
+        if coll == "teams":
+            self._conn.execute("DELETE FROM team_members WHERE team_id = ?", (key,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO team_members (team_id, user_id) VALUES (?, ?)",
+                [(key, m) for m in doc.get("members", [])],
+            )
+
+    def _get(self, coll, key):
+        row = self._conn.execute(f"SELECT doc FROM {coll} WHERE id = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _where(self, where):
+        if not where:
+            return "", []
+        clauses, params = [], []
+        for field, value in where.items():
+            if value is None:
+                clauses.append(f"{field} IS NULL")
+            else:
+                clauses.append(f"{field} = ?")
+                params.append(_column_value(value))
+        return " WHERE " + " AND ".join(clauses), params
+
+    def _select(self, coll, where=None, order_by=None, limit=None, offset=0, extra_sql="", extra_params=()):
+        sql, params = self._where(where)
+        if extra_sql:
+            sql += (" AND " if sql else " WHERE ") + extra_sql
+            params += list(extra_params)
+        query = f"SELECT doc FROM {coll}{sql}"
+        if order_by:
+            query += " ORDER BY " + ", ".join(f"{f} {'DESC' if desc else 'ASC'}" for f, desc in order_by)
+        if limit is not None:
+            query += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        return [json.loads(r[0]) for r in self._conn.execute(query, params)]
+
+    # ---------- generic document API ----------
+    async def get(self, coll, key):
+        return await self._run(self._get, coll, key)
+
+    async def insert(self, coll, doc, key=None):
+        key = doc.get("_id") if key is None else key
+        await self._run(self._put, coll, key, doc)
+        return doc
+
+    async def update(self, coll, key, updates: dict):
+        """Merge `updates` into the stored document; returns the new document"""
+        def _update():
+            doc = self._get(coll, key)
+            if doc is None:
+                return None
+            doc.update(updates)
+            self._put(coll, key, doc)
+            return doc
+        return await self._run(_update)
+
+    async def unset(self, coll, key, fields, updates=None, expect=None):
+        """Remove fields (and optionally $set `updates`) in one transaction;
+        returns the new document
+
+        With `expect` ({field: value}) nothing is written unless every
+        listed field still holds that value.
+        """
+        def _unset():
+            doc = self._get(coll, key)
+            if doc is None:
+                return None
+            if any(doc.get(f) != v for f, v in (expect or {}).items()):
+                return doc
+            for field in fields:
+                doc.pop(field, None)
+            doc.update(updates or {})
+            self._put(coll, key, doc)
+            return doc
+        return await self._run(_unset)
+
+    async def delete(self, coll, key):
+        def _delete():
+            self._conn.execute(f"DELETE FROM {coll} WHERE id = ?", (key,))
+            if coll == "teams":
+                self._conn.execute("DELETE FROM team_members WHERE team_id = ?", (key,))
+        await self._run(_delete)
+
+    async def expire(self, coll, field, cutoff, limit):
+        """Delete up to `limit` documents whose `field` sorts before `cutoff`
+        (ISO timestamps); returns how many were deleted"""
+        def _expire():
+            column = field if field in SCHEMA[coll][1] else f"json_extract(doc, '$.{field}')"
+            cursor = self._conn.execute(
+                f"DELETE FROM {coll} WHERE id IN (SELECT id FROM {coll} WHERE {column} < ? LIMIT ?)",
+                (cutoff, limit),
+            )
+            return cursor.rowcount
+        return await self._run(_expire)
+
+    async def checkpoint(self):
+        """Copy the WAL into the database file and truncate it"""
+        def _checkpoint():
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        await self._run(_checkpoint)
+
+    async def find(self, coll, where=None, order_by=None, limit=None, offset=0):
+        """Filter on hot columns (equality only) with optional ordering/paging
+
+        `order_by` is a list of (column, descending) pairs.
+        """
+        return await self._run(self._select, coll, where, order_by, limit, offset)
+
+    async def scan(self, coll, after=None, limit=100):
+        """The next `limit` documents in key order, starting after key `after`"""
+        def _scan():
+            if after is None:
+                rows = self._conn.execute(f"SELECT doc FROM {coll} ORDER BY id LIMIT ?", (limit,))
+            else:
+                rows = self._conn.execute(f"SELECT doc FROM {coll} WHERE id > ? ORDER BY id LIMIT ?", (after, limit))
+            return [json.loads(r[0]) for r in rows]
+        return await self._run(_scan)
+
+    async def find_one(self, coll, where):
+        rows = await self.find(coll, where, limit=1)
+        return rows[0] if rows else None
+
+    async def count(self, coll, where=None):
+        def _count():
+            sql, params = self._where(where)
+            return self._conn.execute(f"SELECT COUNT(*) FROM {coll}{sql}", params).fetchone()[0]
+        return await self._run(_count)
+
+    # ---------- collection specific queries ----------
+    async def get_user_teams(self, user_id):
+        def _query():
+            rows = self._conn.execute(
+                "SELECT t.doc FROM teams t JOIN team_members m ON m.team_id = t.id WHERE m.user_id = ?",
+                (user_id,),
+            )
+            return [json.loads(r[0]) for r in rows]
+        return await self._run(_query)
+
+    async def get_user_transactions(self, user_id, limit=50):
+        def _query():
+            rows = self._conn.execute(
+                "SELECT doc FROM transactions WHERE buyer_id = ? "
+                "UNION ALL SELECT doc FROM transactions WHERE seller_id = ? AND buyer_id IS NOT ? "
+                "LIMIT ?",
+                (user_id, user_id, user_id, limit),
+            )
+            return [json.loads(r[0]) for r in rows]
+        return await self._run(_query)
+
+    async def search_listings(self, category=None, search=None, order_by=None, limit=None, offset=0,
+                              after=None, count=True):
+        """Active listings with optional category + substring search; returns (rows, total)
+
+        `after` is a keyset cursor: the `order_by` column values of the last
+        row already shown (every column must sort the same direction), so the
+        next page starts there instead of skipping `offset` rows. With
+        count=False the total is not computed (returned as None).
+        """
+        def _query():
+            where = {"status": "active"}
+            if category:
+                where["category"] = category
+            clauses, extra_params = [], []
+            if search:
+                like = f"%{search.lower()}%"
+                clauses.append("(lower(json_extract(doc, '$.title')) LIKE ? OR lower(json_extract(doc, '$.description')) LIKE ?)")
+                extra_params += [like, like]
+            extra_sql = " AND ".join(clauses)
+            total = None
+            if count:
+                sql, params = self._where(where)
+                if extra_sql:
+                    sql += " AND " + extra_sql
+                total = self._conn.execute(f"SELECT COUNT(*) FROM marketplace{sql}", params + extra_params).fetchone()[0]
+            if after is not None and order_by:
+                columns = ", ".join(column for column, _ in order_by)
+                marks = ", ".join("?" * len(order_by))
+                clauses.append(f"({columns}) {'<' if order_by[0][1] else '>'} ({marks})")
+                extra_params += [_column_value(v) for v in after]
+                extra_sql = " AND ".join(clauses)
+                skip = 0
+            else:
+                skip = offset
+            rows = self._select("marketplace", where, order_by, limit, skip, extra_sql, extra_params)
+            return rows, total
+        return await self._run(_query)
+
+    async def increment(self, coll, key, inc, set=None, floors=None, max=None, before=False):
+        """Atomic $inc/$set/$max on one document (read + write in one transaction)
+
+        Returns the new document (the old one with before=True), or None if
+        it doesn't exist or a field would drop below its entry in `floors`.
+        """
+        def _inc():
+            doc = self._get(coll, key)
+            if doc is None:
+                return None
+            for field, minimum in (floors or {}).items():
+                if doc.get(field, 0) + inc.get(field, 0) < minimum:
+                    return None
+            old = dict(doc)
+            for field, delta in inc.items():
+                doc[field] = doc.get(field, 0) + delta
+            if set:
+                doc.update(set)
+            for field, value in (max or {}).items():
+                if doc.get(field) is None or value > doc[field]:
+                    doc[field] = value
+            self._put(coll, key, doc)
+            return old if before else doc
+        return await self._run(_inc)
+
+    async def bulk_increment(self, coll, ops):
+        """{key: (inc, max)} applied in a single transaction; returns {key: new doc}"""
+        def _bulk():
+            docs = {}
+            for key, (inc, max_fields) in ops.items():
+                doc = self._get(coll, key)
+                if doc is None:
+                    continue
+                for field, delta in (inc or {}).items():
+                    doc[field] = doc.get(field, 0) + delta
+                for field, value in (max_fields or {}).items():
+                    if doc.get(field) is None or value > doc[field]:
+                        doc[field] = value
+                self._put(coll, key, doc)
+                docs[key] = doc
+            return docs
+        return await self._run(_bulk)
+
+    async def ledger_apply(self, deltas, tx):
+        """Apply {user_id: {field: delta}} and insert the ledger entry `tx`
+        in a single transaction
+
+        Every balance is checked before anything is written: returns
+        {user_id: new doc}, or None (nothing written) if a user is missing
+        or a decremented field would drop below zero.
+        """
+        def _apply():
+            docs = {}
+            for key, inc in deltas.items():
+                doc = self._get("users", key)
+                if doc is None:
+                    return None
+                if any(doc.get(field, 0) + delta < 0 for field, delta in inc.items() if delta < 0):
+                    return None
+                docs[key] = doc
+            for key, inc in deltas.items():
+                doc = docs[key]
+                for field, delta in inc.items():
+                    doc[field] = doc.get(field, 0) + delta
+                self._put("users", key, doc)
+            self._put("transactions", tx["transaction_id"], tx)
+            return docs
+        return await self._run(_apply)
+
+    # ---------- capped per-user logs ----------
+    async def log_append(self, log, user_id, entries, cap, prepend=False):
+        """Add entries to a user's log, keeping only the newest `cap`
+
+        With prepend=True the entries are treated as older than everything
+        already stored (used when importing legacy history).
+        """
+        def _append():
+            rows = list(entries)
+            if prepend:
+                # Re-insert what is already stored after the imported entries
+                existing = self._conn.execute(
+                    "SELECT entry FROM user_logs WHERE log = ? AND user_id = ? ORDER BY seq", (log, user_id)
+                ).fetchall()
+                self._conn.execute("DELETE FROM user_logs WHERE log = ? AND user_id = ?", (log, user_id))
+                rows += [json.loads(r[0]) for r in existing]
+            self._conn.executemany(
+                "INSERT INTO user_logs (log, user_id, entry) VALUES (?, ?, ?)",
+                [(log, user_id, _encode(e)) for e in rows],
+            )
+            self._conn.execute(
+                "DELETE FROM user_logs WHERE log = ? AND user_id = ? AND seq <= ("
+                "SELECT seq FROM user_logs WHERE log = ? AND user_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                (log, user_id, log, user_id, cap),
+            )
+        await self._run(_append)
+
+    async def log_read(self, log, user_id, limit=None):
+        """A user's log entries, oldest first (the newest `limit` if given)"""
+        def _read():
+            rows = self._conn.execute(
+                "SELECT entry FROM user_logs WHERE log = ? AND user_id = ? ORDER BY seq DESC LIMIT ?",
+                (log, user_id, -1 if limit is None else limit),
+            ).fetchall()
+            return [json.loads(r[0]) for r in reversed(rows)]
+        return await self._run(_read)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._executor.shutdown(wait=True)